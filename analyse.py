@@ -1,13 +1,151 @@
-"""This module contains functions to analyze the data in the database."""
+"""This module contains functions to analyze the data in the database.
 
+Every function takes a database connection from get_db, or a store.CheckOffStore with the check-offs of all habits
+loaded into memory, as its db argument.
+"""
+
+import importlib.util
 from datetime import timedelta, date, datetime
-from db import (get_primary_key, get_date_list, list_of_habits_daily, list_of_habits_weekly, search_start_date)
+from db import (get_habit_metadata, get_day_list, iter_completion_days, get_completion_day_range, to_epoch_day,
+                epoch_weekday, get_streak_state, rebuild_streak_state, get_longest_streaks, get_monthly_completions,
+                DEFAULT_USER_ID)
+from store import CheckOffStore
+
+# NumPy is optional. Without it the streak functions use the pure Python loops. It is imported on the first use of the
+# NumPy engine (see _numpy), so programs that never calculate a streak from the history do not pay for the import.
+np = None
+
+# The streak functions dispatch to the NumPy engine when this is True. (Set it to False to compare both engines.)
+USE_NUMPY = importlib.util.find_spec("numpy") is not None
+
+
+def _numpy():
+    """Import NumPy on first use and return the module."""
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+
+def _numpy_streaks(dates, step, day_of_week=None):
+    """Find the runs of check-off days with NumPy in one pass.
+
+    The days are loaded into an int32 array, sorted and made unique with np.unique, and every position where the gap
+    to the next day is not exactly `step` days ends a run (np.diff and np.flatnonzero).
+
+    parameters:
+        dates: Epoch days of the check-off dates in any order.
+        step(int): Days between two check-offs of a streak. (1 for daily habits, 7 for weekly habits)
+        day_of_week(int): If given, only check-offs on this day of the week (Monday is 0) are counted.
+
+    returns:
+        tuple: The longest run, the run ending at the most recent check-off and the most recent check-off day.
+               (0, 0, None) if there are no check-offs to count.
+    """
+    np = _numpy()
+    days = np.unique(np.asarray(dates, dtype=np.int32))
+    if day_of_week is not None:
+        days = days[(days + 3) % 7 == day_of_week]
+    if days.size == 0:
+        return 0, 0, None
+
+    run_ends = np.flatnonzero(np.diff(days) != step)
+    boundaries = np.concatenate(([-1], run_ends, [days.size - 1]))
+    run_lengths = np.diff(boundaries)
+    return int(run_lengths.max()), int(run_lengths[-1]), int(days[-1])
+
+
+def _python_streaks(dates, step, day_of_week=None):
+    """Find the runs of check-off days with a Python loop. Same parameters and result as _numpy_streaks."""
+    days = sorted(set(dates))
+    if day_of_week is not None:
+        days = [day for day in days if epoch_weekday(day) == day_of_week]
+    if not days:
+        return 0, 0, None
+
+    longest_run = current_run = 1
+    for previous_day, day in zip(days, days[1:]):
+        current_run = current_run + 1 if day - previous_day == step else 1
+        longest_run = max(longest_run, current_run)
+    return longest_run, current_run, days[-1]
+
+
+def _query(db, function, *args):
+    """Call a db.py query function, or the CheckOffStore method of the same name when the analysis runs on a store
+    (see store.CheckOffStore) instead of a database connection."""
+    if isinstance(db, CheckOffStore):
+        return getattr(db, function.__name__)(*args)
+    return function(db, *args)
+
+
+def _streak_state(db, habit_id, start_date=None):
+    """Get the streak summary of a habit from the habit_streak_state table.
+
+    The summary is kept up to date by add_habit_completion while check-offs arrive in order. If it is missing
+    (new habit, reset habit or a check-off added for an earlier date) it is rebuilt from the whole check-off history
+    and saved (see db.rebuild_streak_state), so the following lookups are a single row read again. On a read-only
+    connection it is rebuilt without being saved, and on a CheckOffStore it is calculated from the days of the store
+    every time.
+
+    parameters:
+        db: Database connection from get_db() function
+        habit_id(int): Primary key of the habit
+        start_date(str): Start date of a weekly habit. None for daily habits.
+
+    returns:
+        tuple: step, day_of_week, last_day, current_run and longest_run (see db.get_streak_state)
+    """
+    if start_date is None:
+        step, day_of_week = 1, None
+    else:
+        step, day_of_week = 7, datetime.strptime(start_date, "%Y-%m-%d").weekday()
 
+    streaks = _numpy_streaks if USE_NUMPY else _python_streaks
+    if isinstance(db, CheckOffStore):
+        longest_run, current_run, last_day = streaks(db.habit_days(habit_id), step, day_of_week)
+        return step, day_of_week, last_day, current_run, longest_run
 
-def calculate_longest_streak(db, name):
+    state = get_streak_state(db, habit_id)
+    if state is None or state[:2] != (step, day_of_week):
+        state = rebuild_streak_state(db, habit_id, step, day_of_week, streaks)
+    return state
+
+
+# Days in the first window read backwards by the current streak calculations. Every further window is twice as long.
+CURRENT_STREAK_WINDOW = 64
+
+
+def _iter_recent_days(db, habit_id, first_day, last_day):
+    """Read the completion days of a habit backwards from the most recent one in bounded windows.
+
+    The first window covers CURRENT_STREAK_WINDOW days and every further window is twice as long, each read with a range
+    query on the (habit_id, completion_day) index. A caller that stops at the first break of a streak therefore reads
+    a number of rows that depends on the streak length, not on how long the habit has existed.
+
+    parameters:
+        db: Database connection from get_db() function
+        habit_id(int): Primary key of the habit
+        first_day(int): Epoch day of the first check-off of the habit
+        last_day(int): Epoch day of the most recent check-off of the habit
+
+    yields:
+        int: Epoch days of the check-off dates, the most recent first.
+    """
+    window = CURRENT_STREAK_WINDOW
+    upper = last_day
+    while upper >= first_day:
+        lower = upper - window + 1
+        yield from _query(db, iter_completion_days, habit_id, lower, upper)
+        upper = lower - 1
+        window *= 2
+
+
+def calculate_longest_streak(db, name, user_id=DEFAULT_USER_ID):
     """Calculate the longest streak for daily habits.
 
-    dates = a list of check off dates for the habit searched via the habit_id (primary key)
+    dates = a list of check off days for the habit searched via the habit_id (primary key), as epoch days sorted
+    by SQLite with the most recent first
 
     If there are no dates for the habit, the function returns 0. If there are dates, the function proceeds to the
     calculation.
@@ -20,21 +158,24 @@ def calculate_longest_streak(db, name):
     parameters:
         db: Database connection from get_db() function
         name(str): Name of the habit used to search habit_id
+        user_id(int): Owner of the habit. Default is the default user.
 
     returns:
         int: The longest streak of the habit."""
 
-    habit_id = get_primary_key(db, name)
-    dates = get_date_list(db, habit_id)
+    habit_id = _query(db, get_habit_metadata, name, user_id)[0]
+    dates = _query(db, get_day_list, habit_id)
 
     if not dates:
         return 0
+    elif USE_NUMPY:
+        return _numpy_streaks(dates, 1)[0]
     else:
         longest_streak = 1
         current_reviewed_streak = 1
 
         for i in range(1, len(dates)):
-            if dates[i] == dates[i - 1] - timedelta(days=1):
+            if dates[i] == dates[i - 1] - 1:
                 current_reviewed_streak += 1
             elif dates[i] == dates[i - 1]:
                 continue
@@ -46,7 +187,7 @@ def calculate_longest_streak(db, name):
         return longest_streak
 
 
-def calculate_longest_streak_weekly(db, name, start_date):
+def calculate_longest_streak_weekly(db, name, start_date, user_id=DEFAULT_USER_ID):
     """Calculate the longest streak for weekly habits.
 
     dates = a list of check off dates for the habit searched via the habit_id (primary key)
@@ -61,12 +202,13 @@ def calculate_longest_streak_weekly(db, name, start_date):
     parameters:
         db: Database connection from get_db() function
         name(str): Name of the habit used to search habit_id
+        user_id(int): Owner of the habit. Default is the default user.
 
     returns:
         int: The longest streak of the habit."""
 
-    habit_id = get_primary_key(db, name)
-    dates = get_date_list(db, habit_id)
+    habit_id = _query(db, get_habit_metadata, name, user_id)[0]
+    dates = _query(db, get_day_list, habit_id)
 
     if not dates:
         return 0
@@ -74,7 +216,10 @@ def calculate_longest_streak_weekly(db, name, start_date):
         start_date = datetime.strptime(start_date, "%Y-%m-%d")
         day_of_week = start_date.weekday()
 
-        filtered_list = list(filter(lambda x: (x.weekday() == day_of_week), dates))
+        if USE_NUMPY:
+            return _numpy_streaks(dates, 7, day_of_week)[0]
+
+        filtered_list = [day for day in dates if epoch_weekday(day) == day_of_week]
 
         if not filtered_list:
             return 0
@@ -83,9 +228,11 @@ def calculate_longest_streak_weekly(db, name, start_date):
             longest_streak = 1
 
             for i in (range(1, len(filtered_list))):
-                if filtered_list[i] == filtered_list[i - 1] - timedelta(weeks=1):
+                if filtered_list[i] == filtered_list[i - 1] - 7:
                     current_reviewed_streak += 1
                     longest_streak = max(longest_streak, current_reviewed_streak)
+                elif filtered_list[i] == filtered_list[i - 1]:
+                    continue
                 else:
                     current_reviewed_streak = 1
 
@@ -93,269 +240,321 @@ def calculate_longest_streak_weekly(db, name, start_date):
             return longest_streak
 
 
-def get_longest_streak(db, name):
+def get_longest_streak(db, name, user_id=DEFAULT_USER_ID):
     """Get the longest streak of given habit regardless of frequency.
 
-    daily_list = a list of daily habits filtered from the database by frequency
-    weekly_list = a list of weekly habits filtered from the database by frequency
+    metadata = habit_id, frequency and start_date of the habit from one cached lookup (see db.get_habit_metadata)
 
-    Uses the functions calculate_longest_streak (daily) and calculate_longest_streak_weekly (weekly)
+    The longest streak is read from the streak summary in the habit_streak_state table, which is only rebuilt from
+    the check-off history when it is missing.
 
     parameters:
         db: Database connection from get_db() function
         name(str): Name of the habit used to search habit_id
+        user_id(int): Owner of the habit. Default is the default user.
 
     returns:
         str: The longest streak of the habit with designated unit (days or weeks)
     """
 
-    # Check the frequency of the habit
-    daily_list = [habit[0] for habit in list_of_habits_daily(db)]
-    weekly_list = [habit[0] for habit in list_of_habits_weekly(db)]
+    metadata = _query(db, get_habit_metadata, name, user_id)
+    if metadata is None:
+        return None
+    habit_id, frequency, start_date = metadata
 
-    if name in daily_list:
-        longest_streak = calculate_longest_streak(db, name)
+    # Check the frequency of the habit
+    if frequency == "Daily":
+        longest_streak = _streak_state(db, habit_id)[4]
         return f"{longest_streak} days"
 
-    if name in weekly_list:
-        start_date = search_start_date(db, name)
-        longest_streak = calculate_longest_streak_weekly(db, name, start_date)
+    if frequency == "Weekly":
+        longest_streak = _streak_state(db, habit_id, start_date)[4]
         return f"{longest_streak} weeks"
 
 
-def calculate_current_streak(db, name):
+def calculate_current_streak(db, name, user_id=DEFAULT_USER_ID):
     """Calculate the current streak of daily habits.
 
-    dates = a list of check off dates for the habit searched via the habit_id (primary key)
+    first_date, most_recent_date = the first and the most recent check off dates for the habit searched via the
+    habit_id (primary key), from two index lookups (see db.get_completion_day_range)
 
     If there are no dates for the habit, the function returns 0. If there are dates, the function proceeds to the
     calculation.
 
-    The current streak is only calculated if the date at index [0] is today's date. Then, it is calculated by looping
-    through the list of dates and counting the number of consecutive days until the streak breaks.
+    The current streak is only calculated if the most recent date is today's date. Then, the dates are read backwards
+    in bounded windows (see _iter_recent_days) and the consecutive days are counted until the streak breaks.
+    The dates older than the window with the first break are never read.
 
     parameters:
         db: Database connection from get_db() function
         name(str): Name of the habit used to search habit_id
+        user_id(int): Owner of the habit. Default is the default user.
 
     returns:
         int: The current streak of the habit.
     """
 
-    today = date.today()
+    today = to_epoch_day(date.today())
 
-    habit_id = get_primary_key(db, name)
-    dates = get_date_list(db, habit_id)
+    habit_id = _query(db, get_habit_metadata, name, user_id)[0]
+    first_date, most_recent_date = _query(db, get_completion_day_range, habit_id)
 
-    if not dates:
+    if most_recent_date is None:
         print(f"Habit {name} has not yet added any completion dates.")
         return 0
     else:
         current_streak = 0
 
-        if dates[0] == today:
+        if most_recent_date == today:
             current_streak += 1
-            for i in range(1, len(dates)):
-                if dates[i] == dates[i - 1] - timedelta(days=1):
+            previous_date = most_recent_date
+            dates = _iter_recent_days(db, habit_id, first_date, most_recent_date)
+            next(dates)
+            for check_off in dates:
+                if check_off == previous_date - 1:
                     current_streak += 1
-                elif dates[i] == dates[i - 1]:
+                elif check_off == previous_date:
                     continue
                 else:
                     break
+                previous_date = check_off
         else:
             current_streak = 0
 
         return current_streak
 
 
-def calculate_current_streak_weekly(db, name, start_date):
+def calculate_current_streak_weekly(db, name, start_date, user_id=DEFAULT_USER_ID):
     """Calculate the current streak of weekly habits.
 
-    dates = a list of check off dates for the habit searched via the habit_id (primary key)
+    dates = the check off dates for the habit searched via the habit_id (primary key), read backwards from the most
+    recent date in bounded windows (see _iter_recent_days)
 
     If there are no dates for the habit, the function returns 0. If there are dates, the function proceeds to the
     calculation.
 
-    filtered_list = a list of dates that match the day of the week the habit was started
-
-    If the filtered_list is empty, the function returns 0. Otherwise, the calculation proceeds.
-
-    The current streak is only calculated if the date at index [0] is within the last week. Then, it is calculated by
-    counting the number of consecutive weeks when the habit was completed on the required day of the week.
+    Only the dates that match the day of the week the habit was started are counted. If there is no such date within
+    the last week, the function returns 0 without reading older dates. Otherwise, it is calculated by counting the
+    number of consecutive weeks when the habit was completed on the required day of the week until the streak breaks.
 
     parameters:
         db: Database connection from get_db() function
         name(str): Name of the habit used to search habit_id
+        user_id(int): Owner of the habit. Default is the default user.
 
     returns:
         int: The current streak of the habit.
     """
 
-    habit_id = get_primary_key(db, name)
-    today = date.today()
-    dates = get_date_list(db, habit_id)
+    habit_id = _query(db, get_habit_metadata, name, user_id)[0]
+    today = to_epoch_day(date.today())
+    first_date, most_recent_date = _query(db, get_completion_day_range, habit_id)
 
-    if not dates:
+    if most_recent_date is None:
         print(f"Habit {name} has not yet added any completion dates.")
         return 0
     else:
         start_date = datetime.strptime(start_date, "%Y-%m-%d")
         day_of_week = start_date.weekday()
-        filtered_list = list(filter(lambda x: (x.weekday() == day_of_week), dates))
 
-        if not filtered_list:
-            return 0
-        else:
-            current_streak = 1
-
-            if filtered_list[0] >= today - timedelta(weeks=1):
-                for i in (range(1, len(filtered_list))):
-                    if filtered_list[i] == filtered_list[i - 1] - timedelta(weeks=1):
-                        current_streak += 1
-                    else:
-                        break
+        current_streak = 0
+        previous_date = None
+        for check_off in _iter_recent_days(db, habit_id, first_date, most_recent_date):
+            if epoch_weekday(check_off) != day_of_week:
+                continue
+            if previous_date is None:
+                if check_off < today - 7:
+                    # No check-off on the required day of the week within the last week, older dates are not read.
+                    break
+                current_streak = 1
+            elif check_off == previous_date - 7:
+                current_streak += 1
+            elif check_off == previous_date:
+                continue
             else:
-                current_streak = 0
+                break
+            previous_date = check_off
 
-            return current_streak
+        return current_streak
 
 
-def get_current_streak(db, name):
+def get_current_streak(db, name, user_id=DEFAULT_USER_ID):
     """Get the current streak of given habit regardless of frequency.
 
-    daily_list = a list of daily habits filtered from the database by frequency
-    weekly_list = a list of weekly habits filtered from the database by frequency
+    metadata = habit_id, frequency and start_date of the habit from one cached lookup (see db.get_habit_metadata)
 
-    Uses the functions calculate_current_streak (daily) and calculate_current_streak_weekly (weekly)
+    The current streak is read from the streak summary in the habit_streak_state table: the streak ending on the most
+    recent check-off counts if that check-off was today (daily) or within the last week (weekly). Habits without
+    counted check-offs are passed to calculate_current_streak (daily) and calculate_current_streak_weekly (weekly).
 
     parameters:
         db: Database connection from get_db() function
         name(str): Name of the habit used to search habit_id
+        user_id(int): Owner of the habit. Default is the default user.
 
     returns:
         str: The current streak of the habit with designated unit (days or weeks)
     """
 
-    daily_list = [habit[0] for habit in list_of_habits_daily(db)]
-    weekly_list = [habit[0] for habit in list_of_habits_weekly(db)]
+    metadata = _query(db, get_habit_metadata, name, user_id)
+    if metadata is None:
+        return None
+    habit_id, frequency, start_date = metadata
+    today = to_epoch_day(date.today())
 
-    if name in daily_list:
-        current_streak = calculate_current_streak(db, name)
+    if frequency == "Daily":
+        _, _, last_day, current_run, _ = _streak_state(db, habit_id)
+        if last_day is None:
+            current_streak = calculate_current_streak(db, name, user_id)
+        else:
+            current_streak = current_run if last_day == today else 0
         return f"{current_streak} days"
 
-    if name in weekly_list:
-        start_date = search_start_date(db, name)
-        current_streak = calculate_current_streak_weekly(db, name, start_date)
+    if frequency == "Weekly":
+        _, _, last_day, current_run, _ = _streak_state(db, habit_id, start_date)
+        if last_day is None:
+            current_streak = calculate_current_streak_weekly(db, name, start_date, user_id)
+        else:
+            current_streak = current_run if last_day >= today - 7 else 0
         return f"{current_streak} weeks"
 
 
-# Need to improve data redundancy in the following two functions monthly_habit_completion and max_longest_streak
-def monthly_habit_completion(db, month):
-    """Get the number of completions for each habit for the provided month, in ascending order.
+def monthly_completion_counts(db, month, user_id=DEFAULT_USER_ID, workers=None):
+    """Get the number of check-off events of each habit in the provided month within the most recent year.
+
+    The counting is done by the database in one grouped query (see db.get_monthly_completions), so callers such as
+    the CLI can reuse the result without reading the check-off history again. With workers, the habits are split
+    into shards that are counted by a process pool (see parallel.parallel_monthly_completions).
+
+    parameters:
+        db: Database connection.
+        month(int): Numerical value of month for date retrieval.
+        user_id(int): Owner of the habits. Default is the default user.
+        workers(int): Number of worker processes for the parallel mode. Default is None (serial).
+
+    returns:
+        list: Tuples of habit name, frequency and number of check-off events, in ascending order of check-off events.
+    """
+    cutoff_date = to_epoch_day(date.today() - timedelta(days=365))
+    if workers:
+        from parallel import parallel_monthly_completions
+        return parallel_monthly_completions(db, month, cutoff_date, user_id, workers)
+    return _query(db, get_monthly_completions, month, cutoff_date, user_id)
+
 
-    daily_list = a list of daily habits filtered from the database by frequency
-    weekly_list = a list of weekly habits filtered from the database by frequency
+def monthly_habit_completion(db, month, user_id=DEFAULT_USER_ID, workers=None):
+    """Get the number of completions for each habit for the provided month, in ascending order.
 
-    The function loops through the list of daily habits and weekly habits and filters the dates to only include the
-    dates that match the designated month and are within the most recent year.
+    month_totals = a list of every habit with its frequency and the number of check-off events in the designated month
+    within the most recent year, in ascending order (see monthly_completion_counts)
 
-    The function then counts the number of check-off events for each habit and stores the count in a dictionary with the
-    habit name as the key and the count as the value. The dictionary is then sorted in ascending order by the number of
-    check off events.
+    The function prints the daily habits and then the weekly habits with their number of check-off events.
 
     parameters:
         db: Database connection.
        month(int): Numerical value of month for date retrieval.
+       user_id(int): Owner of the habits. Default is the default user.
+       workers(int): Number of worker processes for the parallel mode. Default is None (serial).
 
     returns:
-       list of key:value pairs: Name of habit with number of check-off events in the designated month separated by
-                                periodicity.
+       list: Tuples of habit name, frequency and number of check-off events in the designated month.
     """
+    month_totals = monthly_completion_counts(db, month, user_id, workers)
+
     print("Daily Habits:\n")
-    daily_list = [habit[0] for habit in list_of_habits_daily(db)]
+    daily_habit_total = [(name, total) for name, frequency, total in month_totals if frequency == "Daily"]
 
-    if not daily_list:
+    if not daily_habit_total:
         print("\nYou have no habits logged to analyze.\n")
     else:
-        daily_habit_total = {}
-        cutoff_date = date.today() - timedelta(days=365)
-
-        for habit in daily_list:
-            habit_id = get_primary_key(db, habit)
-            dates = get_date_list(db, habit_id)
-            month_check_offs = [check_off for check_off in dates if check_off.month == month and
-                                check_off > cutoff_date]
-            daily_habit_total[habit] = len(month_check_offs)
-        sort_daily_habit_total = dict(sorted(daily_habit_total.items(), key=lambda x: x[1]))
-        for key, value in sort_daily_habit_total.items():
+        for key, value in daily_habit_total:
             print(f"{key}: {value}")
 
     print("\nWeekly Habits:\n")
-    weekly_list = [habit[0] for habit in list_of_habits_weekly(db)]
+    weekly_habit_total = [(name, total) for name, frequency, total in month_totals if frequency == "Weekly"]
 
-    if not weekly_list:
+    if not weekly_habit_total:
         print("\nYou have no habits logged to analyze.\n")
     else:
-        weekly_habit_total = {}
-        cutoff_date = date.today() - timedelta(days=365)
-
-        for habit in weekly_list:
-            habit_id = get_primary_key(db, habit)
-            dates = get_date_list(db, habit_id)
-            month_check_offs = [check_off for check_off in dates if check_off.month == month and
-                                check_off > cutoff_date]
-            weekly_habit_total[habit] = len(month_check_offs)
-        sort_weekly_habit_total = dict(sorted(weekly_habit_total.items(), key=lambda x: x[1]))
-        for key, value in sort_weekly_habit_total.items():
+        for key, value in weekly_habit_total:
             print(f"{key}: {value}")
 
+    return month_totals
+
+
+def longest_streak_maxima(db, user_id=DEFAULT_USER_ID, workers=None):
+    """Find the daily and the weekly habit with the longest streak.
+
+    longest_streaks = a list of every habit with its frequency and longest streak, calculated by the database in one
+    query (see db.get_longest_streaks) instead of one calculation per habit. On a CheckOffStore the streaks are
+    calculated from the days of the store.
+
+    With workers, the habits are split into shards that are analysed by a process pool instead, and the maxima of the
+    shards are merged (see parallel.parallel_longest_streak_maxima). Both give the same result.
+
+    parameters:
+        db: Database connection.
+        user_id(int): Owner of the habits. Default is the default user.
+        workers(int): Number of worker processes for the parallel mode. Default is None (serial).
+
+    returns:
+        dict: For Daily and Weekly, a tuple of the name and longest streak of the habit with the longest streak, or
+              None if there are no such habits. If two habits have the same streak, the habit created first is used.
+    """
+    if workers:
+        from parallel import parallel_longest_streak_maxima
+        return parallel_longest_streak_maxima(db, user_id, workers)
+
+    if isinstance(db, CheckOffStore):
+        longest_streaks = []
+        for habit_id, name, frequency, start_date in db.habits(user_id):
+            if frequency in ("Daily", "Weekly"):
+                state = _streak_state(db, habit_id, start_date if frequency == "Weekly" else None)
+                longest_streaks.append((name, frequency, state[4]))
+    else:
+        longest_streaks = get_longest_streaks(db, user_id)
+    maxima = {}
+    for habit_frequency in ("Daily", "Weekly"):
+        habits = [(name, streak) for name, frequency, streak in longest_streaks if frequency == habit_frequency]
+        maxima[habit_frequency] = max(habits, key=lambda habit: habit[1]) if habits else None
+    return maxima
+
 
-def max_longest_streak(db):
+def max_longest_streak(db, user_id=DEFAULT_USER_ID, workers=None):
     """Analyzes the longest streak of all habits in the database and returns the daily and weekly habit with the longest
     streak.
 
-    daily_list = a list of daily habits filtered from the database by frequency
-    weekly_list = a list of weekly habits filtered from the database by frequency
-
-    The function loops through the list of daily habits and weekly habits and calculates the longest streak for each
-    storing these values in a dictionary with the habit name as the key and the longest streak as the value.
+    maxima = the daily and the weekly habit with the longest streak (see longest_streak_maxima)
 
-    The function then finds the maximum value of the dictionary and prints the habit with the longest streak with its
-    corresponding unit (days or weeks).
+    The function prints the habit with the longest streak for each frequency with its corresponding unit (days or
+    weeks). If two habits have the same streak, the habit created first is shown.
 
     parameters:
         db: Database connection.
+        user_id(int): Owner of the habits. Default is the default user.
+        workers(int): Number of worker processes for the parallel mode. Default is None (serial).
 
     returns:
-        str: Daily and weekly habit with the longest streak and the number of days or weeks.
+        dict: For Daily and Weekly, the name and longest streak of the habit with the longest streak, or None.
 
     """
 
+    maxima = longest_streak_maxima(db, user_id, workers)
+
     print("\nDaily Habits:\n")
-    daily_list = [habit[0] for habit in list_of_habits_daily(db)]
-    if not daily_list:
+    maximum_daily_streak = maxima["Daily"]
+    if maximum_daily_streak is None:
         print("\nYou have no habits logged to analyze.\n")
     else:
-        daily_habit_longest_streak = {}
-
-        for habit in daily_list:
-            longest_streak = calculate_longest_streak(db, habit)
-            daily_habit_longest_streak[habit] = longest_streak
-        maximum_daily_streak = max(daily_habit_longest_streak, key=daily_habit_longest_streak.get)
-        print(f"Daily Habit with Longest Streak: {maximum_daily_streak} with "
-              f"{daily_habit_longest_streak[maximum_daily_streak]} days.\n")
+        print(f"Daily Habit with Longest Streak: {maximum_daily_streak[0]} with "
+              f"{maximum_daily_streak[1]} days.\n")
 
     print("Weekly Habits:\n")
-    weekly_list = [habit[0] for habit in list_of_habits_weekly(db)]
-    if not weekly_list:
+    maximum_weekly_streak = maxima["Weekly"]
+    if maximum_weekly_streak is None:
         print("\nYou have no habits logged to analyze.\n")
     else:
-        weekly_habit_longest_streak = {}
-
-        for habit in weekly_list:
-            start_date = search_start_date(db, habit)
-            longest_streak = calculate_longest_streak_weekly(db, habit, start_date)
-            weekly_habit_longest_streak[habit] = longest_streak
-        maximum_weekly_streak = max(weekly_habit_longest_streak, key=weekly_habit_longest_streak.get)
-        print(f"Weekly Habit with Longest Streak: {maximum_weekly_streak} with "
-              f"{weekly_habit_longest_streak[maximum_weekly_streak]} weeks.\n")
+        print(f"Weekly Habit with Longest Streak: {maximum_weekly_streak[0]} with "
+              f"{maximum_weekly_streak[1]} weeks.\n")
+
+    return maxima
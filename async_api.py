@@ -0,0 +1,151 @@
+"""This module contains an asyncio interface to the database and analysis functions of the Habit Tracker.
+
+The functions of db.py and analyse.py block on SQLite, so an event loop that calls them directly stops serving other
+requests while the database is read or written. AsyncHabitTracker runs them on its own threads instead:
+
+    async with AsyncHabitTracker("main.db") as tracker:
+        await tracker.add_habit_completion(habit_id)
+        streak = await tracker.get_current_streak("Reading")
+
+Reads run on a pool of reader threads, each with its own connection from get_db, so at most `readers` connections are
+open. Writes run on a single writer thread, because SQLite allows one writer at a time. Check-offs that arrive while
+the writer is busy are collected and saved together in one transaction (see db.add_completions_batch).
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import analyse
+from db import (get_db, close_db, add_habit, add_completions_batch, get_date_list, DEFAULT_USER_ID)
+
+
+class AsyncHabitTracker:
+    """Coroutines for adding habits and check-offs and for analysing the habits of one database file.
+
+    attributes:
+        database(str): Name of the database file.
+        readers(int): Number of reader threads, which is also the number of read connections.
+        max_batch(int): Maximum number of check-offs saved in one transaction.
+        batches(int): Number of check-off transactions written so far.
+        batched_rows(int): Number of check-offs written so far.
+    """
+
+    def __init__(self, database="main.db", readers=4, max_batch=500):
+        """
+        Initialize the reader and writer threads. No connection is opened until the first request.
+
+        parameters:
+           database(str): Name of the database file. Default is main.db.
+           readers(int): Number of reader threads and read connections. Default is 4.
+           max_batch(int): Maximum number of check-offs saved in one transaction. Default is 500.
+        """
+        self.database = database
+        self.readers = readers
+        self.max_batch = max_batch
+        self.batches = 0
+        self.batched_rows = 0
+        self._reader = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="habit-reader")
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="habit-writer")
+        self._pending = []
+        self._flusher = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _read(self, function, *args):
+        """Run a function with a reader connection as its first argument on a reader thread and return its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reader, lambda: function(get_db(self.database), *args))
+
+    async def _write(self, function, *args):
+        """Run a function with the writer connection as its first argument on the writer thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, lambda: function(get_db(self.database), *args))
+
+    async def add_habit(self, name, description, frequency, start_date, user_id=DEFAULT_USER_ID):
+        """Save a new habit, see db.add_habit."""
+        await self._write(add_habit, name, description, frequency, start_date, user_id)
+
+    async def add_habit_completion(self, habit_id, completion_date=None, idempotency_key=None):
+        """Save a check-off of a habit, see db.add_habit_completion.
+
+        The check-off is queued and saved with the other check-offs that are waiting for the writer, in one
+        transaction. The coroutine returns once that transaction is committed.
+
+        parameters:
+           habit_id(int): Primary key of the habit.
+           completion_date(str): Date the habit was completed (YYYY-MM-DD HH:MM). Default is the current date.
+           idempotency_key(str): Key of the client request. A retry with the same key is not saved again.
+
+        raises:
+           sqlite3.Error: If the check-off could not be saved, e.g. because there is no habit with this habit_id.
+        """
+        if completion_date is None:
+            completion_date = datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((habit_id, completion_date, idempotency_key, future))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush())
+        await future
+
+    async def _flush(self):
+        """Write the queued check-offs in batches of up to max_batch until the queue is empty.
+        Check-offs queued while a batch is being written go into the next batch."""
+        while self._pending:
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            try:
+                results = await self._write(add_completions_batch, [row[:3] for row in batch])
+            except Exception as error:
+                results = [error] * len(batch)
+            self.batches += 1
+            self.batched_rows += len(batch)
+            for (*_, future), error in zip(batch, results):
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+
+    async def flush(self):
+        """Wait until every queued check-off is written."""
+        while self._flusher is not None and not self._flusher.done():
+            await self._flusher
+
+    async def get_date_list(self, habit_id):
+        """Return the check-off dates of a habit, see db.get_date_list."""
+        return await self._read(get_date_list, habit_id)
+
+    async def get_longest_streak(self, name, user_id=DEFAULT_USER_ID):
+        """Return the longest streak of a habit, see analyse.get_longest_streak."""
+        return await self._read(analyse.get_longest_streak, name, user_id)
+
+    async def get_current_streak(self, name, user_id=DEFAULT_USER_ID):
+        """Return the current streak of a habit, see analyse.get_current_streak."""
+        return await self._read(analyse.get_current_streak, name, user_id)
+
+    async def monthly_habit_completion(self, month, user_id=DEFAULT_USER_ID):
+        """Return every habit with its frequency and number of check-offs in the month, see
+        analyse.monthly_habit_completion. Nothing is printed, the rows come from analyse.monthly_completion_counts."""
+        return await self._read(analyse.monthly_completion_counts, month, user_id)
+
+    async def close(self):
+        """Write the queued check-offs, close the connections of the reader and writer threads and stop the threads."""
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        # Every reader thread waits at the barrier, so each one runs exactly one close_db for its own connection.
+        barrier = threading.Barrier(self.readers)
+
+        def close_reader():
+            barrier.wait()
+            close_db(self.database)
+
+        await asyncio.gather(*(loop.run_in_executor(self._reader, close_reader) for _ in range(self.readers)))
+        await loop.run_in_executor(self._writer, close_db, self.database)
+        self._reader.shutdown()
+        self._writer.shutdown()
@@ -0,0 +1,465 @@
+"""This module contains benchmarks for the database and analysis functions of the Habit Tracker.
+
+A synthetic database of configurable size is generated (daily and weekly habits with gaps, repeated check-offs on the
+same day and weekly check-offs on the wrong weekday), then get_date_list, the streak functions, the monthly and
+longest streak reports, the habits due today and the insert paths are timed. The results are printed and can be
+written to a JSON file, so the numbers of two commits can be compared.
+
+The insert benchmark compares saving check-off dates one by one with Habit.add_habit_completion_date (the loop used in
+test_add_habit_completion_date) against saving them in one transaction with Habit.add_completion_dates.
+
+The load test runs many concurrent coroutines against async_api.AsyncHabitTracker, each alternating a check-off and a
+current streak lookup, and reports the requests per second and the average number of check-offs per transaction.
+
+Run it from the command line, for example:
+
+    python benchmark.py --habits 10000 --years 5 --output results.json
+    python benchmark.py --compare old_results.json results.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, date, timedelta
+from habit import Habit
+import analyse
+from async_api import AsyncHabitTracker
+from write_queue import CheckOffQueue
+from store import CheckOffStore
+from snapshot import export_snapshot, load_snapshot
+from db import (get_db, close_db, add_habit, add_habit_completions_bulk, get_date_list, get_habit_metadata,
+                day_list_cache, clear_metadata_cache, habits_due)
+
+
+def make_dates(count, end=None):
+    """Create a list of daily check-off dates ending yesterday, oldest first.
+
+    parameters:
+        count(int): Number of dates to create.
+        end(datetime): Last check-off date. Default is yesterday at 08:00.
+
+    returns:
+        list: Dates in the format YYYY-MM-DD HH:MM.
+    """
+    if end is None:
+        end = datetime.now().replace(hour=8, minute=0, second=0, microsecond=0) - timedelta(days=1)
+    return [datetime.strftime(end - timedelta(days=day), "%Y-%m-%d %H:%M") for day in range(count - 1, -1, -1)]
+
+
+def make_history(frequency, start, end, rng):
+    """Create a synthetic check-off history for one habit.
+
+    Daily habits are checked off on about 85% of the days, weekly habits on about 85% of the weeks on the weekday of
+    their start date. About 3% of the check-offs are repeated later the same day, and weekly habits also get
+    check-offs on other weekdays, which do not count towards their streaks.
+
+    parameters:
+        frequency(str): Daily or Weekly.
+        start(date): Start date of the habit.
+        end(date): Last day that can have a check-off.
+        rng(random.Random): Random number generator, so a seed gives the same database.
+
+    returns:
+        list: Dates in the format YYYY-MM-DD HH:MM, oldest first.
+    """
+    step = 1 if frequency == "Daily" else 7
+    dates = []
+    day = start
+    while day <= end:
+        if rng.random() < 0.85:
+            dates.append(f"{day.isoformat()} {rng.randint(6, 20):02d}:{rng.randint(0, 59):02d}")
+            if rng.random() < 0.03:
+                dates.append(f"{day.isoformat()} 21:{rng.randint(0, 59):02d}")
+        if step == 7 and rng.random() < 0.1:
+            off_day = day + timedelta(days=rng.randint(1, 6))
+            if off_day <= end:
+                dates.append(f"{off_day.isoformat()} 12:00")
+        day += timedelta(days=step)
+    return dates
+
+
+def generate_database(path, habits, years, seed=0):
+    """Create a database file with synthetic habits and check-off histories.
+
+    parameters:
+        path(str): Name of the database file to create.
+        habits(int): Number of habits. About 70% are daily and 30% weekly.
+        years(int): Years of check-off history per habit, ending today.
+        seed(int): Seed of the random number generator.
+
+    returns:
+        int: Number of check-off rows saved.
+    """
+    rng = random.Random(seed)
+    db = get_db(path)
+    end = date.today()
+    start = end - timedelta(days=365 * years)
+    rows = 0
+    for number in range(habits):
+        frequency = "Daily" if rng.random() < 0.7 else "Weekly"
+        habit_start = start + timedelta(days=rng.randint(0, 6))
+        name = f"Habit {number}"
+        add_habit(db, name, "Benchmark habit.", frequency, habit_start.isoformat())
+        habit_id = get_habit_metadata(db, name)[0]
+        rows += add_habit_completions_bulk(db, habit_id, make_history(frequency, habit_start, end, rng))[0]
+    return rows
+
+
+def _time(function, calls=1):
+    """Call a function, with its printed output hidden, and return the timing as a dictionary."""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(calls):
+            function()
+    elapsed = time.perf_counter() - start
+    return {"calls": calls, "seconds": elapsed, "per_call": elapsed / calls}
+
+
+def _time_each(function, names):
+    """Call a function once per habit name and return the total timing as a dictionary.
+    The in-process caches are emptied first, so every call reads the database."""
+    day_list_cache.clear()
+    clear_metadata_cache()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name in names:
+            function(name)
+    elapsed = time.perf_counter() - start
+    return {"calls": len(names), "seconds": elapsed, "per_call": elapsed / max(len(names), 1)}
+
+
+def benchmark_queries(path, sample, month=None, seed=0, workers=None):
+    """Time the reading and analysis functions on an existing database.
+
+    The per-habit functions run for a random sample of habits; the reports run once over all habits.
+
+    parameters:
+        path(str): Name of the database file.
+        sample(int): Number of habits for the per-habit functions.
+        month(int): Month for monthly_habit_completion. Default is the current month.
+        seed(int): Seed used to pick the sample.
+        workers(int): Number of worker processes for the parallel reports. Default is the number of CPUs.
+
+    returns:
+        dict: Timing of each function.
+    """
+    db = get_db(path)
+    month = month or date.today().month
+    rows = db.execute("SELECT name, frequency, start_date FROM habit_metadata ORDER BY habit_id").fetchall()
+    picked = random.Random(seed).sample(rows, min(sample, len(rows)))
+    daily = [name for name, frequency, _ in picked if frequency == "Daily"]
+    weekly = [(name, start_date) for name, frequency, start_date in picked if frequency == "Weekly"]
+    names = [name for name, _, _ in picked]
+
+    results = {
+        "get_date_list": _time_each(lambda name: get_date_list(db, get_habit_metadata(db, name)[0]), names),
+        "calculate_longest_streak": _time_each(lambda name: analyse.calculate_longest_streak(db, name), daily),
+        "calculate_current_streak": _time_each(lambda name: analyse.calculate_current_streak(db, name), daily),
+        "calculate_longest_streak_weekly": _time_each(
+            lambda habit: analyse.calculate_longest_streak_weekly(db, *habit), weekly),
+        "calculate_current_streak_weekly": _time_each(
+            lambda habit: analyse.calculate_current_streak_weekly(db, *habit), weekly),
+    }
+    with db:
+        db.execute("DELETE FROM habit_streak_state")
+    results["get_longest_streak_rebuild"] = _time_each(lambda name: analyse.get_longest_streak(db, name), names)
+    results["get_longest_streak"] = _time_each(lambda name: analyse.get_longest_streak(db, name), names)
+    results["get_current_streak"] = _time_each(lambda name: analyse.get_current_streak(db, name), names)
+    results["monthly_habit_completion"] = _time(lambda: analyse.monthly_habit_completion(db, month))
+    results["max_longest_streak"] = _time(lambda: analyse.max_longest_streak(db))
+    results["habits_due"] = _time(lambda: habits_due(db), calls=10)
+    workers = workers or os.cpu_count()
+    results["monthly_habit_completion_parallel"] = _time(lambda: analyse.monthly_habit_completion(db, month,
+                                                                                                 workers=workers))
+    results["max_longest_streak_parallel"] = _time(lambda: analyse.max_longest_streak(db, workers=workers))
+    results["store_load"] = _time(lambda: CheckOffStore.load(db))
+    store = CheckOffStore.load(db)
+    results["monthly_habit_completion_store"] = _time(lambda: analyse.monthly_habit_completion(store, month))
+    results["max_longest_streak_store"] = _time(lambda: analyse.max_longest_streak(store))
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot_path = os.path.join(directory, "benchmark.snapshot")
+        results["snapshot_export"] = _time(lambda: export_snapshot(db, snapshot_path))
+        results["snapshot_load"] = _time(lambda: load_snapshot(snapshot_path), calls=10)
+        snapshot = load_snapshot(snapshot_path)
+        results["monthly_habit_completion_snapshot"] = _time(lambda: analyse.monthly_habit_completion(snapshot, month))
+        results["max_longest_streak_snapshot"] = _time(lambda: analyse.max_longest_streak(snapshot))
+    return results
+
+
+def benchmark_memory(path):
+    """Measure the memory used to hold the check-offs of all habits, as lists of dates (get_date_list) and as a
+    CheckOffStore, with tracemalloc.
+
+    parameters:
+        path(str): Name of the database file.
+
+    returns:
+        dict: Number of check-offs and bytes allocated by each representation.
+    """
+    db = get_db(path)
+    habit_ids = [row[0] for row in db.execute("SELECT habit_id FROM habit_metadata")]
+    day_list_cache.clear()
+    results = {}
+    for name, load in (("date_lists", lambda: {habit_id: get_date_list(db, habit_id) for habit_id in habit_ids}),
+                       ("store", lambda: CheckOffStore.load(db))):
+        tracemalloc.start()
+        loaded = load()
+        results[name] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        day_list_cache.clear()
+        del loaded
+    results["check_offs"] = db.execute("SELECT COUNT(*) FROM habit_completion_dates").fetchone()[0]
+    return results
+
+
+def benchmark_inserts(count):
+    """Time the per-row insert loop against the bulk insert and the write-behind queue for the same number of
+    check-off dates.
+    Each path writes to its own fresh database file, so neither benefits from the other's page cache.
+
+    parameters:
+        count(int): Number of check-off dates to insert.
+
+    returns:
+        dict: Seconds taken and rows per second for the per-row loop, the bulk insert and the write-behind queue, with
+        the queue metrics (see CheckOffQueue.metrics) for the latter.
+    """
+    dates = make_dates(count)
+    database = Habit.Database
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "per_row.db")
+            habit = _new_habit(path, "Per row")
+            start = time.perf_counter()
+            for check_off in dates:
+                habit.add_habit_completion_date(check_off)
+            elapsed = time.perf_counter() - start
+            results["per_row"] = {"rows": count, "seconds": elapsed, "rows_per_second": count / elapsed}
+            close_db(path)
+
+            path = os.path.join(directory, "bulk.db")
+            habit = _new_habit(path, "Bulk")
+            start = time.perf_counter()
+            rows, _ = habit.add_completion_dates(dates)
+            elapsed = time.perf_counter() - start
+            results["bulk"] = {"rows": rows, "seconds": elapsed, "rows_per_second": rows / elapsed}
+            close_db(path)
+
+            path = os.path.join(directory, "write_behind.db")
+            habit = _new_habit(path, "Write behind")
+            start = time.perf_counter()
+            Habit.write_queue = CheckOffQueue(path)
+            for check_off in dates:
+                habit.add_habit_completion_date(check_off)
+            Habit.write_queue.close()
+            elapsed = time.perf_counter() - start
+            results["write_behind"] = {"rows": count, "seconds": elapsed, "rows_per_second": count / elapsed,
+                                       **Habit.write_queue.metrics()}
+            close_db(path)
+    finally:
+        Habit.Database = database
+        Habit.write_queue = None
+    return results
+
+
+def benchmark_async(path, coroutines, requests, readers=4, seed=0):
+    """Load test the asyncio interface with many concurrent coroutines on an existing database.
+
+    Every coroutine sends the given number of requests, alternating a check-off of a random habit and a current streak
+    lookup of a random habit.
+
+    parameters:
+        path(str): Name of the database file.
+        coroutines(int): Number of concurrent coroutines.
+        requests(int): Number of requests per coroutine.
+        readers(int): Number of reader threads of the AsyncHabitTracker.
+        seed(int): Seed used to pick the habits.
+
+    returns:
+        dict: Number of requests, seconds taken, requests per second and average check-offs per transaction.
+    """
+    db = get_db(path)
+    habits = db.execute("SELECT habit_id, name FROM habit_metadata ORDER BY habit_id").fetchall()
+    check_off = datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M")
+    rng = random.Random(seed)
+
+    async def client(tracker, picks):
+        for number, (habit_id, name) in enumerate(picks):
+            if number % 2 == 0:
+                await tracker.add_habit_completion(habit_id, check_off)
+            else:
+                await tracker.get_current_streak(name)
+
+    async def run():
+        async with AsyncHabitTracker(path, readers=readers) as tracker:
+            picks = [[rng.choice(habits) for _ in range(requests)] for _ in range(coroutines)]
+            start = time.perf_counter()
+            await asyncio.gather(*(client(tracker, client_picks) for client_picks in picks))
+            elapsed = time.perf_counter() - start
+        return elapsed, tracker.batched_rows / max(tracker.batches, 1)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        elapsed, batch_size = asyncio.run(run())
+    total = coroutines * requests
+    return {"coroutines": coroutines, "requests": total, "seconds": elapsed, "requests_per_second": total / elapsed,
+            "average_batch": batch_size}
+
+
+def benchmark_startup(path, runs=5):
+    """Time cold starts of main.py as separate processes, the median of several runs.
+
+    The list and streak commands are timed, and the import of main.py with questionary, which is what every start
+    loaded before the commands imported it only for the interactive menu.
+
+    parameters:
+        path(str): Name of the database file.
+        runs(int): Number of runs of each command.
+
+    returns:
+        dict: Median seconds of each command.
+    """
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    name = get_db(path).execute("SELECT name FROM habit_metadata ORDER BY habit_id").fetchone()[0]
+    commands = {"list_command": [main_py, "--database", path, "list"],
+                "streak_command": [main_py, "--database", path, "streak", name],
+                "interactive_imports": ["-c", "import main, questionary, analyse"]}
+    results = {}
+    for command, arguments in commands.items():
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, *arguments], capture_output=True, check=True,
+                           cwd=os.path.dirname(main_py))
+            timings.append(time.perf_counter() - start)
+        results[command] = {"calls": runs, "seconds": sum(timings), "per_call": statistics.median(timings)}
+    return results
+
+
+def _copy_database(source, target):
+    """Copy a database file, including the check-offs that are still in its write-ahead log, with the backup API."""
+    with contextlib.closing(sqlite3.connect(source)) as original, contextlib.closing(sqlite3.connect(target)) as copy:
+        original.backup(copy)
+
+
+def _new_habit(database, name):
+    """Save a daily habit in the given database file and return it."""
+    Habit.Database = database
+    habit = Habit(name=name, description="Benchmark habit.", frequency="Daily", start_date="2000-01-01")
+    habit.save_habit()
+    return habit
+
+
+def _git_commit():
+    """Return the current git commit of the repository, or None if it cannot be found."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_file, new_file):
+    """Print the change in seconds per call, rows per second or requests per second of every benchmark between two
+    JSON result files.
+
+    parameters:
+        old_file(str): JSON results of the earlier run.
+        new_file(str): JSON results of the later run.
+    """
+    with open(old_file) as file:
+        old = json.load(file)
+    with open(new_file) as file:
+        new = json.load(file)
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    for group, key in (("queries", "per_call"), ("startup", "per_call"), ("inserts", "rows_per_second"),
+                       ("load", "requests_per_second")):
+        for name, result in new.get(group, {}).items():
+            before = old.get(group, {}).get(name)
+            if before is None or not before.get(key):
+                print(f"{name}: {result[key]:.6g} (new)")
+            else:
+                print(f"{name}: {before[key]:.6g} -> {result[key]:.6g} ({result[key] / before[key]:.2f}x)")
+
+
+def main():
+    """Parse the command line arguments, run the benchmarks and print the results."""
+    parser = argparse.ArgumentParser(description="Benchmark the Habit Tracker database and analysis functions.")
+    parser.add_argument("--habits", type=int, default=200, help="Number of habits in the generated database.")
+    parser.add_argument("--years", type=int, default=2, help="Years of check-off history per habit.")
+    parser.add_argument("--sample", type=int, default=100, help="Number of habits for the per-habit functions.")
+    parser.add_argument("--dates", type=int, default=365, help="Number of check-off dates for the insert paths.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated data.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes for the parallel reports.")
+    parser.add_argument("--coroutines", type=int, default=100, help="Number of concurrent coroutines in the load test.")
+    parser.add_argument("--requests", type=int, default=20, help="Number of requests per coroutine in the load test.")
+    parser.add_argument("--database", help="Use (or create, if missing) this database file instead of a temporary "
+                                           "one. The benchmarks run on a copy, so the file is not changed.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two JSON result files and exit.")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = {"commit": _git_commit(), "timestamp": datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(), "numpy": analyse.USE_NUMPY,
+              "parameters": {"habits": args.habits, "years": args.years, "sample": args.sample,
+                             "dates": args.dates, "seed": args.seed, "coroutines": args.coroutines,
+                             "requests": args.requests, "workers": args.workers}}
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = args.database or os.path.join(directory, "benchmark.db")
+        if not os.path.exists(source):
+            start = time.perf_counter()
+            rows = generate_database(source, args.habits, args.years, args.seed)
+            report["generate"] = {"rows": rows, "seconds": time.perf_counter() - start}
+            print(f"Generated {args.habits} habits with {rows} check-offs in {report['generate']['seconds']:.1f} s")
+            close_db(source)
+        # The query benchmark deletes the streak summaries and the load test adds check-offs, so the benchmarks run
+        # on a copy and the --database file is left as it was.
+        path = os.path.join(directory, "benchmark_copy.db")
+        _copy_database(source, path)
+        report["queries"] = benchmark_queries(path, args.sample, seed=args.seed, workers=args.workers)
+        report["memory"] = benchmark_memory(path)
+        report["startup"] = benchmark_startup(path)
+        report["load"] = {"async": benchmark_async(path, args.coroutines, args.requests, seed=args.seed)}
+        close_db(path)
+    report["inserts"] = benchmark_inserts(args.dates)
+
+    for name, result in report["queries"].items():
+        print(f"{name}: {result['calls']} calls in {result['seconds']:.3f} s ({result['per_call'] * 1000:.3f} ms/call)")
+    for name, result in report["startup"].items():
+        print(f"startup {name}: {result['per_call'] * 1000:.1f} ms (median of {result['calls']} runs)")
+    for name, result in report["inserts"].items():
+        print(f"insert {name}: {result['rows']} rows in {result['seconds']:.3f} s "
+              f"({result['rows_per_second']:.0f} rows/s)")
+    memory = report["memory"]
+    print(f"memory for {memory['check_offs']} check-offs: {memory['date_lists'] / 2 ** 20:.1f} MiB as date lists, "
+          f"{memory['store'] / 2 ** 20:.1f} MiB as a CheckOffStore")
+    load = report["load"]["async"]
+    print(f"async load: {load['requests']} requests from {load['coroutines']} coroutines in {load['seconds']:.3f} s "
+          f"({load['requests_per_second']:.0f} requests/s, {load['average_batch']:.1f} check-offs per transaction)")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
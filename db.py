@@ -1,30 +1,240 @@
 """This module contains functions to analyze the data in the database."""
 
-from datetime import datetime
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, date
+import os
 import sqlite3
+import threading
+import time
+
+
+# Connections are cached per thread and per database file, so repeated get_db calls reuse one connection
+# instead of reconnecting and rerunning the schema bootstrap. sqlite3 connections must stay on the thread that
+# created them, which is why the cache is thread-local rather than a shared pool.
+_local = threading.local()
+
+# Seconds a connection waits for another connection's lock before it reports the database as locked.
+BUSY_TIMEOUT = 30
+
+# Serialises the schema bootstrap of the connections opened by this process.
+_bootstrap_lock = threading.Lock()
+
+# Per-connection settings: WAL lets readers work while a check-off is written, synchronous NORMAL is safe with WAL
+# and avoids an fsync per commit, and a negative cache_size is in KiB (8 MiB of page cache).
+CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -8192",
+)
+
+
+# Habits created without naming a user belong to this user, so a single-user tracker works as before.
+DEFAULT_USER_ID = 1
+DEFAULT_USER_NAME = "default"
+
+# Check-off days are stored as the number of days since 1970-01-01, so streaks can be found with integer arithmetic.
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# SQL expression that turns the "%Y-%m-%d %H:%M" completion_date column into its epoch day.
+# (julianday of 1970-01-01 00:00 is 2440587.5)
+_EPOCH_DAY_SQL = "CAST(julianday(substr(completion_date, 1, 10)) - 2440587.5 AS INTEGER)"
+
+# Insert of one check-off. A row that breaks a unique index (the idempotency key, or the day with unique check-offs
+# switched on) is left out instead of raising, which is what makes retried and double-submitted check-offs harmless.
+_INSERT_COMPLETION = """INSERT INTO habit_completion_dates (completion_date, habit_id, completion_day, idempotency_key)
+                        VALUES (?,?,?,?) ON CONFLICT DO NOTHING"""
+
+
+def to_epoch_day(day):
+    """Return the epoch day (days since 1970-01-01) of a date."""
+
+    return day.toordinal() - EPOCH_ORDINAL
+
+
+def from_epoch_day(day):
+    """Return the date of an epoch day (days since 1970-01-01)."""
+
+    return date.fromordinal(day + EPOCH_ORDINAL)
+
+
+def completion_day(completion_date):
+    """Return the epoch day of a completion date in the format YYYY-MM-DD HH:MM, or None if it is not a date."""
+
+    try:
+        return to_epoch_day(date.fromisoformat(completion_date[:10]))
+    except (TypeError, ValueError):
+        return None
+
+
+def epoch_weekday(day):
+    """Return the day of the week of an epoch day, Monday is 0 and Sunday is 6 (as date.weekday).
+    1970-01-01 was a Thursday, which is why the epoch day is shifted by 3."""
+
+    return (day + 3) % 7
+
+
+class HabitConnection(sqlite3.Connection):
+    """sqlite3 connection that remembers the path of its database file, so in-process caches can be shared by all
+    connections to the same file, and whether it was opened read-only (see connect_read_only)."""
+
+    path = None
+    read_only = False
+    data_version = None
+
+
+def _db_key(db):
+    """Return the key used by the in-process caches for the database of a connection: the path of its database file,
+    or None for in-memory databases and connections without a path, whose results are not cached."""
+
+    return getattr(db, "path", None)
+
+
+def _cached_database(db):
+    """Return the key of the database of a connection for the in-process caches, or None if results read through
+    the connection must not be cached (see _db_key).
+
+    Each connection remembers the PRAGMA data_version it saw last. It changes when another connection, of this or of
+    another process, commits to the file, and the cached entries of the database are dropped then."""
+
+    database = _db_key(db)
+    if database is None:
+        return None
+    version = db.execute("PRAGMA data_version").fetchone()[0]
+    if version != db.data_version:
+        day_list_cache.discard(database)
+        _metadata_cache.discard(database)
+        db.data_version = version
+    return database
+
+
+def _db_path(name):
+    """Return the key used to cache connections for a database name.
+    In-memory databases are private to a connection, so they are never shared."""
+
+    if name == ":memory:":
+        return None
+    return os.path.abspath(name)
+
+
+def connect(name="main.db"):
+    """Open a new connection to the database with the connection pragmas applied.
+    The schema bootstrap only runs when the schema version stored in the file (PRAGMA user_version) is behind, so it
+    also runs for a file that was deleted and created again while the process was running.
+
+    parameter:
+       name(str): Name of the database to connect to. Default argument is main.db.
+
+    returns:
+       sqlite3.Connection: A new connection that is not cached by get_db.
+    """
+
+    db = sqlite3.connect(name, timeout=BUSY_TIMEOUT, factory=HabitConnection)
+    for pragma in CONNECTION_PRAGMAS:
+        db.execute(pragma)
+
+    path = db.path = _db_path(name)
+    if path is None:
+        create_tables(db)
+        return db
+
+    # The version read here only decides whether migrate has to run. migrate reads it again under the write lock
+    # (see migrate), so processes that open the file at the same time wait for each other.
+    with _bootstrap_lock:
+        if get_schema_version(db) < len(MIGRATIONS):
+            _use_wal(db)
+            create_tables(db)
+    return db
+
+
+def _use_wal(db):
+    """Switch the database file to WAL mode, if it is not in WAL mode yet.
+
+    The switch needs the file to itself. If SQLite reports the database as locked, e.g. while another process is
+    migrating it, the switch is tried again until BUSY_TIMEOUT seconds have passed."""
+
+    deadline = time.monotonic() + BUSY_TIMEOUT
+    while db.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+        try:
+            db.execute("PRAGMA journal_mode = WAL")
+        except sqlite3.OperationalError as error:
+            if "locked" not in str(error) or time.monotonic() >= deadline:
+                raise
+            time.sleep(0.05)
 
 
 def get_db(name="main.db"):
-    """Create a connection to the database and return it.
-       While creating the connection, also create database tables.
+    """Return the connection to the database for the current thread.
+       The first call for a database file in a thread opens the connection (see connect), later calls reuse it.
+       While creating the connection, the database tables are created and pending migrations are applied.
+       Foreign keys are switched on for the connection so deletions cascade to the check-off dates.
 
 
     parameter:
        name(str): Name of the database to connect to. Default argument is main.db."""
 
-    db = sqlite3.connect(name)
-    create_tables(db)
+    path = _db_path(name)
+    if path is None:
+        return connect(name)
+
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    db = connections.get(path)
+    if db is None:
+        db = connections[path] = connect(name)
+    return db
+
+
+def close_db(name="main.db"):
+    """Close the current thread's cached connection to the database, if there is one.
+
+    parameter:
+       name(str): Name of the database the connection was opened with.
+    """
+
+    connections = getattr(_local, "connections", {})
+    db = connections.pop(_db_path(name), None)
+    if db is not None:
+        db.close()
+
+
+def connect_read_only(name="main.db"):
+    """Open a read-only connection to an existing database file, e.g. for worker processes that only run queries.
+    The schema is not bootstrapped and nothing can be written through the connection.
+
+    parameter:
+       name(str): Name of the database file.
+
+    returns:
+       sqlite3.Connection: A new connection that is not cached by get_db.
+    """
+
+    from urllib.request import pathname2url
+    path = _db_path(name)
+    if path is None:
+        raise ValueError("An in-memory database cannot be opened read-only from another connection.")
+    db = sqlite3.connect(f"file:{pathname2url(path)}?mode=ro", uri=True, timeout=BUSY_TIMEOUT,
+                         factory=HabitConnection)
+    db.execute("PRAGMA cache_size = -8192")
+    db.path = path
+    db.read_only = True
     return db
 
 
 def create_tables(db):
-    """Create the tables in the database if they do not exist.
+    """Create the tables in the database if they do not exist and upgrade the schema to the latest version.
 
     :parameter:
        db: Database connection from the get_db function.
     """
 
-    cur = db.cursor()
+    migrate(db)
+
+
+def _migration_base_tables(cur):
+    """Version 1: the original habit_metadata and habit_completion_dates tables."""
 
     cur.execute("""CREATE TABLE IF NOT EXISTS habit_metadata (
         habit_id INTEGER PRIMARY KEY,
@@ -41,10 +251,242 @@ def create_tables(db):
         FOREIGN KEY (habit_id) REFERENCES habit_metadata(habit_id)
     )""")
 
+
+def _migration_indexes_and_cascades(cur):
+    """Version 2: unique index on the habit name, composite index on (habit_id, completion_date) and
+    ON DELETE CASCADE from habit_completion_dates to habit_metadata.
+
+    SQLite cannot add a cascade to an existing foreign key, so habit_completion_dates is rebuilt.
+    Check-off dates that point to a habit that no longer exists are dropped during the rebuild.
+
+    The original schema allowed several habits with the same name. They are merged into the first one created, which
+    keeps the check-off dates of all of them, before the unique index is built."""
+
+    cur.execute("""UPDATE habit_completion_dates
+                   SET habit_id = (SELECT MIN(first.habit_id) FROM habit_metadata first
+                                   JOIN habit_metadata habit ON habit.name = first.name
+                                   WHERE habit.habit_id = habit_completion_dates.habit_id)
+                   WHERE habit_id IN (SELECT habit_id FROM habit_metadata WHERE name IS NOT NULL)""")
+    cur.execute("""DELETE FROM habit_metadata
+                   WHERE name IS NOT NULL AND habit_id NOT IN (SELECT MIN(habit_id) FROM habit_metadata
+                                                               WHERE name IS NOT NULL GROUP BY name)""")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_habit_metadata_name ON habit_metadata (name)")
+
+    cur.execute("""CREATE TABLE habit_completion_dates_new (
+        tracker_id INTEGER PRIMARY KEY,
+        completion_date TEXT,
+        habit_id INTEGER NOT NULL,
+        FOREIGN KEY (habit_id) REFERENCES habit_metadata(habit_id) ON DELETE CASCADE
+    )""")
+    cur.execute("""INSERT INTO habit_completion_dates_new (tracker_id, completion_date, habit_id)
+                   SELECT tracker_id, completion_date, habit_id FROM habit_completion_dates
+                   WHERE habit_id IN (SELECT habit_id FROM habit_metadata)""")
+    cur.execute("DROP TABLE habit_completion_dates")
+    cur.execute("ALTER TABLE habit_completion_dates_new RENAME TO habit_completion_dates")
+
+    cur.execute("""CREATE INDEX IF NOT EXISTS idx_completion_habit_date
+                   ON habit_completion_dates (habit_id, completion_date)""")
+
+
+def _migration_completion_day(cur):
+    """Version 3: integer completion_day column with the check-off date as days since 1970-01-01.
+    The minute timestamp in completion_date is kept; completion_day is backfilled from it and indexed together
+    with habit_id, which replaces the (habit_id, completion_date) index."""
+
+    cur.execute("ALTER TABLE habit_completion_dates ADD COLUMN completion_day INTEGER")
+    cur.execute(f"UPDATE habit_completion_dates SET completion_day = {_EPOCH_DAY_SQL}")
+    cur.execute("DROP INDEX IF EXISTS idx_completion_habit_date")
+    cur.execute("""CREATE INDEX IF NOT EXISTS idx_completion_habit_day
+                   ON habit_completion_dates (habit_id, completion_day)""")
+
+
+def _migration_streak_state(cur):
+    """Version 4: habit_streak_state table with the streak summary of each habit.
+
+    step is 1 for daily and 7 for weekly habits, day_of_week is the weekday a weekly habit must be checked off on
+    (NULL for daily habits), last_day the most recent counted check-off, current_run the streak ending on last_day and
+    longest_run the longest streak. A missing row means the summary has to be rebuilt from the check-off history."""
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS habit_streak_state (
+        habit_id INTEGER PRIMARY KEY,
+        step INTEGER NOT NULL,
+        day_of_week INTEGER,
+        last_day INTEGER,
+        current_run INTEGER NOT NULL,
+        longest_run INTEGER NOT NULL,
+        FOREIGN KEY (habit_id) REFERENCES habit_metadata(habit_id) ON DELETE CASCADE
+    )""")
+
+
+def _migration_users(cur):
+    """Version 5: users table and a user_id owner column on habit_metadata.
+
+    Existing habits are given to the default user. Habit names only have to be unique per user, so the unique name
+    index becomes (user_id, name), and (user_id, frequency) serves the per-user habit lists. habit_metadata is rebuilt
+    to add the foreign key to users."""
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    )""")
+    cur.execute("INSERT OR IGNORE INTO users VALUES (?, ?)", (DEFAULT_USER_ID, DEFAULT_USER_NAME))
+
+    cur.execute("""CREATE TABLE habit_metadata_new (
+        habit_id INTEGER PRIMARY KEY,
+        name TEXT,
+        description TEXT,
+        frequency TEXT,
+        start_date TEXT,
+        user_id INTEGER NOT NULL DEFAULT 1,
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+    )""")
+    cur.execute(f"""INSERT INTO habit_metadata_new (habit_id, name, description, frequency, start_date, user_id)
+                    SELECT habit_id, name, description, frequency, start_date, {DEFAULT_USER_ID} FROM habit_metadata""")
+    cur.execute("DROP TABLE habit_metadata")
+    cur.execute("ALTER TABLE habit_metadata_new RENAME TO habit_metadata")
+
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_habit_metadata_user_name ON habit_metadata (user_id, name)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_habit_metadata_user_frequency ON habit_metadata (user_id, frequency)")
+
+
+def _migration_start_weekday(cur):
+    """Version 6: start_weekday column on habit_metadata for the habits due on a day.
+
+    start_weekday is the day of the week of start_date (Monday is 0, as date.weekday), the only day a weekly habit is
+    due. Triggers keep it in step with start_date, however the row is written, and the (user_id, frequency,
+    start_weekday) index, which replaces the (user_id, frequency) one, finds the habits due on a day without reading
+    the others."""
+
+    cur.execute("ALTER TABLE habit_metadata ADD COLUMN start_weekday INTEGER")
+    weekday = "(CAST(strftime('%w', NEW.start_date) AS INTEGER) + 6) % 7"
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_habit_metadata_weekday_insert
+                    AFTER INSERT ON habit_metadata BEGIN
+                        UPDATE habit_metadata SET start_weekday = {weekday} WHERE habit_id = NEW.habit_id;
+                    END""")
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_habit_metadata_weekday_update
+                    AFTER UPDATE OF start_date ON habit_metadata BEGIN
+                        UPDATE habit_metadata SET start_weekday = {weekday} WHERE habit_id = NEW.habit_id;
+                    END""")
+    cur.execute("UPDATE habit_metadata SET start_weekday = (CAST(strftime('%w', start_date) AS INTEGER) + 6) % 7")
+    cur.execute("DROP INDEX IF EXISTS idx_habit_metadata_user_frequency")
+    cur.execute("""CREATE INDEX IF NOT EXISTS idx_habit_metadata_due
+                   ON habit_metadata (user_id, frequency, start_weekday)""")
+
+
+def _migration_idempotency_key(cur):
+    """Version 7: idempotency_key column on habit_completion_dates for retried check-off requests.
+
+    A client that may send a check-off twice (e.g. after a timeout) gives it a key, and the partial unique index turns
+    the second insert into a no-op (see add_habit_completion). Check-offs without a key are not affected."""
+
+    cur.execute("ALTER TABLE habit_completion_dates ADD COLUMN idempotency_key TEXT")
+    cur.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_completion_idempotency_key
+                   ON habit_completion_dates (idempotency_key) WHERE idempotency_key IS NOT NULL""")
+
+
+# Schema migrations in order. The position in the list + 1 is the schema version stored in PRAGMA user_version,
+# so new migrations must only ever be appended.
+MIGRATIONS = [
+    _migration_base_tables,
+    _migration_indexes_and_cascades,
+    _migration_completion_day,
+    _migration_streak_state,
+    _migration_users,
+    _migration_start_weekday,
+    _migration_idempotency_key,
+]
+
+
+def get_schema_version(db):
+    """Return the schema version of the database stored in PRAGMA user_version.
+
+    parameters:
+       db: Database connection from the get_db function.
+    """
+
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db):
+    """Upgrade the database in place by applying every migration newer than the stored schema version.
+
+    Each migration runs in its own transaction together with the version bump, so an interrupted upgrade leaves
+    the database at the last completed version. Foreign keys are switched off while tables are rebuilt and
+    checked again afterwards.
+
+    The transactions are taken with BEGIN IMMEDIATE and the schema version is read again inside each of them, so when
+    several processes open an old database at the same time, one of them applies each migration and the others wait
+    for it and skip the migrations that are already applied.
+
+    parameters:
+       db: Database connection from the get_db function.
+
+    returns:
+       int: The schema version after the upgrade.
+    """
+
+    version = get_schema_version(db)
+    if version >= len(MIGRATIONS):
+        return version
+
+    foreign_keys = db.execute("PRAGMA foreign_keys").fetchone()[0]
     db.commit()
+    db.execute("PRAGMA foreign_keys = OFF")
+    try:
+        while version < len(MIGRATIONS):
+            cur = db.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                version = get_schema_version(db)
+                if version < len(MIGRATIONS):
+                    MIGRATIONS[version](cur)
+                    version += 1
+                    if cur.execute("PRAGMA foreign_key_check").fetchone() is not None:
+                        raise sqlite3.IntegrityError(f"Migration to schema version {version} broke a foreign key.")
+                    cur.execute(f"PRAGMA user_version = {version}")
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+    finally:
+        db.execute(f"PRAGMA foreign_keys = {'ON' if foreign_keys else 'OFF'}")
+    return version
+
+
+def add_user(db, name):
+    """Add a user to the users table.
+
+    parameters:
+       db: Database connection from the get_db function.
+       name(str): Unique name of the user.
+
+    returns:
+       int: user_id of the new user.
+    """
 
+    cur = db.cursor()
+    cur.execute("INSERT INTO users VALUES (null,?)", (name,))
+    db.commit()
+    return cur.lastrowid
 
-def add_habit(db, name, description, frequency, start_date):
+
+def get_user_id(db, name):
+    """Get the user_id of a user searching by name.
+
+    parameters:
+       db: Database connection from the get_db function.
+       name(str): Name of the user.
+
+    returns:
+       int: user_id of the user, or None if there is no user with this name.
+    """
+
+    cur = db.cursor()
+    result = cur.execute("""SELECT user_id FROM users WHERE name = ?""", (name,)).fetchone()
+    return result[0] if result is not None else None
+
+
+def add_habit(db, name, description, frequency, start_date, user_id=DEFAULT_USER_ID):
     """Add a habit to the database.
 
     parameters:
@@ -53,44 +495,419 @@ def add_habit(db, name, description, frequency, start_date):
        description(str): Description of the habit/ purpose for habit creation.
        frequency(str): Periodicity habit should be done (Daily or Weekly).
        start_date(date): Date the habit was started.
+       user_id(int): Owner of the habit. Default is the default user (DEFAULT_USER_ID).
     """
 
     cur = db.cursor()
-    cur.execute("INSERT INTO habit_metadata VALUES (null,?,?,?,?)", (name, description, frequency, start_date))
+    cur.execute("""INSERT INTO habit_metadata (name, description, frequency, start_date, user_id) VALUES (?,?,?,?,?)""",
+                (name, description, frequency, start_date, user_id))
     db.commit()
+    _metadata_cache.pop((_db_key(db), user_id, name))
 
 
-def get_primary_key(db, name):
+def get_primary_key(db, name, user_id=DEFAULT_USER_ID):
     """Get the primary key of the habit from the parent table habit_metadata searching by name.
 
     parameters:
        db: Database connection from the get_db function.
        name(str): Name of the habit.
+       user_id(int): Owner of the habit. Default is the default user (DEFAULT_USER_ID).
     """
 
     cur = db.cursor()
-    result = cur.execute("""SELECT habit_id FROM habit_metadata WHERE name = ?""", (name,))
+    result = cur.execute("""SELECT habit_id FROM habit_metadata WHERE user_id = ? AND name = ?""", (user_id, name))
     return result.fetchone()[0]
 
 
-def add_habit_completion(db, habit_id, completion_date=None):
+class LRUCache:
+    """Bounded least-recently-used cache with hit and miss counters.
+
+    Keys are tuples that start with the database they belong to (see discard). Every key has a generation that
+    changes when its entry is removed, so a value read from the database while a writer changed it is not cached
+    (see generation).
+
+    attributes:
+        maxsize(int): Maximum number of entries. The least recently used entry is dropped when it is exceeded.
+        hits(int): Number of get calls that found an entry.
+        misses(int): Number of get calls that did not find an entry.
+    """
+
+    def __init__(self, maxsize=128):
+        """
+        Initialize an empty cache.
+
+        parameters:
+           maxsize(int): Maximum number of entries.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Number of entries in the cache."""
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the entry for the key and mark it as recently used, or None if it is not cached."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def generation(self, key):
+        """Return the generation of the entry for the key, which changes whenever it is removed with pop, discard or
+        clear. A reader takes it before reading the value from the database and passes it to put."""
+        with self._lock:
+            return self._epoch, self._generations.get(key, 0)
+
+    def put(self, key, value, generation=None):
+        """Add or replace the entry for the key, dropping the least recently used entries over maxsize.
+
+        If generation is given and the entry was removed since it was taken (a writer changed the data while it was
+        read), the value may be stale and is not cached."""
+        with self._lock:
+            if generation is not None and (self._epoch, self._generations.get(key, 0)) != generation:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        """Remove the entry for the key, if there is one, and start a new generation for it (see generation)."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+            if len(self._generations) > 4 * self.maxsize:
+                # Forget the counters of all keys and start a new epoch, so the generations taken before stay stale.
+                self._generations.clear()
+                self._epoch += 1
+
+    def discard(self, database):
+        """Remove the entries of one database (the first item of their keys) and start a new generation for all
+        keys."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == database]:
+                del self._entries[key]
+            self._generations.clear()
+            self._epoch += 1
+
+    def clear(self):
+        """Remove all entries, start a new generation for all keys and reset the hit and miss counters."""
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._epoch += 1
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """Return the hits, misses, current size and maximum size of the cache as a dictionary."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "maxsize": self.maxsize}
+
+
+# Read-through cache of get_day_list results keyed by (database, habit_id). Adding check-offs, resetting or deleting
+# a habit removes its entry. Set day_list_cache.maxsize to change how many habits are kept.
+day_list_cache = LRUCache(maxsize=256)
+
+
+# In-process cache of get_habit_metadata results keyed by (database, user_id, habit name). Entries are removed by
+# add_habit, reset_habit and delete_habit, and all entries of a database when another connection commits to it.
+_metadata_cache = LRUCache(maxsize=1024)
+
+
+def get_habit_metadata(db, name, user_id=DEFAULT_USER_ID):
+    """Get the habit_id, frequency and start_date of a habit with one lookup on the unique name index.
+    The result is cached in the process, so repeated analyses of the same habit do not query habit_metadata again.
+    Like get_day_list, results of in-memory databases are not cached and the cached results of a database are dropped
+    when another connection commits to it.
+
+    parameters:
+       db: Database connection from the get_db function.
+       name(str): Name of the habit.
+       user_id(int): Owner of the habit. Default is the default user (DEFAULT_USER_ID).
+
+    returns:
+       tuple: habit_id, frequency and start_date of the habit, or None if there is no habit with this name.
+    """
+
+    database = _cached_database(db)
+    key = (database, user_id, name)
+    metadata = _metadata_cache.get(key) if database is not None else None
+    if metadata is None:
+        generation = _metadata_cache.generation(key)
+        cur = db.cursor()
+        result = cur.execute("""SELECT habit_id, frequency, start_date FROM habit_metadata
+                                WHERE user_id = ? AND name = ?""", (user_id, name))
+        metadata = result.fetchone()
+        if metadata is not None and database is not None:
+            _metadata_cache.put(key, metadata, generation)
+    return metadata
+
+
+def clear_metadata_cache():
+    """Empty the in-process cache of get_habit_metadata, e.g. to measure uncached lookups."""
+
+    _metadata_cache.clear()
+
+
+def add_habit_completion(db, habit_id, completion_date=None, idempotency_key=None):
     """Add a completion date to the habit_completion_dates table with the associated habit_id.
 
+    The check-off is not added if a check-off with the same idempotency_key was saved before, or, with unique
+    check-offs switched on (see set_unique_check_offs), if the habit was already checked off on that day.
+
     parameters:
        db: Database connection from the get_db function.
        habit_id(int): Primary key of the habit to be used as the foreign key.
        completion_date(str): Date the habit was completed. Default is the current date.
+       idempotency_key(str): Key of the client request, so a retried request is saved once. Default is no key.
+
+    returns:
+       bool: True if the check-off was added, False if it was a duplicate.
     """
 
     cur = db.cursor()
     if completion_date is None:
         from datetime import datetime
         completion_date = datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M")
-    cur.execute("INSERT INTO habit_completion_dates VALUES (null,?,?)", (completion_date, habit_id))
+    day = completion_day(completion_date)
+    cur.execute(_INSERT_COMPLETION, (completion_date, habit_id, day, idempotency_key))
+    added = cur.rowcount == 1
+    if added:
+        _update_streak_state(cur, habit_id, [day])
     db.commit()
+    day_list_cache.pop((_db_key(db), habit_id))
+    return added
 
 
-def search_habit(db, name):
+def add_habit_completions_bulk(db, habit_id, dates):
+    """Add many completion dates for one habit to the habit_completion_dates table in a single transaction.
+    All rows are inserted with one executemany call and committed once, instead of one commit per date. If some rows
+    are left out as duplicates, the streak summary of the habit is rebuilt on the next lookup (see _insert_completions).
+
+    parameters:
+       db: Database connection from the get_db function.
+       habit_id(int): Primary key of the habit to be used as the foreign key.
+       dates(iterable of str): Dates the habit was completed in the format YYYY-MM-DD HH:MM.
+
+    returns:
+       tuple: Number of rows inserted (duplicates left out by unique check-offs are not counted) and the insert
+              rate in rows per second.
+    """
+
+    rows = [(completion_date, habit_id, completion_day(completion_date), None) for completion_date in dates]
+    start = time.perf_counter()
+    with db:
+        cur = db.cursor()
+        inserted, days = _insert_completions(cur, rows)
+        _update_streak_state(cur, habit_id, days.get(habit_id, []))
+    day_list_cache.pop((_db_key(db), habit_id))
+    elapsed = time.perf_counter() - start
+    rows_per_second = len(rows) / elapsed if elapsed > 0 else float("inf")
+    return inserted, rows_per_second
+
+
+def add_completions_batch(db, completions):
+    """Add completion dates of any number of habits to the habit_completion_dates table in a single transaction.
+    This is the group commit used by writers that collect check-offs from many callers (see async_api).
+
+    If the batch cannot be saved, for example because one habit_id does not exist, the transaction is rolled back and
+    every row is saved in a transaction of its own instead, so only the rows that fail are lost. Duplicates (see
+    add_habit_completion) are left out and count as saved, so a retried request succeeds.
+
+    parameters:
+       db: Database connection from the get_db function.
+       completions(list of tuple): habit_id and completion date (YYYY-MM-DD HH:MM) of every check-off, optionally
+           followed by an idempotency key.
+
+    returns:
+       list: None for every saved row, or the exception raised while saving it, in the order of completions.
+    """
+
+    rows = [(completion_date, habit_id, completion_day(completion_date), key[0] if key else None)
+            for habit_id, completion_date, *key in completions]
+    try:
+        with db:
+            cur = db.cursor()
+            for habit_id, habit_days in _insert_completions(cur, rows)[1].items():
+                _update_streak_state(cur, habit_id, habit_days)
+        results = [None] * len(rows)
+    except sqlite3.Error as error:
+        if len(rows) == 1:
+            return [error]
+        results = [add_completions_batch(db, [completion])[0] for completion in completions]
+    key = _db_key(db)
+    for habit_id in {row[1] for row in rows}:
+        day_list_cache.pop((key, habit_id))
+    return results
+
+
+def _insert_completions(cur, rows):
+    """Insert check-off rows (completion_date, habit_id, completion_day, idempotency_key) in the open transaction with
+    one executemany call.
+
+    The rowcount of executemany only tells how many rows were inserted, not which rows were left out as duplicates.
+    If any were left out, None is added to the days of every habit of the batch, so their streak summaries are
+    removed and rebuilt instead of counting a day that was not inserted (see _update_streak_state).
+
+    returns:
+        tuple: Number of rows inserted, and a dict of habit_id to the epoch days of its rows.
+    """
+    cur.executemany(_INSERT_COMPLETION, rows)
+    inserted = cur.rowcount
+    days = {}
+    for row in rows:
+        days.setdefault(row[1], []).append(row[2])
+    if inserted < len(rows):
+        for habit_days in days.values():
+            habit_days.append(None)
+    return inserted, days
+
+
+def _update_streak_state(cur, habit_id, days):
+    """Advance the streak summary of a habit in habit_streak_state for newly added check-off days.
+
+    Days that arrive in order (on or after the last counted check-off) update the summary in constant time.
+    A day before the last counted check-off, or a date that could not be read, removes the summary instead, so it is
+    rebuilt from the whole history on the next lookup. If there is no summary yet, nothing is done.
+
+    parameters:
+        cur: Cursor of the transaction that added the check-off dates.
+        habit_id(int): Primary key of the habit.
+        days(list of int): Epoch days of the check-off dates that were added.
+    """
+    state = cur.execute("""SELECT step, day_of_week, last_day, current_run, longest_run FROM habit_streak_state
+                           WHERE habit_id = ?""", (habit_id,)).fetchone()
+    if state is None:
+        return
+    step, day_of_week, last_day, current_run, longest_run = state
+
+    if None in days:
+        cur.execute("DELETE FROM habit_streak_state WHERE habit_id = ?", (habit_id,))
+        return
+    for day in sorted(days):
+        if day_of_week is not None and epoch_weekday(day) != day_of_week:
+            continue
+        if last_day is not None and day < last_day:
+            cur.execute("DELETE FROM habit_streak_state WHERE habit_id = ?", (habit_id,))
+            return
+        if last_day is not None and day == last_day:
+            continue
+        current_run = current_run + 1 if last_day is not None and day - last_day == step else 1
+        longest_run = max(longest_run, current_run)
+        last_day = day
+    cur.execute("""UPDATE habit_streak_state SET last_day = ?, current_run = ?, longest_run = ? WHERE habit_id = ?""",
+                (last_day, current_run, longest_run, habit_id))
+
+
+def get_streak_state(db, habit_id):
+    """Get the streak summary of a habit from the habit_streak_state table.
+
+    parameters:
+        db: Database connection from the get_db function.
+        habit_id(int): Primary key of the habit.
+
+    returns:
+        tuple: step, day_of_week, last_day, current_run and longest_run, or None if the summary has to be rebuilt.
+    """
+    cur = db.cursor()
+    result = cur.execute("""SELECT step, day_of_week, last_day, current_run, longest_run FROM habit_streak_state
+                            WHERE habit_id = ?""", (habit_id,))
+    return result.fetchone()
+
+
+def save_streak_state(db, habit_id, step, day_of_week, last_day, current_run, longest_run):
+    """Save the streak summary of a habit that was rebuilt from its check-off history.
+
+    parameters:
+        db: Database connection from the get_db function.
+        habit_id(int): Primary key of the habit.
+        step(int): Days between two check-offs of a streak. (1 for daily habits, 7 for weekly habits)
+        day_of_week(int): Weekday a weekly habit must be checked off on, None for daily habits.
+        last_day(int): Epoch day of the most recent counted check-off, None if there is none.
+        current_run(int): Streak ending on last_day.
+        longest_run(int): Longest streak of the habit.
+    """
+    cur = db.cursor()
+    cur.execute("INSERT OR REPLACE INTO habit_streak_state VALUES (?,?,?,?,?,?)",
+                (habit_id, step, day_of_week, last_day, current_run, longest_run))
+    db.commit()
+
+
+@contextmanager
+def _write_transaction(db):
+    """Run the block in a write transaction that is committed when the block ends, or rolled back if it raises.
+
+    If the caller already has a transaction open, the block runs in a savepoint of it instead, so the caller's
+    uncommitted writes are neither committed nor rolled back here. Otherwise the transaction is started with
+    BEGIN IMMEDIATE, so no other connection can write between the reads and the writes of the block.
+
+    parameters:
+        db: Database connection from the get_db function.
+    """
+    if db.in_transaction:
+        db.execute("SAVEPOINT write_transaction")
+        try:
+            yield
+        except BaseException:
+            db.execute("ROLLBACK TO write_transaction")
+            db.execute("RELEASE write_transaction")
+            raise
+        db.execute("RELEASE write_transaction")
+        return
+
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        db.rollback()
+        raise
+    db.commit()
+
+
+def rebuild_streak_state(db, habit_id, step, day_of_week, streaks):
+    """Rebuild the streak summary of a habit from its check-off history and save it.
+
+    The history is read from the table, not from day_list_cache, and the summary is saved in the same write
+    transaction (see _write_transaction), so a check-off committed by another connection in between cannot be left
+    out of the saved summary. If the caller has a transaction open, the summary is saved in it without committing it.
+    On a read-only connection the summary is calculated but not saved.
+
+    parameters:
+        db: Database connection from the get_db function.
+        habit_id(int): Primary key of the habit.
+        step(int): Days between two check-offs of a streak. (1 for daily habits, 7 for weekly habits)
+        day_of_week(int): Weekday a weekly habit must be checked off on, None for daily habits.
+        streaks: Function that returns the longest_run, current_run and last_day of a list of epoch days, the step and
+            the day_of_week (see analyse._python_streaks).
+
+    returns:
+        tuple: step, day_of_week, last_day, current_run and longest_run (see get_streak_state)
+    """
+    query = """SELECT completion_day FROM habit_completion_dates WHERE habit_id = ? ORDER BY completion_day DESC"""
+    if db.read_only:
+        longest_run, current_run, last_day = streaks([row[0] for row in db.execute(query, (habit_id,))],
+                                                     step, day_of_week)
+        return step, day_of_week, last_day, current_run, longest_run
+
+    with _write_transaction(db):
+        longest_run, current_run, last_day = streaks([row[0] for row in db.execute(query, (habit_id,))],
+                                                     step, day_of_week)
+        db.execute("INSERT OR REPLACE INTO habit_streak_state VALUES (?,?,?,?,?,?)",
+                   (habit_id, step, day_of_week, last_day, current_run, longest_run))
+    return step, day_of_week, last_day, current_run, longest_run
+
+
+def search_habit(db, name, user_id=DEFAULT_USER_ID):
     """Search for a habit in the habit_metadata table.
        This function provides the ability to search for a habit by name, to ensure the habit is not
        duplicated in the database.
@@ -98,22 +915,24 @@ def search_habit(db, name):
     parameters:
        db: Database connection from the get_db function.
        name(str): Name of the habit to search for.
+       user_id(int): Owner of the habit. Default is the default user (DEFAULT_USER_ID).
     """
 
     cur = db.cursor()
     try:
-        result = cur.execute("""SELECT * FROM habit_metadata WHERE name = ?""", (name,))
+        result = cur.execute("""SELECT * FROM habit_metadata WHERE user_id = ? AND name = ?""", (user_id, name))
         return result.fetchone()[1]
     except TypeError:
         return None
 
 
-def search_start_date(db, name):
+def search_start_date(db, name, user_id=DEFAULT_USER_ID):
     """Search for a habit in the habit_metadata table by name and return the start date.
 
     parameters:
        db: Database connection from the get_db function.
        name(str): Name of the habit to search for.
+       user_id(int): Owner of the habit. Default is the default user (DEFAULT_USER_ID).
 
     return:
         start_date(str): Start date of the habit.
@@ -121,17 +940,18 @@ def search_start_date(db, name):
 
     cur = db.cursor()
     try:
-        result = cur.execute("""SELECT * FROM habit_metadata WHERE name = ?""", (name,))
+        result = cur.execute("""SELECT * FROM habit_metadata WHERE user_id = ? AND name = ?""", (user_id, name))
         return result.fetchone()[4]
     except TypeError:
         return None
 
 
-def list_of_habits(db):
-    """Creates a list of names of all habits in the database.
+def list_of_habits(db, user_id=DEFAULT_USER_ID):
+    """Creates a list of names of all habits of a user in the database.
 
     parameters:
         db: Database connection from the get_db function.
+        user_id(int): Owner of the habits. Default is the default user (DEFAULT_USER_ID).
 
     returns:
         result.fetchall(): List of habits in the habit_metadata table.
@@ -140,79 +960,332 @@ def list_of_habits(db):
 
     cur = db.cursor()
     try:
-        result = cur.execute("""SELECT name FROM habit_metadata""")
+        result = cur.execute("""SELECT name FROM habit_metadata WHERE user_id = ? ORDER BY habit_id""", (user_id,))
         return result.fetchall()
     except TypeError:
         return None
 
 
-def list_of_habits_daily(db):
+def list_of_habits_daily(db, user_id=DEFAULT_USER_ID):
     """Provides a list of habits with the frequency daily.
 
     parameters:
         db: Database connection from the get_db function.
+        user_id(int): Owner of the habits. Default is the default user (DEFAULT_USER_ID).
     """
 
     cur = db.cursor()
     try:
-        result = cur.execute("""SELECT name FROM habit_metadata WHERE frequency = "Daily" """)
+        result = cur.execute("""SELECT name FROM habit_metadata WHERE user_id = ? AND frequency = "Daily"
+                                ORDER BY habit_id""", (user_id,))
         return result.fetchall()
     except TypeError:
         return None
 
 
-def list_of_habits_weekly(db):
+def list_of_habits_weekly(db, user_id=DEFAULT_USER_ID):
     """Provides a list of habits with the frequency weekly.
 
     parameters:
         db: Database connection from the get_db function.
+        user_id(int): Owner of the habits. Default is the default user (DEFAULT_USER_ID).
     """
 
     cur = db.cursor()
     try:
-        result = cur.execute("""SELECT name FROM habit_metadata WHERE frequency = "Weekly" """)
+        result = cur.execute("""SELECT name FROM habit_metadata WHERE user_id = ? AND frequency = "Weekly"
+                                ORDER BY habit_id""", (user_id,))
         return result.fetchall()
     except TypeError:
         return None
 
 
+def get_habits_by_name(db, names, user_id=DEFAULT_USER_ID):
+    """Get the habit_id, frequency and start_date of many habits of a user by name, with one query per 500 names.
+
+    parameters:
+        db: Database connection from the get_db function.
+        names(list of str): Names of the habits.
+        user_id(int): Owner of the habits. Default is the default user (DEFAULT_USER_ID).
+
+    returns:
+        dict: Name of every habit that was found, with a tuple of its habit_id, frequency and start_date.
+    """
+
+    names = list(names)
+    habits = {}
+    cur = db.cursor()
+    for start in range(0, len(names), 500):
+        chunk = names[start:start + 500]
+        result = cur.execute(f"""SELECT name, habit_id, frequency, start_date FROM habit_metadata
+                                 WHERE user_id = ? AND name IN ({", ".join("?" * len(chunk))})""", (user_id, *chunk))
+        habits.update((name, (habit_id, frequency, start_date)) for name, habit_id, frequency, start_date in result)
+    return habits
+
+
+def habits_due(db, on=None, user_id=DEFAULT_USER_ID):
+    """Provides the habits that are due on a day and have not been checked off on it yet: the daily habits that have
+    started and the weekly habits whose start date was on the same day of the week.
+
+    One query answers this for all habits: the daily habits and the weekly habits that start on the day of the week
+    are two searches of the (user_id, frequency, start_weekday) index, and for each of them the check-off on the day
+    and the most recent check-off are single lookups in the (habit_id, completion_day) index.
+
+    parameters:
+        db: Database connection from the get_db function.
+        on(date): The day to check. Default is today.
+        user_id(int): Owner of the habits. Default is the default user (DEFAULT_USER_ID).
+
+    returns:
+        list: Tuples of name, frequency and the date of the most recent check-off (None if the habit has never been
+              checked off), in the order the habits were created.
+    """
+    on = on or date.today()
+    cur = db.cursor()
+    result = cur.execute("""
+        WITH due AS (
+            SELECT habit_id, name, frequency FROM habit_metadata
+            WHERE user_id = :user_id AND frequency = 'Daily' AND start_date <= :day
+            UNION ALL
+            SELECT habit_id, name, frequency FROM habit_metadata
+            WHERE user_id = :user_id AND frequency = 'Weekly' AND start_weekday = :weekday AND start_date <= :day)
+        SELECT due.name, due.frequency,
+               (SELECT MAX(c.completion_day) FROM habit_completion_dates c WHERE c.habit_id = due.habit_id)
+        FROM due
+        WHERE NOT EXISTS (SELECT 1 FROM habit_completion_dates c
+                          WHERE c.habit_id = due.habit_id AND c.completion_day = :epoch_day)
+        ORDER BY due.habit_id""", {"user_id": user_id, "day": on.isoformat(), "weekday": on.weekday(),
+                                   "epoch_day": to_epoch_day(on)})
+    return [(name, frequency, None if last_day is None else from_epoch_day(last_day))
+            for name, frequency, last_day in result]
+
+
+def get_habits(db, user_id=DEFAULT_USER_ID):
+    """Get every habit of a user with all its metadata in one query.
+
+    parameters:
+        db: Database connection from the get_db function.
+        user_id(int): Owner of the habits. Default is the default user (DEFAULT_USER_ID).
+
+    returns:
+        list: Tuples of habit_id, name, description, frequency and start_date, in the order the habits were created.
+    """
+
+    cur = db.cursor()
+    result = cur.execute("""SELECT habit_id, name, description, frequency, start_date FROM habit_metadata
+                            WHERE user_id = ? ORDER BY habit_id""", (user_id,))
+    return result.fetchall()
+
+
+def get_day_list(db, habit_id):
+    """Get the completion days for a habit based on habit_id, most recent first.
+    The days are epoch days (see to_epoch_day) read from the completion_day column already sorted by SQLite
+    through the (habit_id, completion_day) index, so no dates are parsed.
+
+    The result is kept in day_list_cache, so analysing the same habit again in one session does not read the
+    check-off history again. It is returned as a tuple because the cached value is shared. A result read while
+    another thread saved check-offs of the habit is not cached (see LRUCache.generation), the cached lists of a
+    database are dropped when another connection commits to it (see _cached_database), and the lists of in-memory
+    databases are not cached.
+
+    parameters:
+        db: Database connection from the get_db function.
+        habit_id(int): Primary key of the habit.
+    """
+    database = _cached_database(db)
+    key = (database, habit_id)
+    days = day_list_cache.get(key) if database is not None else None
+    if days is None:
+        generation = day_list_cache.generation(key)
+        cur = db.cursor()
+        result = cur.execute("""SELECT completion_day FROM habit_completion_dates WHERE habit_id = ?
+                                ORDER BY completion_day DESC""", (habit_id,))
+        days = tuple(day[0] for day in result.fetchall())
+        if database is not None:
+            day_list_cache.put(key, days, generation)
+    return days
+
+
+def get_completion_day_range(db, habit_id):
+    """Get the first and the most recent completion day of a habit.
+    Each is a single lookup at one end of the (habit_id, completion_day) index, however long the history is.
+
+    parameters:
+        db: Database connection from the get_db function.
+        habit_id(int): Primary key of the habit.
+
+    returns:
+        tuple: Epoch days of the first and the most recent check-off, (None, None) if there are no check-offs.
+    """
+    cur = db.cursor()
+    result = cur.execute("""SELECT (SELECT MIN(completion_day) FROM habit_completion_dates WHERE habit_id = :habit_id),
+                                   (SELECT MAX(completion_day) FROM habit_completion_dates WHERE habit_id = :habit_id)
+                         """, {"habit_id": habit_id})
+    return result.fetchone()
+
+
+# Number of rows read from SQLite at a time by the iter_completion_* generators.
+FETCH_CHUNK_SIZE = 256
+
+
+def iter_completion_days(db, habit_id, since=None, until=None, order="desc"):
+    """Stream the completion days of a habit from the database in SQL-sorted order.
+
+    The rows are read from the cursor in chunks of FETCH_CHUNK_SIZE, so a caller that stops early (for example at the
+    first gap of a streak) never reads the rest of the history.
+
+    parameters:
+        db: Database connection from the get_db function.
+        habit_id(int): Primary key of the habit.
+        since(date or int): Only days on or after this date or epoch day. Default is no lower limit.
+        until(date or int): Only days on or before this date or epoch day. Default is no upper limit.
+        order(str): "desc" for the most recent day first (default) or "asc" for the oldest day first.
+
+    yields:
+        int: Epoch days of the check-off dates (see to_epoch_day).
+    """
+    if order not in ("asc", "desc"):
+        raise ValueError('order must be "asc" or "desc".')
+
+    query = "SELECT completion_day FROM habit_completion_dates WHERE habit_id = ?"
+    parameters = [habit_id]
+    if since is not None:
+        query += " AND completion_day >= ?"
+        parameters.append(to_epoch_day(since) if isinstance(since, date) else since)
+    if until is not None:
+        query += " AND completion_day <= ?"
+        parameters.append(to_epoch_day(until) if isinstance(until, date) else until)
+    query += f" ORDER BY completion_day {order.upper()}"
+
+    cur = db.cursor()
+    cur.execute(query, parameters)
+    while True:
+        rows = cur.fetchmany(FETCH_CHUNK_SIZE)
+        if not rows:
+            return
+        for row in rows:
+            yield row[0]
+
+
+def iter_completion_dates(db, habit_id, since=None, until=None, order="desc"):
+    """Stream the completion dates of a habit from the database in SQL-sorted order.
+    Same as iter_completion_days, but yields each check-off as a date.
+
+    parameters:
+        db: Database connection from the get_db function.
+        habit_id(int): Primary key of the habit.
+        since(date): Only dates on or after this date. Default is no lower limit.
+        until(date): Only dates on or before this date. Default is no upper limit.
+        order(str): "desc" for the most recent date first (default) or "asc" for the oldest date first.
+
+    yields:
+        date: The check-off dates.
+    """
+    for day in iter_completion_days(db, habit_id, since, until, order):
+        yield from_epoch_day(day)
+
+
 def get_date_list(db, habit_id):
-    """Get a list of completion dates for a habit based on habit_id.
+    """Get a list of completion dates for a habit based on habit_id, most recent first.
 
     parameters:
         db: Database connection from the get_db function.
         habit_id(int): Primary key of the habit.
     """
+    return [from_epoch_day(day) for day in get_day_list(db, habit_id)]
+
+
+def get_longest_streaks(db, user_id=DEFAULT_USER_ID):
+    """Get the longest streak of every daily and weekly habit with one query over habit_completion_dates.
+
+    The streaks are found in SQL with the gaps-and-islands method: the check-off days of each habit are numbered in
+    order with ROW_NUMBER(), and day - step * row_number is the same for every day of one streak (step is 1 day for
+    daily habits and 7 days for weekly habits). Weekly habits only count check-offs on the weekday of their
+    start_date, and repeated check-offs on the same day are counted once.
+
+    parameters:
+        db: Database connection from the get_db function.
+        user_id(int): Owner of the habits. Default is the default user (DEFAULT_USER_ID).
+
+    returns:
+        list: Tuples of habit name, frequency and longest streak, in the order the habits were created.
+              Habits without check-offs have a longest streak of 0.
+    """
     cur = db.cursor()
-    result = cur.execute("""SELECT habit_id, completion_date FROM habit_completion_dates WHERE habit_id = ?""",
-                         (habit_id,))
-    date_list = result.fetchall()
+    result = cur.execute("""
+        WITH days AS (
+            SELECT DISTINCT c.habit_id, c.completion_day AS day,
+                   CASE m.frequency WHEN 'Weekly' THEN 7 ELSE 1 END AS step
+            FROM habit_metadata m JOIN habit_completion_dates c ON c.habit_id = m.habit_id
+            WHERE m.user_id = :user_id AND c.completion_day IS NOT NULL
+              AND (m.frequency = 'Daily'
+                   OR (m.frequency = 'Weekly'
+                       AND (c.completion_day - CAST(julianday(m.start_date) - 2440587.5 AS INTEGER)) % 7 = 0))
+        ),
+        islands AS (
+            SELECT habit_id, day - step * ROW_NUMBER() OVER (PARTITION BY habit_id ORDER BY day) AS island
+            FROM days
+        ),
+        runs AS (
+            SELECT habit_id, COUNT(*) AS run FROM islands GROUP BY habit_id, island
+        )
+        SELECT m.name, m.frequency, COALESCE(MAX(r.run), 0)
+        FROM habit_metadata m LEFT JOIN runs r ON r.habit_id = m.habit_id
+        WHERE m.user_id = :user_id AND m.frequency IN ('Daily', 'Weekly')
+        GROUP BY m.habit_id
+        ORDER BY m.habit_id""", {"user_id": user_id})
+    return result.fetchall()
+
 
-    dates = []
-    for day in date_list:
-        day = datetime.strptime(day[1], "%Y-%m-%d %H:%M").date()
-        dates.append(day)
-    dates.sort(reverse=True)
-    return dates
+def get_monthly_completions(db, month, cutoff_day, user_id=DEFAULT_USER_ID):
+    """Count the check-off events of every daily and weekly habit in a month with one grouped query.
 
+    Only check-offs after cutoff_day are read, using the range on the (habit_id, completion_day) index, and the month
+    is taken from the epoch day, so the query does not need to read the completion_date strings.
 
-def delete_habit(db, name):
+    parameters:
+        db: Database connection from the get_db function.
+        month(int): Numerical value of month for date retrieval.
+        cutoff_day(int): Epoch day; only check-offs after this day are counted.
+        user_id(int): Owner of the habits. Default is the default user (DEFAULT_USER_ID).
+
+    returns:
+        list: Tuples of habit name, frequency and number of check-off events, in ascending order of the number of
+              check-off events (habits with the same number in the order they were created).
+    """
+    cur = db.cursor()
+    result = cur.execute("""
+        SELECT m.name, m.frequency, COUNT(c.completion_day) AS check_offs
+        FROM habit_metadata m
+        LEFT JOIN habit_completion_dates c
+            ON c.habit_id = m.habit_id AND c.completion_day > ?
+            AND CAST(strftime('%m', c.completion_day + 2440587.5) AS INTEGER) = ?
+        WHERE m.user_id = ? AND m.frequency IN ('Daily', 'Weekly')
+        GROUP BY m.habit_id
+        ORDER BY check_offs, m.habit_id""", (cutoff_day, month, user_id))
+    return result.fetchall()
+
+
+def delete_habit(db, name, user_id=DEFAULT_USER_ID):
     """Deletes habit from the habit_metadata table and all dates from the
     habit_completion_dates table by first searching for the habit_id through the get_primary_key
-    function, and using this argument for cascade deletion.
+    function, and using this argument for cascade deletion. (The foreign key ON DELETE CASCADE removes
+    the check-off dates together with the habit.)
 
     parameters:
         db: Database connection from the get_db function.
         name(str): Name of the habit used to search for habit_id to be deleted.
+        user_id(int): Owner of the habit. Default is the default user (DEFAULT_USER_ID).
     """
     cur = db.cursor()
-    habit_id = get_primary_key(db, name)
-    cur.execute("DELETE FROM habit_completion_dates WHERE habit_id = ?", (habit_id,))
+    habit_id = get_primary_key(db, name, user_id)
     cur.execute("DELETE FROM habit_metadata WHERE habit_id = ?", (habit_id,))
     db.commit()
+    _metadata_cache.pop((_db_key(db), user_id, name))
+    day_list_cache.pop((_db_key(db), habit_id))
 
 
-def reset_habit(db, name, start_date=None):
+def reset_habit(db, name, start_date=None, user_id=DEFAULT_USER_ID):
     """This function searches for the habit_id using the name as an argument in the get_primary_key function.
     The corresponding dates associated with this habit_id are deleted from the habit_completion_dates table.
     The associated start_date is changed to the date provided in the start_date parameter.
@@ -221,9 +1294,92 @@ def reset_habit(db, name, start_date=None):
         db: Database connection from the get_db function.
         name(str): Name of the habit used to search for habit_id
         start_date(str): Date the habit is reset to.
+        user_id(int): Owner of the habit. Default is the default user (DEFAULT_USER_ID).
    """
     cur = db.cursor()
-    habit_id = get_primary_key(db, name)
+    habit_id = get_primary_key(db, name, user_id)
     cur.execute("DELETE FROM habit_completion_dates WHERE habit_id = ?", (habit_id,))
     cur.execute("UPDATE habit_metadata SET start_date = ? WHERE habit_id = ?", (start_date, habit_id))
+    cur.execute("DELETE FROM habit_streak_state WHERE habit_id = ?", (habit_id,))
     db.commit()
+    _metadata_cache.pop((_db_key(db), user_id, name))
+    day_list_cache.pop((_db_key(db), habit_id))
+
+
+def unique_check_offs(db):
+    """Return True if unique check-offs are switched on, i.e. a habit can only be checked off once a day.
+    See set_unique_check_offs."""
+
+    for _, name, unique, *_ in db.execute("PRAGMA index_list(habit_completion_dates)"):
+        if name == "idx_completion_habit_day":
+            return bool(unique)
+    return False
+
+
+def _remove_repeated_check_offs(cur):
+    """Delete the repeated check-offs of a habit on the same day in the open transaction, keeping the first one saved.
+
+    returns:
+        tuple: Number of check-offs removed and the habit_ids they belonged to.
+    """
+    duplicate = """EXISTS (SELECT 1 FROM habit_completion_dates first
+                           WHERE first.habit_id = habit_completion_dates.habit_id
+                           AND first.completion_day = habit_completion_dates.completion_day
+                           AND first.tracker_id < habit_completion_dates.tracker_id)"""
+    habit_ids = [row[0] for row in cur.execute(f"SELECT DISTINCT habit_id FROM habit_completion_dates "
+                                               f"WHERE {duplicate}")]
+    cur.execute(f"DELETE FROM habit_completion_dates WHERE {duplicate}")
+    return cur.rowcount, habit_ids
+
+
+def compact_check_offs(db, vacuum=False):
+    """Remove repeated check-offs of a habit on the same day, keeping the first one saved.
+
+    The streaks do not change, as they count days, but get_monthly_completions counts each day once afterwards and
+    every scan of the check-offs reads fewer rows. Check-offs whose date could not be read are kept.
+
+    parameters:
+        db: Database connection from the get_db function.
+        vacuum(bool): Also run VACUUM, so the database file shrinks by the space of the removed rows.
+
+    returns:
+        int: Number of check-offs removed.
+    """
+    with db:
+        removed, habit_ids = _remove_repeated_check_offs(db.cursor())
+    key = _db_key(db)
+    for habit_id in habit_ids:
+        day_list_cache.pop((key, habit_id))
+    if vacuum:
+        db.execute("VACUUM")
+    return removed
+
+
+def set_unique_check_offs(db, enabled=True):
+    """Switch unique check-offs on or off.
+
+    When they are on, the (habit_id, completion_day) index is a unique index, so a second check-off of a habit on the
+    same day is left out by add_habit_completion and the other insert functions. Switching them on removes the
+    repeated check-offs that are already saved first (see compact_check_offs), in the same write transaction
+    (see _write_transaction) as the index rebuild, so no check-off can be saved in between. If the caller has a
+    transaction open, the change is made in it without committing it. The setting is stored in the database.
+
+    parameters:
+        db: Database connection from the get_db function.
+        enabled(bool): True to switch unique check-offs on, False to allow repeated check-offs again.
+
+    returns:
+        int: Number of check-offs removed.
+    """
+    with _write_transaction(db):
+        if unique_check_offs(db) == enabled:
+            return 0
+        cur = db.cursor()
+        removed, habit_ids = _remove_repeated_check_offs(cur) if enabled else (0, [])
+        cur.execute("DROP INDEX IF EXISTS idx_completion_habit_day")
+        cur.execute(f"""CREATE {"UNIQUE" if enabled else ""} INDEX idx_completion_habit_day
+                        ON habit_completion_dates (habit_id, completion_day)""")
+    key = _db_key(db)
+    for habit_id in habit_ids:
+        day_list_cache.pop((key, habit_id))
+    return removed
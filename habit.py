@@ -1,15 +1,26 @@
 """This module contains the Habit class and associated methods."""
 
 from datetime import datetime, date
-from db import get_db, add_habit, get_primary_key, add_habit_completion
+from db import (get_db, add_habit, get_primary_key, add_habit_completion, add_habit_completions_bulk, get_habits,
+                DEFAULT_USER_ID)
 
 
 class Habit:
-    """This is the Habit Class and associated methods."""
+    """This is the Habit Class and associated methods.
+
+    The attributes are kept in __slots__, so a Habit is a small record without an instance dictionary, and the
+    database connection is only looked up when it is first needed (see the db property).
+    """
+
+    __slots__ = ("name", "description", "frequency", "start_date", "user_id", "habit_id", "_db")
 
     Database = "test.db"
+    # Optional write_queue.CheckOffQueue. If it is set, add_habit_completion_date queues the check-off instead of
+    # saving it in its own transaction.
+    write_queue = None
 
-    def __init__(self, name: str = None, description: str = None, frequency: str = None, start_date: date = None):
+    def __init__(self, name: str = None, description: str = None, frequency: str = None, start_date: date = None,
+                 user_id: int = DEFAULT_USER_ID, db=None, habit_id: int = None):
         """
         Initialize Habit Instance.
 
@@ -19,16 +30,43 @@ class Habit:
            description(str): Description of the habit/ purpose for habit creation.
            frequency(str): Periodicity habit should be done. (Daily or Weekly)
            start_date(date): Date the habit was started.
-           database(str): Name of the database to connect to. (main.db or test.db)
-           self.habit_id(int): Primary key of the habit.
+           user_id(int): Owner of the habit. Default is the default user.
+           db: Database connection to use. Default is the connection of get_db for Habit.Database, opened on first use.
+           habit_id(int): Primary key of the habit, if it is already known.
         """
         self.name = (name.lower()).capitalize()
         # Capitalize the first letter of the habit name. (For consistency with test database.)
         self.description = description
         self.frequency = frequency
         self.start_date = start_date
-        self.habit_id = None
-        self.db = get_db(self.Database)
+        self.user_id = user_id
+        self.habit_id = habit_id
+        self._db = db
+
+    @property
+    def db(self):
+        """Database connection of the habit. Without an injected connection, the connection of get_db for
+        Habit.Database is looked up on first use and kept."""
+        if self._db is None:
+            self._db = get_db(self.Database)
+        return self._db
+
+    @classmethod
+    def load_all(cls, db=None, user_id=DEFAULT_USER_ID):
+        """
+        Build a Habit for every habit of a user from one query (see db.get_habits).
+
+        parameters:
+           db: Database connection shared by all the habits. Default is the connection of get_db for Habit.Database.
+           user_id(int): Owner of the habits. Default is the default user.
+
+        returns:
+           list: Habit objects with their habit_id, in the order the habits were created.
+        """
+        if db is None:
+            db = get_db(cls.Database)
+        return [cls(name, description, frequency, start_date, user_id, db=db, habit_id=habit_id)
+                for habit_id, name, description, frequency, start_date in get_habits(db, user_id)]
 
     def __str__(self):
         """
@@ -48,8 +86,8 @@ class Habit:
         """
         # Design choice to remove the check for existing habits in the database to the main.py file.
 
-        add_habit(self.db, self.name, self.description, self.frequency, self.start_date)
-        self.habit_id = get_primary_key(self.db, self.name)
+        add_habit(self.db, self.name, self.description, self.frequency, self.start_date, self.user_id)
+        self.habit_id = get_primary_key(self.db, self.name, self.user_id)
         return self.habit_id
 
     @staticmethod
@@ -78,6 +116,36 @@ class Habit:
             print("Please enter a date in the format: YYYY-MM-DD HH:MM")
             return
 
+    @staticmethod
+    def check_dates_input_past(completion_dates):
+        """
+       Check a batch of dates at once: each date must be in the correct format and not in the future.
+       Unlike check_date_input_past, the current time is read once for the whole batch and dates that do not pass
+       the check are left out instead of being saved.
+
+       parameter:
+           completion_dates(iterable of str): Dates the habit was completed.
+
+       returns:
+           list: Dates in the correct format. The number of dates left out is printed.
+        """
+        current_datetime = datetime.now()
+        checked_dates = []
+        rejected = 0
+        for completion_date in completion_dates:
+            try:
+                parsed_date = datetime.strptime(completion_date, "%Y-%m-%d %H:%M")
+            except (ValueError, TypeError):
+                rejected += 1
+                continue
+            if parsed_date > current_datetime:
+                rejected += 1
+            else:
+                checked_dates.append(datetime.strftime(parsed_date, "%Y-%m-%d %H:%M"))
+        if rejected:
+            print(f"{rejected} date(s) were in the future or not in the format: YYYY-MM-DD HH:MM")
+        return checked_dates
+
     @staticmethod
     def check_month(month):
         """Check the input of a month to make sure it is an integer and between 1-12, this is more for
@@ -106,17 +174,36 @@ class Habit:
         (This functionality is more so for testing purposes,
         as in the CLI, the only option for a check-off date is today's date.)
 
+        If Habit.write_queue is set, the check-off is handed to the write-behind queue and saved with other
+        check-offs in a later transaction.
+
         parameter:
            completion_date(str): Date the habit was completed. Default is today, if not provided.
         """
-        if completion_date is None:
-            self.habit_id = get_primary_key(self.db, self.name)
-            add_habit_completion(self.db, self.habit_id, completion_date)
-        else:
+        if completion_date is not None:
             completion_date = self.check_date_input_past(completion_date)
-            self.habit_id = get_primary_key(self.db, self.name)
+        self.habit_id = get_primary_key(self.db, self.name, self.user_id)
+        if self.write_queue is not None:
+            self.write_queue.put(self.habit_id, completion_date)
+        else:
             add_habit_completion(self.db, self.habit_id, completion_date)
 
+    def add_completion_dates(self, completion_dates):
+        """
+        Add many completion dates to the habit at once.
+
+        The dates are checked as a batch by the check_dates_input_past method, the habit_id is looked up once and
+        all dates are saved in a single transaction. (Used for loading history, e.g. the test data.)
+
+        parameter:
+           completion_dates(iterable of str): Dates the habit was completed.
+
+        returns:
+           tuple: Number of dates saved and the insert rate in rows per second.
+        """
+        completion_dates = self.check_dates_input_past(completion_dates)
+        self.habit_id = get_primary_key(self.db, self.name, self.user_id)
+        return add_habit_completions_bulk(self.db, self.habit_id, completion_dates)
 
 # Code for previous design choice using class variables and class methods.
 # Chose to switch to use of lists and dictionaries instead of instance variables for runtime storage.
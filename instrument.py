@@ -0,0 +1,254 @@
+"""This module contains the opt-in instrumentation of the database and analysis functions.
+
+enable() wraps every public function of db.py and analyse.py (and the streak engines of analyse.py) so each call
+records its wall time, CPU time and number of rows it read from the database, and traces the SQL statements run by the
+connections of the Habit Tracker with sqlite3's set_trace_callback. Nothing is recorded until enable() is called:
+
+    import instrument
+    instrument.enable()
+    ...
+    instrument.report()
+
+Functions are wrapped in every module of the Habit Tracker that imported them (e.g. `from db import get_day_list` in
+analyse.py), and disable() puts the original functions back.
+
+sqlite3 only reports when a statement starts, so the latency of a statement is measured until the next statement
+starts on the same thread or the instrumented function that ran it returns, which includes fetching its rows.
+
+Rows are counted by a row factory of the traced connections as they are fetched, so a function is charged with the
+rows read by the functions it calls on the same thread, and a result served from a cache counts no rows.
+"""
+
+import atexit
+import functools
+import inspect
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+import analyse
+import db
+
+# Private functions that are wrapped as well, because they are where the streak loops run.
+HOT_PATHS = {analyse: ("_numpy_streaks", "_python_streaks", "_streak_state")}
+
+# sqlite3 passes the statements with their parameters filled in. String and number literals are replaced by ? so the
+# runs of one statement are counted together.
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+_lock = threading.Lock()
+_local = threading.local()
+_wrappers = {}
+_connections = weakref.WeakSet()
+_function_stats = {}
+_statement_stats = {}
+_enabled = False
+
+
+def is_enabled():
+    """Return True if the instrumentation is switched on."""
+    return _enabled
+
+
+def _rows_read():
+    """Return the number of rows fetched so far on this thread from the traced connections."""
+    return getattr(_local, "rows", 0)
+
+
+def _counting_row_factory(previous):
+    """Return a row factory that counts the rows fetched on this thread and then builds them with the row factory the
+    connection had before (previous), or returns them unchanged."""
+
+    def row_factory(cursor, row):
+        _local.rows = getattr(_local, "rows", 0) + 1
+        return row if previous is None else previous(cursor, row)
+    row_factory.previous = previous
+    return row_factory
+
+
+def _record_function(name, wall, cpu, rows):
+    """Add one call to the statistics of a function."""
+    with _lock:
+        stats = _function_stats.setdefault(name, {"calls": 0, "rows": 0, "wall": 0.0, "cpu": 0.0, "max_wall": 0.0})
+        stats["calls"] += 1
+        stats["rows"] += rows
+        stats["wall"] += wall
+        stats["cpu"] += cpu
+        stats["max_wall"] = max(stats["max_wall"], wall)
+
+
+def _finish_statement():
+    """Record the latency of the statement that is running on this thread, if there is one."""
+    running = getattr(_local, "statement", None)
+    if running is None:
+        return
+    _local.statement = None
+    statement, start = running
+    latency = time.perf_counter() - start
+    with _lock:
+        stats = _statement_stats.setdefault(statement, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0})
+        stats["calls"] += 1
+        stats["seconds"] += latency
+        stats["max_seconds"] = max(stats["max_seconds"], latency)
+
+
+def _trace(statement):
+    """set_trace_callback callback: finish the previous statement of this thread and start timing this one."""
+    _finish_statement()
+    _local.statement = (_LITERAL.sub("?", " ".join(statement.split()))[:200], time.perf_counter())
+
+
+def trace_connection(connection):
+    """Trace the SQL statements of a connection and count the rows fetched through it. Connections opened by
+    db.connect while the instrumentation is switched on are traced automatically."""
+    connection.set_trace_callback(_trace)
+    if connection not in _connections:
+        connection.row_factory = _counting_row_factory(connection.row_factory)
+    _connections.add(connection)
+
+
+def _wrap(name, function):
+    """Return a wrapper of a function that records its calls. Generators are timed until they are exhausted, and only
+    the rows read while they run are counted, not those read by the caller between two items."""
+
+    if inspect.isgeneratorfunction(function):
+        @functools.wraps(function)
+        def generator_wrapper(*args, **kwargs):
+            wall, cpu, rows = time.perf_counter(), time.thread_time(), 0
+            items = function(*args, **kwargs)
+            try:
+                while True:
+                    start = _rows_read()
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        return
+                    finally:
+                        rows += _rows_read() - start
+                    yield item
+            finally:
+                items.close()
+                _finish_statement()
+                _record_function(name, time.perf_counter() - wall, time.thread_time() - cpu, rows)
+        return generator_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        wall, cpu, rows = time.perf_counter(), time.thread_time(), _rows_read()
+        try:
+            result = function(*args, **kwargs)
+            if isinstance(result, sqlite3.Connection):
+                trace_connection(result)
+            return result
+        finally:
+            _finish_statement()
+            _record_function(name, time.perf_counter() - wall, time.thread_time() - cpu, _rows_read() - rows)
+    return wrapper
+
+
+def _project_modules():
+    """Return the loaded modules of the Habit Tracker (the modules in the directory of this file)."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return [module for module in list(sys.modules.values())
+            if os.path.dirname(os.path.abspath(getattr(module, "__file__", None) or os.sep)) == directory]
+
+
+def enable(dump_on_exit=False):
+    """Switch the instrumentation on.
+
+    parameters:
+        dump_on_exit(bool): Print the summary (see report) when the program exits.
+    """
+    global _enabled
+    if _enabled:
+        return
+    for module in (db, analyse):
+        names = [name for name, value in vars(module).items()
+                 if inspect.isfunction(value) and value.__module__ == module.__name__ and not name.startswith("_")]
+        for name in names + list(HOT_PATHS.get(module, ())):
+            function = getattr(module, name)
+            _wrappers[function] = _wrap(f"{module.__name__}.{name}", function)
+
+    for module in _project_modules():
+        if module.__name__ == __name__:
+            continue
+        for name, value in list(vars(module).items()):
+            if inspect.isfunction(value) and value in _wrappers:
+                setattr(module, name, _wrappers[value])
+
+    for connection in getattr(db._local, "connections", {}).values():
+        trace_connection(connection)
+    _enabled = True
+    if dump_on_exit:
+        atexit.register(report)
+
+
+def disable():
+    """Switch the instrumentation off and put the original functions back. The statistics are kept."""
+    global _enabled
+    if not _enabled:
+        return
+    originals = {wrapper: function for function, wrapper in _wrappers.items()}
+    for module in _project_modules():
+        for name, value in list(vars(module).items()):
+            if inspect.isfunction(value) and value in originals:
+                setattr(module, name, originals[value])
+    for connection in list(_connections):
+        try:
+            connection.set_trace_callback(None)
+            connection.row_factory = getattr(connection.row_factory, "previous", connection.row_factory)
+        except sqlite3.ProgrammingError:
+            pass
+    _connections.clear()
+    _wrappers.clear()
+    _enabled = False
+    atexit.unregister(report)
+
+
+def reset():
+    """Remove all recorded statistics."""
+    with _lock:
+        _function_stats.clear()
+        _statement_stats.clear()
+
+
+def summary():
+    """Return the recorded statistics.
+
+    returns:
+        dict: functions maps "module.function" to calls, rows read, wall and cpu seconds and the slowest call
+              (max_wall);
+              statements maps each SQL statement to calls, seconds and the slowest execution (max_seconds).
+    """
+    with _lock:
+        return {"functions": {name: dict(stats) for name, stats in _function_stats.items()},
+                "statements": {statement: dict(stats) for statement, stats in _statement_stats.items()}}
+
+
+def report(limit=20, file=None):
+    """Print the functions and SQL statements that took the most time.
+
+    parameters:
+        limit(int): Number of functions and statements to print. Default is 20.
+        file: File to print to. Default is standard output.
+    """
+    file = file or sys.stdout
+    stats = summary()
+    if not stats["functions"] and not stats["statements"]:
+        print("No calls have been recorded.", file=file)
+        return
+
+    print(f"\n{'function':<45} {'calls':>8} {'rows':>10} {'wall s':>10} {'cpu s':>10} {'max ms':>9}", file=file)
+    functions = sorted(stats["functions"].items(), key=lambda item: item[1]["wall"], reverse=True)
+    for name, function in functions[:limit]:
+        print(f"{name:<45} {function['calls']:>8} {function['rows']:>10} {function['wall']:>10.4f} "
+              f"{function['cpu']:>10.4f} {function['max_wall'] * 1000:>9.3f}", file=file)
+
+    print(f"\n{'statement':<80} {'calls':>8} {'seconds':>10} {'max ms':>9}", file=file)
+    statements = sorted(stats["statements"].items(), key=lambda item: item[1]["seconds"], reverse=True)
+    for statement, timing in statements[:limit]:
+        print(f"{statement[:80]:<80} {timing['calls']:>8} {timing['seconds']:>10.4f} "
+              f"{timing['max_seconds'] * 1000:>9.3f}", file=file)
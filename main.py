@@ -1,12 +1,24 @@
-"""This module includes the functions associated with checking user input and the main command line interface."""
+"""This module includes the functions associated with checking user input and the main command line interface.
 
+Without a command, the interactive menu (cli) is started. The commands checkoff, list, streak, monthly and top run
+one action without prompts, e.g. from cron jobs or shell scripts:
+
+    python main.py checkoff Reading
+    python main.py streak Reading
+    python main.py --database main.db top
+
+questionary (with prompt_toolkit) and the analysis functions are imported by the functions that use them, so the
+commands that do not need them start without loading them.
+"""
+
+import argparse
+import sys
 from datetime import datetime, date
 import calendar
-import questionary
 from habit import Habit
 from db import (get_db, list_of_habits, list_of_habits_weekly, list_of_habits_daily, search_start_date, reset_habit,
-                search_habit, delete_habit)
-from analyse import get_longest_streak, get_current_streak, monthly_habit_completion, max_longest_streak
+                search_habit, delete_habit, get_habits_by_name, habits_due, add_completions_batch,
+                compact_check_offs, set_unique_check_offs)
 
 
 def check_date(start_date):
@@ -22,6 +34,8 @@ def check_date(start_date):
         returns:
             start_date: str in the format of YYYY-MM-DD (if the date has met all the requirements tested)
     """
+    import questionary
+
     while True:
         try:
             if len(start_date) == 10:
@@ -54,6 +68,8 @@ def check_name(db, name):
         returns:
             name: str (if the name has met all the requirements tested)
     """
+    import questionary
+
     while True:
         try:
             name = (name.lower()).capitalize()
@@ -88,6 +104,8 @@ def check_description(description):
         returns:
             description: str (if the description has met all the requirements tested)
         """
+    import questionary
+
     while True:
         try:
             if not description:
@@ -105,13 +123,81 @@ def check_description(description):
                                            ).ask()
 
 
-def cli():
-    """This function is the main command line interface for the user to interact with the Habit Tracker."""
+def check_off_habits(db, names, day=None):
+    """This function checks off several habits at once.
+
+    The start dates of all the habits are read with one query, and the check-offs of the habits that have started are
+    saved in one transaction (or handed to the write-behind queue, if Habit.write_queue is set).
+
+    parameters:
+        db: database connection from get_db() function
+        names(list of str): Names of the habits to check off.
+        day(date): Day of the check-offs. Default is today.
+
+    returns:
+        tuple: The habits checked off as (name, frequency, start_date), the habits that have not started yet as
+               (name, start_date), and the names that are not habits.
+    """
+    day = day or date.today()
+    completion_date = datetime.strftime(day, "%Y-%m-%d %H:%M")
+    habits = get_habits_by_name(db, names)
+
+    checked, not_started, unknown, completions = [], [], [], []
+    seen = set()
+    for name in names:
+        if name not in habits:
+            unknown.append(name)
+            continue
+        habit_id, frequency, start_date = habits[name]
+        # A habit named twice is checked off once.
+        if habit_id in seen:
+            continue
+        seen.add(habit_id)
+        if day < datetime.strptime(start_date, "%Y-%m-%d").date():
+            not_started.append((name, start_date))
+            continue
+        checked.append((name, frequency, start_date))
+        completions.append((habit_id, completion_date))
+
+    if Habit.write_queue is not None:
+        for habit_id, check_off in completions:
+            Habit.write_queue.put(habit_id, check_off)
+    elif completions:
+        errors = add_completions_batch(db, completions)
+        checked = [habit for habit, error in zip(checked, errors) if error is None]
+    return checked, not_started, unknown
+
+
+def cli(write_behind=False, durability="normal", profile=False):
+    """This function is the main command line interface for the user to interact with the Habit Tracker.
+
+    parameters:
+        write_behind(bool): Queue check-offs and save them in group commits (see write_queue.CheckOffQueue).
+        durability(str): Durability mode of the write-behind queue: off, normal or full.
+        profile(bool): Record the time taken by the database and analysis functions (see instrument.enable). The
+            summary is printed from the Show Profile menu entry and when the program exits.
+    """
+    import questionary
+    from analyse import get_longest_streak, get_current_streak, monthly_habit_completion, max_longest_streak
+
+    if profile:
+        import instrument
+        instrument.enable(dump_on_exit=True)
+    db = get_db(Habit.Database)
+    # The connection is cached by get_db, so it is opened once and passed to the Habit objects created below.
+    queue = None
+    if write_behind:
+        from write_queue import CheckOffQueue
+        queue = Habit.write_queue = CheckOffQueue(Habit.Database, durability=durability)
     while True:
-        db = get_db(Habit.Database)
         choice = questionary.select("What would you like to do?",
-                                    choices=["Create Habit", "Check Off Habit", "Show List of Habits", "Analyze Habit",
-                                             "Delete Habit", "Reset Habit", "Exit"]).ask()
+                                    choices=["Create Habit", "Check Off Habit", "Show Habits Due Today",
+                                             "Show List of Habits", "Analyze Habit", "Delete Habit", "Reset Habit",
+                                             "Show Profile", "Exit"]).ask()
+
+        # Queued check-offs are written before anything reads or changes the saved habits.
+        if queue is not None and choice != "Check Off Habit":
+            queue.flush()
 
         if choice == "Create Habit":
             name = questionary.text("What is the name of your habit?").ask()
@@ -141,7 +227,7 @@ def cli():
                 print(f"Your habit {name} was not created.")
                 continue
 
-            habit = Habit(name, description, frequency, start_date)
+            habit = Habit(name, description, frequency, start_date, db=db)
             habit.save_habit()
             print(f"\nPlease review the information you entered for your habit:\n\n{habit}\n")
 
@@ -152,40 +238,30 @@ def cli():
                 print("\nYou have no habits to check off.\n")
                 continue
             else:
-                habits.append("Exit")
-                habit_name = questionary.select("Which habit would you like to check off?", habits).ask()
-                if habit_name == "Exit":
+                habit_names = questionary.checkbox("Which habits would you like to check off? "
+                                                   "(Select with space, confirm with enter.)", habits).ask()
+                if not habit_names:
                     continue
-                else:
-                    habit = Habit(habit_name)
-                    start_date = search_start_date(db, habit_name)
-                    # The start_date needs to be retrieved from the database.
-
-                    start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
-                    today_date = datetime.now().date()
-                    # Put both dates in the same format to compare.
-
-                    weekly_list = [habit[0] for habit in list_of_habits_weekly(db)]
-
-                # Inform user of what day of the week their weekly habit should be checked off.
-                if habit_name in weekly_list:
-                    start_date_day_of_week = calendar.day_name[start_date.weekday()]
-                    print(f"\nJust so you know, {habit_name} is a weekly habit.\n\nTrying to do this activity the same "
-                          f"day each week\nwill help you to maintain your habit.\n\n"
-                          f"In order for check-off events to count toward\nyour current streak and longest streak,\n"
-                          f"you need to complete your habit on {start_date_day_of_week}s.\n")
-
-                # Check if the habit has started yet.
-                try:
-                    if today_date >= start_date:
-                        today_date = datetime.strftime(today_date, "%Y-%m-%d %H:%M")
-                        # Put date into string format before saving.
-                        habit.add_habit_completion_date(today_date)
-                        print(f"\n{habit.name} has been checked off.\n")
-                    else:
-                        raise ValueError(f"{habit.name} has not started yet. Please wait until {start_date}.")
-                except ValueError:
-                    print(f"\n{habit.name} has not started yet. Please wait until {start_date}.\n")
+                checked, not_started, _ = check_off_habits(db, habit_names)
+
+                for habit_name, frequency, start_date in checked:
+                    # Inform user of what day of the week their weekly habit should be checked off.
+                    if frequency == "Weekly":
+                        start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+                        start_date_day_of_week = calendar.day_name[start_date.weekday()]
+                        print(f"\nJust so you know, {habit_name} is a weekly habit.\n\nTrying to do this activity "
+                              f"the same day each week\nwill help you to maintain your habit.\n\n"
+                              f"In order for check-off events to count toward\nyour current streak and longest "
+                              f"streak,\nyou need to complete your habit on {start_date_day_of_week}s.\n")
+                    print(f"\n{habit_name} has been checked off.\n")
+
+                for habit_name, start_date in not_started:
+                    print(f"\n{habit_name} has not started yet. Please wait until {start_date}.\n")
+
+        elif choice == "Show Habits Due Today":
+            print("\nHere are the habits you still need to do today:\n")
+            command_due(db)
+            print()
 
         elif choice == "Show List of Habits":
             next_choice = questionary.select("Would you like to see all habits or just "
@@ -251,7 +327,7 @@ def cli():
                 if habit_name == "Exit":
                     continue
                 else:
-                    habit = Habit(habit_name)
+                    habit = Habit(habit_name, db=db)
                     start_date = search_start_date(db, habit_name)
                     change_start_date = questionary.select(f"Would you like to change your start date? " 
                                                            f"Current start date is: {start_date}",
@@ -331,9 +407,236 @@ def cli():
             if analysis_choice == "Exit":
                 continue
 
+        elif choice == "Show Profile":
+            import instrument
+            if instrument.is_enabled():
+                instrument.report()
+            else:
+                print("\nProfiling is off. Start the Habit Tracker with profiling on to record timings.\n")
+
         elif choice == "Exit":
             break
 
+    # Flush-on-exit: write the queued check-offs and stop the writer thread before leaving the program.
+    if queue is not None:
+        queue.close()
+        Habit.write_queue = None
+
+
+def command_checkoff(db, names, completion_date=None, all_due=False):
+    """Check off habits without prompts (the checkoff command). All the habits are saved in one transaction.
+
+    parameters:
+        db: database connection from get_db() function
+        names(list of str): Names of the habits.
+        completion_date(str): Day of the check-offs in the format YYYY-MM-DD. Default is today.
+        all_due(bool): Also check off every habit that is due on the day and not checked off yet.
+
+    returns:
+        int: 0 if all the habits were checked off, 1 if not.
+    """
+    day = date.today()
+    if completion_date is not None:
+        try:
+            day = datetime.strptime(completion_date, "%Y-%m-%d").date()
+        except ValueError:
+            print("The date you entered is not in the correct format. Please use YYYY-MM-DD.")
+            return 1
+        if day > date.today():
+            print("The date you entered is in the future.")
+            return 1
+
+    names = list(dict.fromkeys((name.lower()).capitalize() for name in names))
+    if all_due:
+        names += [habit[0] for habit in habits_due(db, day) if habit[0] not in names]
+    if not names:
+        print("There are no habits to check off.")
+        return 0 if all_due else 1
+
+    checked, not_started, unknown = check_off_habits(db, names, day)
+    for name, _, _ in checked:
+        print(f"{name} has been checked off.")
+    for name, start_date in not_started:
+        print(f"{name} has not started yet. Please wait until {start_date}.")
+    for name in unknown:
+        print(f"There is no habit called {name}.")
+    return 0 if len(checked) == len(names) else 1
+
+
+def command_due(db, due_date=None):
+    """Print the habits that are due on a day and have not been checked off yet, with their most recent check-off
+    (the due command and the Show Habits Due Today menu entry).
+
+    parameters:
+        db: database connection from get_db() function
+        due_date(str): Day in the format YYYY-MM-DD. Default is today.
+
+    returns:
+        int: 0, or 1 if the date is not in the correct format.
+    """
+    day = date.today()
+    if due_date is not None:
+        try:
+            day = datetime.strptime(due_date, "%Y-%m-%d").date()
+        except ValueError:
+            print("The date you entered is not in the correct format. Please use YYYY-MM-DD.")
+            return 1
+
+    habits = habits_due(db, day)
+    if not habits:
+        print("There are no habits due.")
+    for name, frequency, last_date in habits:
+        last_check_off = "never checked off" if last_date is None else f"last checked off on {last_date}"
+        print(f"{name} ({frequency}), {last_check_off}.")
+    return 0
+
+
+def command_list(db, frequency=None):
+    """Print the names of the habits, one per line (the list command).
+
+    parameters:
+        db: database connection from get_db() function
+        frequency(str): daily or weekly to list only those habits. Default is all habits.
+
+    returns:
+        int: 0
+    """
+    habits = {None: list_of_habits, "daily": list_of_habits_daily, "weekly": list_of_habits_weekly}[frequency](db)
+    for habit in habits:
+        print(habit[0])
+    return 0
+
+
+def command_streak(db, name):
+    """Print the longest and the current streak of a habit (the streak command).
+
+    parameters:
+        db: database connection from get_db() function
+        name(str): Name of the habit.
+
+    returns:
+        int: 0 if the habit exists, 1 if not.
+    """
+    from analyse import get_longest_streak, get_current_streak
+
+    name = (name.lower()).capitalize()
+    longest_streak = get_longest_streak(db, name)
+    if longest_streak is None:
+        print(f"There is no habit called {name}.")
+        return 1
+    print(f"{name} has a longest streak of {longest_streak} and a current streak of {get_current_streak(db, name)}.")
+    return 0
+
+
+def command_monthly(db, month):
+    """Print the number of check-offs of every habit in a month (the monthly command).
+
+    parameters:
+        db: database connection from get_db() function
+        month(int): Numerical value of the month.
+
+    returns:
+        int: 0
+    """
+    from analyse import monthly_habit_completion
+
+    monthly_habit_completion(db, month)
+    return 0
+
+
+def command_top(db):
+    """Print the daily and the weekly habit with the longest streak (the top command).
+
+    parameters:
+        db: database connection from get_db() function
+
+    returns:
+        int: 0
+    """
+    from analyse import max_longest_streak
+
+    max_longest_streak(db)
+    return 0
+
+
+def command_compact(db, unique=False, vacuum=False):
+    """Remove the repeated check-offs of a habit on the same day (the compact command).
+
+    parameters:
+        db: database connection from get_db() function
+        unique(bool): Also switch unique check-offs on, so a habit can only be checked off once a day from now on.
+        vacuum(bool): Shrink the database file afterwards.
+
+    returns:
+        int: 0
+    """
+    removed = compact_check_offs(db, vacuum)
+    if unique:
+        removed += set_unique_check_offs(db)
+        print("Habits can now be checked off once a day.")
+    print(f"{removed} repeated check-offs have been removed.")
+    return 0
+
+
+def main(arguments=None):
+    """Parse the command line arguments and run a command, or start the interactive menu if no command is given.
+
+    parameters:
+        arguments(list): Command line arguments. Default is sys.argv[1:].
+
+    returns:
+        int: Exit status of the command.
+    """
+    parser = argparse.ArgumentParser(description="Habit Tracker. Run without a command for the interactive menu.")
+    parser.add_argument("--database", default=Habit.Database, help=f"Database file. Default is {Habit.Database}.")
+    parser.add_argument("--write-behind", action="store_true",
+                        help="Interactive menu: queue check-offs and save them in group commits.")
+    parser.add_argument("--durability", choices=["off", "normal", "full"], default="normal",
+                        help="Interactive menu: durability mode of the write-behind queue.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Interactive menu: record the time taken by the database and analysis functions.")
+    commands = parser.add_subparsers(dest="command")
+
+    checkoff = commands.add_parser("checkoff", help="Check off one or more habits.")
+    checkoff.add_argument("names", nargs="*", metavar="name", help="Name of a habit.")
+    checkoff.add_argument("--all-due", action="store_true",
+                          help="Check off every habit that is due on the day and not checked off yet.")
+    checkoff.add_argument("--date", help="Day of the check-offs (YYYY-MM-DD). Default is today.")
+    due = commands.add_parser("due", help="List the habits that are due and not checked off yet.")
+    due.add_argument("--date", help="Day to check (YYYY-MM-DD). Default is today.")
+    habit_list = commands.add_parser("list", help="List the habits.")
+    habit_list.add_argument("--frequency", choices=["daily", "weekly"], help="Only list daily or weekly habits.")
+    streak = commands.add_parser("streak", help="Show the longest and current streak of a habit.")
+    streak.add_argument("name", help="Name of the habit.")
+    monthly = commands.add_parser("monthly", help="Show the number of check-offs of every habit in a month.")
+    monthly.add_argument("month", type=int, choices=range(1, 13), metavar="MONTH", help="Month from 1 to 12.")
+    commands.add_parser("top", help="Show the daily and weekly habit with the longest streak.")
+    compact = commands.add_parser("compact", help="Remove repeated check-offs of a habit on the same day.")
+    compact.add_argument("--unique", action="store_true",
+                         help="Only allow one check-off per habit and day from now on.")
+    compact.add_argument("--vacuum", action="store_true", help="Shrink the database file afterwards.")
+    args = parser.parse_args(arguments)
+
+    Habit.Database = args.database
+    if args.command is None:
+        cli(write_behind=args.write_behind, durability=args.durability, profile=args.profile)
+        return 0
+
+    db = get_db(args.database)
+    if args.command == "checkoff":
+        return command_checkoff(db, args.names, args.date, args.all_due)
+    if args.command == "due":
+        return command_due(db, args.date)
+    if args.command == "list":
+        return command_list(db, args.frequency)
+    if args.command == "streak":
+        return command_streak(db, args.name)
+    if args.command == "monthly":
+        return command_monthly(db, args.month)
+    if args.command == "compact":
+        return command_compact(db, args.unique, args.vacuum)
+    return command_top(db)
+
 
 if __name__ == "__main__":
-    cli()
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""This module contains the parallel mode of the all-habits analyses (max_longest_streak and monthly_habit_completion).
+
+The habit_ids of a user are split into shards of consecutive ids, and every shard is analysed by a worker of a
+ProcessPoolExecutor on its own read-only connection (see db.connect_read_only). The workers return the maxima and
+counts of their shard, which are merged here, so the results are the same as those of the serial functions:
+
+    analyse.max_longest_streak(db, workers=4)
+    analyse.monthly_habit_completion(db, month, workers=4)
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import groupby
+import analyse
+from db import connect_read_only, DEFAULT_USER_ID
+
+# Number of shards per worker. More shards than workers keep every worker busy when the shards take different times.
+SHARDS_PER_WORKER = 4
+
+
+def _shards(db, user_id, workers):
+    """Split the habit_ids of a user into ranges of consecutive ids with about the same number of habits.
+
+    returns:
+        list: Tuples of the first and last habit_id of every shard.
+    """
+    habit_ids = [row[0] for row in db.execute("""SELECT habit_id FROM habit_metadata WHERE user_id = ?
+                                                  ORDER BY habit_id""", (user_id,))]
+    size = max(1, -(-len(habit_ids) // (workers * SHARDS_PER_WORKER)))
+    return [(habit_ids[start], habit_ids[min(start + size, len(habit_ids)) - 1])
+            for start in range(0, len(habit_ids), size)]
+
+
+def _run_shards(database, function, shards, workers, *args):
+    """Run a shard function for every shard in a process pool and return the results in the order of the shards."""
+    if database is None:
+        raise ValueError("The parallel analysis needs a database file, not an in-memory database.")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(function, database, first_id, last_id, *args) for first_id, last_id in shards]
+        return [future.result() for future in futures]
+
+
+def _longest_streak_shard(database, first_id, last_id, user_id):
+    """Find the daily and weekly habit with the longest streak among the habits of one shard.
+
+    The check-off days of the shard are read in one scan of the (habit_id, completion_day) index, and the streaks of
+    every habit are found with the same engine as the streak functions in analyse.py.
+
+    returns:
+        dict: For Daily and Weekly, the (streak, habit_id, name) of the habit with the longest streak in the shard,
+              the first created one if several have the same streak, or None if the shard has no such habit.
+    """
+    db = connect_read_only(database)
+    try:
+        habits = {habit_id: (name, frequency, start_date) for habit_id, name, frequency, start_date in db.execute(
+            """SELECT habit_id, name, frequency, start_date FROM habit_metadata
+               WHERE user_id = ? AND habit_id BETWEEN ? AND ? AND frequency IN ('Daily', 'Weekly')""",
+            (user_id, first_id, last_id))}
+        rows = db.execute("""SELECT habit_id, completion_day FROM habit_completion_dates
+                             WHERE habit_id BETWEEN ? AND ? AND completion_day IS NOT NULL
+                             ORDER BY habit_id, completion_day""", (first_id, last_id))
+        streaks = analyse._numpy_streaks if analyse.USE_NUMPY else analyse._python_streaks
+        longest = dict.fromkeys(habits, 0)
+        for habit_id, habit_rows in groupby(rows, key=lambda row: row[0]):
+            if habit_id not in habits:
+                continue
+            _, frequency, start_date = habits[habit_id]
+            days = [day for _, day in habit_rows]
+            if frequency == "Daily":
+                longest[habit_id] = streaks(days, 1)[0]
+            else:
+                longest[habit_id] = streaks(days, 7, datetime.strptime(start_date, "%Y-%m-%d").weekday())[0]
+    finally:
+        db.close()
+
+    maxima = {"Daily": None, "Weekly": None}
+    for habit_id in sorted(habits):
+        name, frequency, _ = habits[habit_id]
+        best = maxima[frequency]
+        if best is None or longest[habit_id] > best[0]:
+            maxima[frequency] = (longest[habit_id], habit_id, name)
+    return maxima
+
+
+def _monthly_completions_shard(database, first_id, last_id, month, cutoff_day, user_id):
+    """Count the check-off events of every habit of one shard in a month after cutoff_day.
+
+    returns:
+        list: Tuples of number of check-off events, habit_id, name and frequency.
+    """
+    db = connect_read_only(database)
+    try:
+        return db.execute("""
+            SELECT COUNT(c.completion_day), m.habit_id, m.name, m.frequency
+            FROM habit_metadata m
+            LEFT JOIN habit_completion_dates c
+                ON c.habit_id = m.habit_id AND c.completion_day > ?
+                AND CAST(strftime('%m', c.completion_day + 2440587.5) AS INTEGER) = ?
+            WHERE m.user_id = ? AND m.habit_id BETWEEN ? AND ? AND m.frequency IN ('Daily', 'Weekly')
+            GROUP BY m.habit_id""", (cutoff_day, month, user_id, first_id, last_id)).fetchall()
+    finally:
+        db.close()
+
+
+def parallel_longest_streak_maxima(db, user_id=DEFAULT_USER_ID, workers=None):
+    """Find the daily and weekly habit with the longest streak with a process pool.
+
+    parameters:
+        db: Database connection from get_db() function. The workers open the same database file read-only.
+        user_id(int): Owner of the habits. Default is the default user.
+        workers(int): Number of worker processes. Default is the number of CPUs.
+
+    returns:
+        dict: For Daily and Weekly, a tuple of the name and longest streak of the habit with the longest streak (the
+              first created one if several have the same streak), or None if there are no such habits.
+    """
+    workers = workers or os.cpu_count()
+    shard_maxima = _run_shards(getattr(db, "path", None), _longest_streak_shard, _shards(db, user_id, workers),
+                               workers, user_id)
+
+    maxima = {}
+    for frequency in ("Daily", "Weekly"):
+        candidates = [shard[frequency] for shard in shard_maxima if shard[frequency] is not None]
+        if not candidates:
+            maxima[frequency] = None
+        else:
+            streak, _, name = max(candidates, key=lambda candidate: (candidate[0], -candidate[1]))
+            maxima[frequency] = (name, streak)
+    return maxima
+
+
+def parallel_monthly_completions(db, month, cutoff_day, user_id=DEFAULT_USER_ID, workers=None):
+    """Count the check-off events of every habit in a month with a process pool, see db.get_monthly_completions.
+
+    parameters:
+        db: Database connection from get_db() function. The workers open the same database file read-only.
+        month(int): Numerical value of month for date retrieval.
+        cutoff_day(int): Epoch day; only check-offs after this day are counted.
+        user_id(int): Owner of the habits. Default is the default user.
+        workers(int): Number of worker processes. Default is the number of CPUs.
+
+    returns:
+        list: Tuples of habit name, frequency and number of check-off events, in ascending order of the number of
+              check-off events (habits with the same number in the order they were created).
+    """
+    workers = workers or os.cpu_count()
+    shards = _run_shards(getattr(db, "path", None), _monthly_completions_shard, _shards(db, user_id, workers),
+                         workers, month, cutoff_day, user_id)
+    counts = sorted(row for shard in shards for row in shard)
+    return [(name, frequency, check_offs) for check_offs, _, name, frequency in counts]
@@ -0,0 +1,186 @@
+"""This module contains the binary snapshot of the habits and check-offs, for read-only analytics replicas.
+
+export_snapshot writes the columns of a store.CheckOffStore to one file, and load_snapshot maps that file into memory
+with mmap and builds a CheckOffStore on memoryviews of the mapping. Nothing is parsed or copied for the check-offs, so
+a reporting worker can start analysing right away and the operating system shares the pages between processes:
+
+    python snapshot.py export main.db main.snapshot
+
+    store = load_snapshot("main.snapshot")
+    max_longest_streak(store)
+
+The file starts with a fixed header (see HEADER), followed by the habit metadata as UTF-8 JSON and the habit_ids,
+user_ids, offsets and days columns as little-endian integers, each section starting at a multiple of 8 bytes.
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from db import get_db, get_schema_version
+from store import CheckOffStore
+
+SNAPSHOT_MAGIC = b"HABITSNP"
+SNAPSHOT_VERSION = 1
+
+# magic, snapshot version, database schema version, export time (seconds since 1970), number of habits, number of
+# check-offs, then the byte offset of the metadata, its length in bytes, and the byte offsets of the habit_ids,
+# user_ids, offsets and days columns.
+HEADER = struct.Struct("<8sIIqqqqqqqqq")
+
+# Item type of each integer column, as used by array and memoryview.cast.
+COLUMN_TYPES = {"habit_ids": "i", "user_ids": "i", "offsets": "q", "days": "i"}
+
+
+def _align(position):
+    """Round a byte position up to the next multiple of 8."""
+    return (position + 7) & ~7
+
+
+def _little_endian(column):
+    """Return the bytes of an integer array in little-endian order."""
+    if sys.byteorder == "little":
+        return column.tobytes()
+    swapped = array(column.typecode, column)
+    swapped.byteswap()
+    return swapped.tobytes()
+
+
+def export_snapshot(db, path):
+    """Write a snapshot of all habits and check-offs of a database.
+
+    The snapshot is written to a temporary file next to path and then renamed, so workers that have the previous
+    snapshot mapped keep reading a complete file.
+
+    parameters:
+        db: Database connection from the get_db function.
+        path(str): Name of the snapshot file.
+
+    returns:
+        CheckOffStore: The store that was written.
+    """
+    store = CheckOffStore.load(db)
+    metadata = json.dumps({"names": store.names, "frequencies": store.frequencies,
+                           "start_dates": store.start_dates}).encode("utf-8")
+    columns = {"habit_ids": store.habit_ids, "user_ids": array("i", store.user_ids), "offsets": store.offsets,
+               "days": array("i", store.days)}
+
+    position = _align(HEADER.size)
+    metadata_offset = position
+    position = _align(position + len(metadata))
+    sections = {}
+    for name, column in columns.items():
+        sections[name] = position
+        position = _align(position + len(column) * column.itemsize)
+
+    header = HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, get_schema_version(db), int(time.time()),
+                         len(store.habit_ids), len(store.days), metadata_offset, len(metadata),
+                         sections["habit_ids"], sections["user_ids"], sections["offsets"], sections["days"])
+
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(header)
+        file.seek(metadata_offset)
+        file.write(metadata)
+        for name, column in columns.items():
+            file.seek(sections[name])
+            file.write(_little_endian(column))
+        file.truncate(position)
+    os.replace(temporary, path)
+    return store
+
+
+def read_header(path):
+    """Read the header of a snapshot file.
+
+    parameters:
+        path(str): Name of the snapshot file.
+
+    returns:
+        dict: Snapshot version, database schema version, export time, number of habits and number of check-offs.
+
+    raises:
+        ValueError: If the file is not a snapshot or has a snapshot version this module cannot read.
+    """
+    with open(path, "rb") as file:
+        return _unpack_header(file.read(HEADER.size))[0]
+
+
+def _unpack_header(data):
+    """Check and unpack the header bytes of a snapshot. Returns the header fields and the section offsets."""
+    if len(data) < HEADER.size:
+        raise ValueError("The file is too short to be a habit snapshot.")
+    (magic, version, schema_version, exported, habit_count, day_count, metadata_offset, metadata_length,
+     *column_offsets) = HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("The file is not a habit snapshot.")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"Snapshot version {version} is not supported (expected {SNAPSHOT_VERSION}).")
+    header = {"version": version, "schema_version": schema_version, "exported": exported,
+              "habits": habit_count, "check_offs": day_count}
+    lengths = {"habit_ids": habit_count, "user_ids": habit_count, "offsets": habit_count + 1, "days": day_count}
+    sections = {name: (offset, lengths[name]) for name, offset in zip(COLUMN_TYPES, column_offsets)}
+    sections["metadata"] = (metadata_offset, metadata_length)
+    return header, sections
+
+
+def load_snapshot(path):
+    """Map a snapshot file into memory and return a CheckOffStore on it.
+
+    The integer columns are memoryviews of the read-only mapping (on a little-endian machine), so loading does not
+    depend on the number of check-offs. np.asarray, as used by the NumPy streak engine, reads them without a copy.
+
+    parameters:
+        path(str): Name of the snapshot file.
+
+    returns:
+        CheckOffStore: Store with the habits and check-offs of the snapshot.
+    """
+    with open(path, "rb") as file:
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    _, sections = _unpack_header(mapping)
+    buffer = memoryview(mapping)
+
+    metadata_offset, metadata_length = sections["metadata"]
+    metadata = json.loads(bytes(buffer[metadata_offset:metadata_offset + metadata_length]).decode("utf-8"))
+
+    columns = {}
+    for name, typecode in COLUMN_TYPES.items():
+        offset, length = sections[name]
+        column = buffer[offset:offset + length * array(typecode).itemsize].cast(typecode)
+        if sys.byteorder != "little":
+            column = array(typecode, column)
+            column.byteswap()
+        columns[name] = column
+
+    return CheckOffStore(columns["habit_ids"], columns["offsets"], columns["days"], list(columns["user_ids"]),
+                         metadata["names"], metadata["frequencies"], metadata["start_dates"])
+
+
+def main():
+    """Parse the command line arguments and export a snapshot or print the header of one."""
+    parser = argparse.ArgumentParser(description="Export or inspect a binary snapshot of the Habit Tracker database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="Write a snapshot of a database.")
+    export.add_argument("database", help="Database file to export, e.g. main.db.")
+    export.add_argument("snapshot", help="Snapshot file to write.")
+    info = commands.add_parser("info", help="Print the header of a snapshot.")
+    info.add_argument("snapshot", help="Snapshot file to read.")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        start = time.perf_counter()
+        store = export_snapshot(get_db(args.database), args.snapshot)
+        print(f"Exported {len(store.habit_ids)} habits with {len(store.days)} check-offs to {args.snapshot} "
+              f"in {time.perf_counter() - start:.2f} s")
+    else:
+        for key, value in read_header(args.snapshot).items():
+            print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
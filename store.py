@@ -0,0 +1,178 @@
+"""This module contains the in-memory check-off store used to analyse all habits without querying the database again.
+
+The check-offs of all habits are kept as one array('i') of epoch days (see db.to_epoch_day), sorted by habit_id and
+day, with a CSR-style index: the days of the habit at position p of habit_ids are days[offsets[p]:offsets[p + 1]].
+That is 4 bytes per check-off instead of a date object and a list slot per check-off.
+
+The functions of analyse.py accept a CheckOffStore in place of a database connection:
+
+    store = CheckOffStore.load(get_db("main.db"))
+    max_longest_streak(store)
+    get_current_streak(store, "Reading")
+
+The store is a snapshot: check-offs saved after it was loaded are not seen by it.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from calendar import monthrange
+from datetime import date
+from db import to_epoch_day, from_epoch_day, DEFAULT_USER_ID
+
+
+class CheckOffStore:
+    """Columnar, read-only copy of the habits and check-off days of a database.
+
+    attributes:
+        habit_ids: habit_id of every habit, in ascending order.
+        offsets: Start of the days of every habit in days, with the end of the last habit as the last item.
+        days: Epoch days of all check-offs, sorted by habit_id and day. Repeated check-offs on one day are kept.
+        user_ids, names, frequencies, start_dates: Metadata of every habit, in the order of habit_ids.
+    """
+
+    def __init__(self, habit_ids, offsets, days, user_ids, names, frequencies, start_dates):
+        """
+        Initialize the store from its columns. The integer columns can be arrays or memoryviews of any buffer.
+
+        parameters:
+           habit_ids: habit_id of every habit, in ascending order.
+           offsets: len(habit_ids) + 1 offsets into days.
+           days: Epoch days of all check-offs, sorted by habit_id and day.
+           user_ids(list): Owner of every habit.
+           names(list): Name of every habit.
+           frequencies(list): Daily or Weekly for every habit.
+           start_dates(list): Start date (YYYY-MM-DD) of every habit.
+        """
+        self.habit_ids = habit_ids
+        self.offsets = offsets
+        self.days = memoryview(days)
+        self.user_ids = user_ids
+        self.names = names
+        self.frequencies = frequencies
+        self.start_dates = start_dates
+        self._positions = {(user_id, name): position for position, (user_id, name) in enumerate(zip(user_ids, names))}
+        self.last_day = max((self.days[offsets[position + 1] - 1] for position in range(len(habit_ids))
+                             if offsets[position + 1] > offsets[position]), default=None)
+
+    @classmethod
+    def load(cls, db):
+        """
+        Load the habits and check-off days of a database into a new store.
+
+        The check-off days are read in one pass over the (habit_id, completion_day) index, so they arrive sorted and
+        no dates are parsed. Check-offs without a readable day are left out.
+
+        parameters:
+           db: Database connection from the get_db function.
+
+        returns:
+           CheckOffStore: The store with every habit of every user.
+        """
+        habit_ids, offsets, days = array("i"), array("q", [0]), array("i")
+        user_ids, names, frequencies, start_dates = [], [], [], []
+        for habit_id, user_id, name, frequency, start_date in db.execute(
+                """SELECT habit_id, user_id, name, frequency, start_date FROM habit_metadata ORDER BY habit_id"""):
+            habit_ids.append(habit_id)
+            user_ids.append(user_id)
+            names.append(name)
+            frequencies.append(frequency)
+            start_dates.append(start_date)
+
+        position = 0
+        rows = db.execute("""SELECT habit_id, completion_day FROM habit_completion_dates
+                             WHERE completion_day IS NOT NULL ORDER BY habit_id, completion_day""")
+        for habit_id, day in rows:
+            while habit_ids[position] != habit_id:
+                position += 1
+                offsets.append(len(days))
+            days.append(day)
+        offsets.extend([len(days)] * (len(habit_ids) + 1 - len(offsets)))
+        return cls(habit_ids, offsets, days, user_ids, names, frequencies, start_dates)
+
+    @property
+    def nbytes(self):
+        """Bytes used by the habit_ids, offsets and days columns."""
+        return sum(memoryview(column).nbytes for column in (self.habit_ids, self.offsets, self.days))
+
+    def _position(self, habit_id):
+        """Return the position of a habit_id in habit_ids, or None if the store has no such habit."""
+        position = bisect_left(self.habit_ids, habit_id)
+        if position < len(self.habit_ids) and self.habit_ids[position] == habit_id:
+            return position
+        return None
+
+    def _bounds(self, habit_id):
+        """Return the start and end of the days of a habit in days, (0, 0) if the store has no such habit."""
+        position = self._position(habit_id)
+        if position is None:
+            return 0, 0
+        return self.offsets[position], self.offsets[position + 1]
+
+    def habit_days(self, habit_id):
+        """Return the check-off days of a habit, oldest first, as a memoryview of days (nothing is copied)."""
+        start, end = self._bounds(habit_id)
+        return self.days[start:end]
+
+    def habits(self, user_id=DEFAULT_USER_ID):
+        """Return the habit_id, name, frequency and start_date of every habit of a user, in the order of habit_id."""
+        return [(self.habit_ids[position], self.names[position], self.frequencies[position],
+                 self.start_dates[position])
+                for position in range(len(self.habit_ids)) if self.user_ids[position] == user_id]
+
+    # The methods below have the names, arguments and results of the db.py functions that analyse.py uses, so the
+    # analysis functions can run on a store in place of a connection.
+
+    def get_habit_metadata(self, name, user_id=DEFAULT_USER_ID):
+        """Return the habit_id, frequency and start_date of a habit, see db.get_habit_metadata."""
+        position = self._positions.get((user_id, name))
+        if position is None:
+            return None
+        return self.habit_ids[position], self.frequencies[position], self.start_dates[position]
+
+    def get_day_list(self, habit_id):
+        """Return the check-off days of a habit, most recent first, see db.get_day_list."""
+        return self.habit_days(habit_id)[::-1]
+
+    def get_completion_day_range(self, habit_id):
+        """Return the first and the most recent check-off day of a habit, see db.get_completion_day_range."""
+        start, end = self._bounds(habit_id)
+        if start == end:
+            return None, None
+        return self.days[start], self.days[end - 1]
+
+    def iter_completion_days(self, habit_id, since=None, until=None, order="desc"):
+        """Yield the check-off days of a habit within a range, see db.iter_completion_days."""
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be 'asc' or 'desc'.")
+        start, end = self._bounds(habit_id)
+        if since is not None:
+            start = bisect_left(self.days, to_epoch_day(since) if isinstance(since, date) else since, start, end)
+        if until is not None:
+            end = bisect_right(self.days, to_epoch_day(until) if isinstance(until, date) else until, start, end)
+        days = self.days[start:end]
+        yield from (days if order == "asc" else days[::-1])
+
+    def get_monthly_completions(self, month, cutoff_day, user_id=DEFAULT_USER_ID):
+        """Count the check-off events of every daily and weekly habit in a month, see db.get_monthly_completions.
+
+        Every day of the month after cutoff_day lies in one of a few ranges of consecutive epoch days (one per year),
+        so each habit is counted with two binary searches per range.
+        """
+        ranges = []
+        if self.last_day is not None and self.last_day > cutoff_day:
+            for year in range(from_epoch_day(cutoff_day + 1).year, from_epoch_day(self.last_day).year + 1):
+                first = max(to_epoch_day(date(year, month, 1)), cutoff_day + 1)
+                last = to_epoch_day(date(year, month, monthrange(year, month)[1]))
+                if first <= last:
+                    ranges.append((first, last))
+
+        counts = []
+        for position in range(len(self.habit_ids)):
+            if self.user_ids[position] != user_id or self.frequencies[position] not in ("Daily", "Weekly"):
+                continue
+            start, end = self.offsets[position], self.offsets[position + 1]
+            check_offs = sum(bisect_right(self.days, last, start, end) - bisect_left(self.days, first, start, end)
+                             for first, last in ranges)
+            counts.append((check_offs, self.habit_ids[position], self.names[position], self.frequencies[position]))
+        counts.sort()
+        return [(name, frequency, check_offs) for check_offs, _, name, frequency in counts]
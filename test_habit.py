@@ -2,9 +2,28 @@
 
 import pytest
 import os
+import sqlite3
+import threading
+import asyncio
+from datetime import date
 from habit import Habit
-from db import get_primary_key, delete_habit
-from analyse import get_longest_streak, get_current_streak, monthly_habit_completion, max_longest_streak
+from db import (get_db, get_primary_key, delete_habit, get_schema_version, MIGRATIONS, close_db, migrate,
+                to_epoch_day, add_habit, add_habit_completion, get_streak_state, get_longest_streaks,
+                get_habit_metadata, reset_habit, get_day_list, day_list_cache, add_user, get_user_id, list_of_habits,
+                iter_completion_dates, from_epoch_day, add_habit_completions_bulk, habits_due,
+                compact_check_offs, set_unique_check_offs, unique_check_offs, add_completions_batch,
+                connect_read_only)
+from async_api import AsyncHabitTracker
+from write_queue import CheckOffQueue
+from store import CheckOffStore
+from snapshot import export_snapshot, load_snapshot, read_header, SNAPSHOT_VERSION
+import instrument
+import main
+import analyse
+import db as db_module
+from analyse import (get_longest_streak, get_current_streak, monthly_habit_completion, max_longest_streak,
+                     monthly_completion_counts, calculate_current_streak, calculate_current_streak_weekly,
+                     longest_streak_maxima)
 
 
 def test_save_habit(habit1, habit2, habit3, habit4, habit5, db):
@@ -29,7 +48,7 @@ def test_data_storage(db, habit1, habit2, habit3, habit4, habit5):
         fixtures that are defined in the conftest.py file
     """
     cur = db.cursor()
-    cur.execute("SELECT name FROM habit_metadata")
+    cur.execute("SELECT name FROM habit_metadata ORDER BY habit_id")
     result = cur.fetchall()
     assert result == [("Meditation",), ("Python",), ("Morning walk",), ("Swimming",), ("Water plants",)]
 
@@ -122,6 +141,26 @@ def test_calculate_current_streak_daily(db, habit1, habit2, habit3):
     assert current_streak_3 == "0 days"
 
 
+def test_numpy_streaks_match_python(db, monkeypatch, habit1, habit2, habit3, habit4, habit5):
+    """Test that the NumPy streak engine gives the same longest and current streaks as the pure Python loops
+    for all 5 predefined habits. (Skipped if NumPy is not installed.)
+
+    parameters:
+        fixtures that are defined in the conftest.py file
+        monkeypatch: pytest fixture used to switch between the two engines
+    """
+    pytest.importorskip("numpy")
+    import analyse
+
+    results = {}
+    for use_numpy in (False, True):
+        monkeypatch.setattr(analyse, "USE_NUMPY", use_numpy)
+        db.execute("DELETE FROM habit_streak_state")
+        results[use_numpy] = [(get_longest_streak(db, habit.name), get_current_streak(db, habit.name))
+                              for habit in (habit1, habit2, habit3, habit4, habit5)]
+    assert results[True] == results[False]
+
+
 # Need to determine a way to test the current streak for weekly habits,
 # where a day can be added within the last week of testing on the day of the week that counts towards the streak.
 
@@ -143,6 +182,18 @@ def test_max_longest_streak(db, capsys):
     assert "Python with 14 days", "Swimming with 5 weeks" in captured.out
 
 
+def test_get_longest_streaks(db):
+    """Test that the single query in get_longest_streaks finds the same longest streak for each of the 5 predefined
+    habits as the calculations per habit.
+
+    parameters:
+        db: database connection fixture in conftest.py
+    """
+    assert get_longest_streaks(db) == [("Meditation", "Daily", 12), ("Python", "Daily", 14),
+                                       ("Morning walk", "Daily", 13), ("Swimming", "Weekly", 5),
+                                       ("Water plants", "Weekly", 4)]
+
+
 def test_monthly_habit_completion(db, capsys):
     """Test monthly habit check-offs by counting the number of dates in the database for each habit in a given
     month. (Function is set to count the number of dates in May 2024)
@@ -165,6 +216,872 @@ def test_monthly_habit_completion(db, capsys):
     assert "Python: 24" in captured.out
 
 
+def test_streak_state_updated_in_order(tmp_path):
+    """Test that check-offs arriving in order update the streak summary row, and that a check-off for an earlier date
+    removes it so the next lookup rebuilds it from the check-off history.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+    """
+    db = get_db(str(tmp_path / "state.db"))
+    add_habit(db, "Reading", "Read more.", "Daily", "2024-04-30")
+    habit_id = get_primary_key(db, "Reading")
+    add_habit_completion(db, habit_id, "2024-05-01 08:00")
+    assert get_streak_state(db, habit_id) is None
+
+    assert get_longest_streak(db, "Reading") == "1 days"
+    add_habit_completion(db, habit_id, "2024-05-02 08:00")
+    add_habit_completion(db, habit_id, "2024-05-03 08:00")
+    assert get_streak_state(db, habit_id) == (1, None, to_epoch_day(date(2024, 5, 3)), 3, 3)
+
+    add_habit_completion(db, habit_id, "2024-04-30 08:00")
+    assert get_streak_state(db, habit_id) is None
+    assert get_longest_streak(db, "Reading") == "4 days"
+
+
+def test_migrate_existing_database(tmp_path):
+    """Test that a database created with the original schema is upgraded in place.
+    The check-off dates are kept, the indexes are added and deleting a habit cascades to its check-off dates.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the old database file
+    """
+    path = tmp_path / "old.db"
+    old = sqlite3.connect(path)
+    old.execute("CREATE TABLE habit_metadata (habit_id INTEGER PRIMARY KEY, name TEXT, description TEXT, "
+                "frequency TEXT, start_date TEXT)")
+    old.execute("CREATE TABLE habit_completion_dates (tracker_id INTEGER PRIMARY KEY, completion_date TEXT, "
+                "habit_id INT, FOREIGN KEY (habit_id) REFERENCES habit_metadata(habit_id))")
+    old.execute("INSERT INTO habit_metadata VALUES (null, 'Reading', 'Read more.', 'Daily', '2024-05-01')")
+    old.execute("INSERT INTO habit_completion_dates VALUES (null, '2024-05-01 08:00', 1)")
+    old.commit()
+    old.close()
+
+    db = get_db(str(path))
+    assert get_schema_version(db) == len(MIGRATIONS)
+    indexes = [row[1] for row in db.execute("PRAGMA index_list(habit_completion_dates)")]
+    assert "idx_completion_habit_day" in indexes
+    assert db.execute("SELECT completion_date, completion_day FROM habit_completion_dates").fetchall() == [
+        ("2024-05-01 08:00", to_epoch_day(date(2024, 5, 1)))]
+
+    with pytest.raises(sqlite3.IntegrityError):
+        db.execute("INSERT INTO habit_metadata (name, description, frequency, start_date) "
+                   "VALUES ('Reading', 'Again.', 'Daily', '2024-05-01')")
+
+    delete_habit(db, "Reading")
+    assert db.execute("SELECT COUNT(*) FROM habit_completion_dates").fetchone()[0] == 0
+
+
+def test_migrate_concurrently(tmp_path):
+    """Test that several connections upgrading the same old database at the same time apply each migration once.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the old database file
+    """
+    path = tmp_path / "concurrent.db"
+    old = sqlite3.connect(path)
+    old.execute("CREATE TABLE habit_metadata (habit_id INTEGER PRIMARY KEY, name TEXT, description TEXT, "
+                "frequency TEXT, start_date TEXT)")
+    old.execute("CREATE TABLE habit_completion_dates (tracker_id INTEGER PRIMARY KEY, completion_date TEXT, "
+                "habit_id INT, FOREIGN KEY (habit_id) REFERENCES habit_metadata(habit_id))")
+    old.commit()
+    old.close()
+
+    barrier = threading.Barrier(4)
+    results = []
+
+    def upgrade():
+        connection = sqlite3.connect(path, timeout=30)
+        barrier.wait()
+        try:
+            results.append(migrate(connection))
+        except sqlite3.Error as error:
+            results.append(error)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=upgrade) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [len(MIGRATIONS)] * 4
+
+
+def test_get_db_waits_for_other_connection(tmp_path):
+    """Test that opening an old database that another connection is reading waits for it, and then switches the
+    file to WAL mode and upgrades it.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the old database file
+    """
+    path = str(tmp_path / "busy.db")
+    other = sqlite3.connect(path, check_same_thread=False)
+    other.execute("CREATE TABLE habit_metadata (habit_id INTEGER PRIMARY KEY, name TEXT, description TEXT, "
+                  "frequency TEXT, start_date TEXT)")
+    other.commit()
+    other.execute("BEGIN")
+    other.execute("SELECT * FROM habit_metadata").fetchall()
+    timer = threading.Timer(0.2, other.rollback)
+    timer.start()
+    try:
+        db = get_db(path)
+    finally:
+        timer.join()
+        other.close()
+    assert get_schema_version(db) == len(MIGRATIONS)
+    assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_migrate_duplicate_habit_names(tmp_path):
+    """Test that habits with the same name in a database with the original schema are merged into the first one, with
+    the check-off dates of all of them, instead of failing the upgrade.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the old database file
+    """
+    path = tmp_path / "duplicates.db"
+    old = sqlite3.connect(path)
+    old.execute("CREATE TABLE habit_metadata (habit_id INTEGER PRIMARY KEY, name TEXT, description TEXT, "
+                "frequency TEXT, start_date TEXT)")
+    old.execute("CREATE TABLE habit_completion_dates (tracker_id INTEGER PRIMARY KEY, completion_date TEXT, "
+                "habit_id INT, FOREIGN KEY (habit_id) REFERENCES habit_metadata(habit_id))")
+    for name in ("Reading", "Swimming", "Reading", "Swimming"):
+        old.execute("INSERT INTO habit_metadata VALUES (null, ?, 'Test habit.', 'Daily', '2024-05-01')", (name,))
+    old.executemany("INSERT INTO habit_completion_dates VALUES (null, ?, ?)",
+                    [("2024-05-01 08:00", 1), ("2024-05-02 08:00", 3), ("2024-05-03 08:00", 4)])
+    old.commit()
+    old.close()
+
+    db = get_db(str(path))
+    assert get_schema_version(db) == len(MIGRATIONS)
+    assert [habit[0] for habit in list_of_habits(db)] == ["Reading", "Swimming"]
+    assert len(get_day_list(db, get_primary_key(db, "Reading"))) == 2
+    assert len(get_day_list(db, get_primary_key(db, "Swimming"))) == 1
+
+
+def test_get_db_reuses_connection(tmp_path):
+    """Test that get_db hands out one cached connection per thread and database file, in WAL mode.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+    """
+    path = str(tmp_path / "pool.db")
+    db = get_db(path)
+    assert get_db(path) is db
+    assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    other_thread = []
+    thread = threading.Thread(target=lambda: other_thread.append(get_db(path)))
+    thread.start()
+    thread.join()
+    assert other_thread[0] is not db
+
+    close_db(path)
+    assert get_db(path) is not db
+
+
+def test_get_db_recreated_file(tmp_path):
+    """Test that a database file deleted and created again while the program runs gets its tables again.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+    """
+    path = str(tmp_path / "recreated.db")
+    add_habit(get_db(path), "Reading", "Read more.", "Daily", "2024-05-01")
+    close_db(path)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    db = get_db(path)
+    assert get_schema_version(db) == len(MIGRATIONS)
+    assert list_of_habits(db) == []
+
+
+def test_add_completion_dates_bulk(tmp_path, monkeypatch, habit1dates):
+    """Test that a batch of check-off dates is saved in one call, leaving out dates in the future or in the wrong
+    format.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+        monkeypatch: pytest fixture used to point the Habit class at the temporary database
+        habit1dates: fixture defined in the conftest.py file
+    """
+    monkeypatch.setattr(Habit, "Database", str(tmp_path / "bulk.db"))
+    habit = Habit(name="Reading", description="Read more.", frequency="Daily", start_date="2024-04-30")
+    habit.save_habit()
+
+    rows, rows_per_second = habit.add_completion_dates(habit1dates + ["2999-01-01 08:00", "not a date"])
+    assert rows == len(habit1dates)
+    assert rows_per_second > 0
+    count = habit.db.execute("SELECT COUNT(*) FROM habit_completion_dates WHERE habit_id = ?", (habit.habit_id,))
+    assert count.fetchone()[0] == len(habit1dates)
+
+
+def test_habit_metadata_cache(tmp_path):
+    """Test that get_habit_metadata returns the habit_id, frequency and start_date of a habit, that the cached
+    result is replaced after the habit is reset or deleted or changed by another connection, and that the results of
+    in-memory databases are not cached.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+    """
+    db = get_db(str(tmp_path / "metadata.db"))
+    assert get_habit_metadata(db, "Reading") is None
+    add_habit(db, "Reading", "Read more.", "Weekly", "2024-05-01")
+    habit_id = get_primary_key(db, "Reading")
+    assert get_habit_metadata(db, "Reading") == (habit_id, "Weekly", "2024-05-01")
+
+    reset_habit(db, "Reading", "2024-06-03")
+    assert get_habit_metadata(db, "Reading") == (habit_id, "Weekly", "2024-06-03")
+
+    delete_habit(db, "Reading")
+    assert get_habit_metadata(db, "Reading") is None
+
+    add_habit(db, "Reading", "Read more.", "Weekly", "2024-05-01")
+    habit_id = get_primary_key(db, "Reading")
+    assert get_habit_metadata(db, "Reading") == (habit_id, "Weekly", "2024-05-01")
+    other = sqlite3.connect(str(tmp_path / "metadata.db"))
+    other.execute("UPDATE habit_metadata SET frequency = 'Daily' WHERE habit_id = ?", (habit_id,))
+    other.commit()
+    other.close()
+    assert get_habit_metadata(db, "Reading") == (habit_id, "Daily", "2024-05-01")
+
+    for frequency in ("Daily", "Weekly"):
+        memory = get_db(":memory:")
+        add_habit(memory, "Reading", "Read more.", frequency, "2024-05-01")
+        assert get_habit_metadata(memory, "Reading")[1] == frequency
+        memory.close()
+
+
+def test_day_list_cache(tmp_path):
+    """Test that get_day_list reads the check-off history once, counts cache hits and misses, and reads it again
+    after a check-off is added.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+    """
+    db = get_db(str(tmp_path / "cache.db"))
+    add_habit(db, "Reading", "Read more.", "Daily", "2024-04-30")
+    habit_id = get_primary_key(db, "Reading")
+    add_habit_completion(db, habit_id, "2024-05-01 08:00")
+
+    day_list_cache.clear()
+    assert get_day_list(db, habit_id) == (to_epoch_day(date(2024, 5, 1)),)
+    assert get_day_list(db, habit_id) == (to_epoch_day(date(2024, 5, 1)),)
+    assert (day_list_cache.hits, day_list_cache.misses) == (1, 1)
+
+    add_habit_completion(db, habit_id, "2024-05-02 08:00")
+    assert get_day_list(db, habit_id) == (to_epoch_day(date(2024, 5, 2)), to_epoch_day(date(2024, 5, 1)))
+    assert (day_list_cache.hits, day_list_cache.misses) == (1, 2)
+
+
+def test_day_list_cache_write_during_read(tmp_path, monkeypatch):
+    """Test that a day list read while another thread saves a check-off of the habit is not cached.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+        monkeypatch: pytest fixture used to run the write between the read and the cache update
+    """
+    path = str(tmp_path / "cache_race.db")
+    db = get_db(path)
+    add_habit(db, "Reading", "Read more.", "Daily", "2024-04-30")
+    habit_id = get_primary_key(db, "Reading")
+    add_habit_completion(db, habit_id, "2024-05-01 08:00")
+    day_list_cache.clear()
+
+    put = day_list_cache.put
+
+    def put_after_write(key, value, generation=None):
+        writer = threading.Thread(target=lambda: add_habit_completion(get_db(path), habit_id, "2024-05-02 08:00"))
+        writer.start()
+        writer.join()
+        put(key, value, generation)
+
+    monkeypatch.setattr(day_list_cache, "put", put_after_write)
+    assert get_day_list(db, habit_id) == (to_epoch_day(date(2024, 5, 1)),)
+    monkeypatch.undo()
+    assert get_day_list(db, habit_id) == (to_epoch_day(date(2024, 5, 2)), to_epoch_day(date(2024, 5, 1)))
+
+
+def test_day_list_cache_other_connections(tmp_path):
+    """Test that check-offs committed by another connection to the database file are read again, and that the day
+    lists of in-memory databases are not cached.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+    """
+    path = str(tmp_path / "cache_shared.db")
+    db = get_db(path)
+    add_habit(db, "Reading", "Read more.", "Daily", "2024-04-30")
+    habit_id = get_primary_key(db, "Reading")
+    add_habit_completion(db, habit_id, "2024-05-01 08:00")
+    assert get_day_list(db, habit_id) == (to_epoch_day(date(2024, 5, 1)),)
+
+    other = sqlite3.connect(path)
+    other.execute("""INSERT INTO habit_completion_dates (completion_date, habit_id, completion_day)
+                     VALUES (?, ?, ?)""", ("2024-05-02 08:00", habit_id, to_epoch_day(date(2024, 5, 2))))
+    other.commit()
+    other.close()
+    assert get_day_list(db, habit_id) == (to_epoch_day(date(2024, 5, 2)), to_epoch_day(date(2024, 5, 1)))
+
+    for day in (date(2024, 5, 3), date(2024, 5, 4)):
+        memory = get_db(":memory:")
+        add_habit(memory, "Reading", "Read more.", "Daily", "2024-04-30")
+        memory_habit_id = get_primary_key(memory, "Reading")
+        add_habit_completion(memory, memory_habit_id, f"{day.isoformat()} 08:00")
+        assert get_day_list(memory, memory_habit_id) == (to_epoch_day(day),)
+        memory.close()
+
+
+def test_day_list_cache_bounded_generations():
+    """Test that the generation counters of LRUCache stay bounded when many keys are removed, and that a value read
+    before its key was removed is still not cached."""
+    cache = db_module.LRUCache(maxsize=2)
+    generation = cache.generation(("main.db", 0))
+    for habit_id in range(100):
+        cache.pop(("main.db", habit_id))
+    assert len(cache._generations) <= 8
+    cache.put(("main.db", 0), (1,), generation)
+    assert cache.get(("main.db", 0)) is None
+
+
+def test_iter_completion_dates(db, habit4):
+    """Test that iter_completion_dates streams the check-off dates of a habit in SQL-sorted order within the given
+    range.
+
+    parameters:
+        fixtures that are defined in the conftest.py file
+    """
+    habit_id = get_primary_key(db, habit4.name)
+    dates = iter_completion_dates(db, habit_id, since=date(2024, 5, 15), until=date(2024, 5, 22), order="asc")
+    assert list(dates) == [date(2024, 5, 15), date(2024, 5, 21), date(2024, 5, 22)]
+    assert next(iter_completion_dates(db, habit_id)) == date(2024, 5, 29)
+    with pytest.raises(ValueError):
+        next(iter_completion_dates(db, habit_id, order="newest"))
+
+
+def test_habits_are_scoped_per_user(tmp_path):
+    """Test that two users can have a habit with the same name, and that the lists and analyses of one user do not
+    include the habits of the other.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+    """
+    db = get_db(str(tmp_path / "users.db"))
+    other_user = add_user(db, "Alex")
+    assert get_user_id(db, "Alex") == other_user
+    add_habit(db, "Reading", "Read more.", "Daily", "2024-04-30")
+    add_habit(db, "Reading", "Read more.", "Daily", "2024-04-30", other_user)
+    add_habit(db, "Cycling", "Improve cardio fitness.", "Weekly", "2024-05-01", other_user)
+    for check_off in ("2024-05-01 08:00", "2024-05-02 08:00"):
+        add_habit_completion(db, get_primary_key(db, "Reading", other_user), check_off)
+
+    assert list_of_habits(db) == [("Reading",)]
+    assert list_of_habits(db, other_user) == [("Reading",), ("Cycling",)]
+    assert get_longest_streak(db, "Reading") == "0 days"
+    assert get_longest_streak(db, "Reading", other_user) == "2 days"
+    assert get_longest_streaks(db, other_user) == [("Reading", "Daily", 2), ("Cycling", "Weekly", 0)]
+
+
+def test_monthly_completion_counts(tmp_path):
+    """Test that monthly_completion_counts returns each habit with its frequency and number of check-off events in the
+    month, leaving out check-offs in the same month more than a year ago.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+    """
+    db = get_db(str(tmp_path / "monthly.db"))
+    today = date.today()
+    add_habit(db, "Reading", "Read more.", "Daily", "2020-01-01")
+    add_habit(db, "Cycling", "Improve cardio fitness.", "Weekly", "2020-01-01")
+    reading_id = get_primary_key(db, "Reading")
+    for check_off in (today, today, date(today.year - 2, today.month, 1)):
+        add_habit_completion(db, reading_id, f"{check_off.isoformat()} 08:00")
+
+    assert monthly_completion_counts(db, today.month) == [("Cycling", "Weekly", 0), ("Reading", "Daily", 2)]
+
+
+def test_current_streak_spanning_several_windows(tmp_path):
+    """Test that the current streak calculations count a streak that is longer than the first window read backwards
+    and stop at the first break, leaving the older check-offs out.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+    """
+    db = get_db(str(tmp_path / "windows.db"))
+    today = to_epoch_day(date.today())
+    add_habit(db, "Reading", "Read more.", "Daily", "2020-01-01")
+    add_habit(db, "Cycling", "Improve cardio fitness.", "Weekly", from_epoch_day(today - 700).isoformat())
+    daily = [today - day for day in range(150)] + [today - day for day in range(152, 400)]
+    weekly = [today - 7 * week for week in range(40)] + [today - 7 * week for week in range(42, 90)]
+    for name, days in (("Reading", daily), ("Cycling", weekly)):
+        add_habit_completions_bulk(db, get_primary_key(db, name),
+                                   [f"{from_epoch_day(day).isoformat()} 08:00" for day in sorted(days)])
+
+    assert calculate_current_streak(db, "Reading") == 150
+    assert calculate_current_streak_weekly(db, "Cycling", from_epoch_day(today - 700).isoformat()) == 40
+
+
+def test_async_tracker_batches_check_offs(tmp_path):
+    """Test that concurrent check-offs through AsyncHabitTracker are saved in shared transactions, that a check-off of
+    a habit that does not exist fails on its own, and that the reads see the saved check-offs.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+    """
+    path = str(tmp_path / "async.db")
+    today = date.today().isoformat()
+
+    async def run():
+        async with AsyncHabitTracker(path, readers=2) as tracker:
+            await tracker.add_habit("Reading", "Read more.", "Daily", "2020-01-01")
+            habit_id = get_primary_key(get_db(path), "Reading")
+            results = await asyncio.gather(*(tracker.add_habit_completion(habit_id, f"{today} 08:{minute:02d}")
+                                             for minute in range(20)),
+                                           tracker.add_habit_completion(habit_id + 1, f"{today} 09:00"),
+                                           return_exceptions=True)
+            assert results[:20] == [None] * 20
+            assert isinstance(results[20], sqlite3.IntegrityError)
+            assert tracker.batches < 21
+            assert len(await tracker.get_date_list(habit_id)) == 20
+            assert await tracker.get_current_streak("Reading") == "1 days"
+            assert await tracker.monthly_habit_completion(date.today().month) == [("Reading", "Daily", 20)]
+
+    asyncio.run(run())
+
+
+def test_write_queue_group_commit(tmp_path):
+    """Test that the write-behind queue saves queued check-offs in group commits on flush and close, reports its
+    metrics, and that in the full durability mode a check-off that cannot be saved raises in put.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+    """
+    path = str(tmp_path / "queue.db")
+    db = get_db(path)
+    add_habit(db, "Reading", "Read more.", "Daily", "2020-01-01")
+    habit_id = get_primary_key(db, "Reading")
+
+    queue = CheckOffQueue(path, interval=60, max_rows=1000)
+    for day in range(1, 11):
+        queue.put(habit_id, f"2024-05-{day:02d} 08:00")
+    assert queue.metrics()["depth"] == 10
+    assert get_day_list(db, habit_id) == ()
+    queue.flush()
+    assert len(get_day_list(db, habit_id)) == 10
+    queue.put(habit_id, "2024-05-11 08:00")
+    queue.close()
+    metrics = queue.metrics()
+    assert (metrics["depth"], metrics["max_depth"], metrics["flushes"], metrics["rows_written"]) == (0, 10, 2, 11)
+    assert len(get_day_list(db, habit_id)) == 11
+    with pytest.raises(RuntimeError):
+        queue.put(habit_id)
+
+    queue = CheckOffQueue(path, interval=0, durability="full")
+    with pytest.raises(sqlite3.IntegrityError):
+        queue.put(habit_id + 1, "2024-05-12 08:00")
+    queue.close()
+    assert queue.metrics()["failed"] == 1
+    with pytest.raises(ValueError):
+        CheckOffQueue(path, durability="fast")
+
+
+def test_write_queue_writer_error(tmp_path, monkeypatch):
+    """Test that put and flush raise the error the writer thread of the queue stopped with instead of waiting for it.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+        monkeypatch: pytest fixture used to make the writer thread fail
+    """
+    path = str(tmp_path / "queue_error.db")
+    db = get_db(path)
+    add_habit(db, "Reading", "Read more.", "Daily", "2020-01-01")
+    habit_id = get_primary_key(db, "Reading")
+
+    def fail(queue, writer_db, batch):
+        raise OSError("writer failed")
+
+    monkeypatch.setattr(CheckOffQueue, "_write", fail)
+    queue = CheckOffQueue(path, interval=0, durability="full")
+    with pytest.raises(OSError):
+        queue.put(habit_id, "2024-05-01 08:00")
+    with pytest.raises(OSError):
+        queue.put(habit_id, "2024-05-02 08:00")
+    queue.close()
+
+    queue = CheckOffQueue(path, interval=0)
+    queue.put(habit_id, "2024-05-03 08:00")
+    with pytest.raises(OSError):
+        queue.flush()
+    queue.close()
+    assert get_day_list(db, habit_id) == ()
+
+
+def test_parallel_analysis_matches_serial(db):
+    """Test that the parallel mode of the all-habits analyses, with a process pool and read-only connections, gives
+    the same results as the serial functions.
+
+    parameters:
+        fixtures that are defined in the conftest.py file
+    """
+    assert longest_streak_maxima(db, workers=2) == longest_streak_maxima(db)
+    for month in (4, 5, 6):
+        assert monthly_completion_counts(db, month, workers=2) == monthly_completion_counts(db, month)
+
+
+def test_habit_load_all(tmp_path):
+    """Test that Habit.load_all builds every habit of a user from one query with its habit_id and the injected
+    connection, and that a Habit has no instance dictionary and no connection until it needs one.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+    """
+    db = get_db(str(tmp_path / "load.db"))
+    for number in range(50):
+        add_habit(db, f"Habit {number}", "Benchmark habit.", "Daily" if number % 2 else "Weekly", "2024-05-01")
+
+    habits = Habit.load_all(db)
+    assert [habit.name for habit in habits] == [f"Habit {number}" for number in range(50)]
+    assert [habit.habit_id for habit in habits] == [get_primary_key(db, habit.name) for habit in habits]
+    assert all(habit.db is db for habit in habits)
+    assert habits[1].frequency == "Daily" and habits[1].start_date == "2024-05-01"
+
+    habit = Habit("Reading")
+    assert not hasattr(habit, "__dict__")
+    assert habit._db is None
+    assert habit.db is get_db(Habit.Database)
+
+
+def test_check_off_store_matches_database(db):
+    """Test that CheckOffStore keeps the check-off days of every habit in one array with an offset per habit, and
+    that the analysis functions give the same results on the store as on the database.
+
+    parameters:
+        fixtures that are defined in the conftest.py file
+    """
+    store = CheckOffStore.load(db)
+    assert store.days.format == "i" and len(store.offsets) == len(store.habit_ids) + 1
+    assert store.nbytes < 8 * (len(store.days) + len(store.habit_ids) + 1)
+
+    for name in ("Meditation", "Python", "Morning walk", "Swimming", "Water plants"):
+        habit_id = get_primary_key(db, name)
+        assert list(store.get_day_list(habit_id)) == list(get_day_list(db, habit_id))
+        assert get_longest_streak(store, name) == get_longest_streak(db, name)
+        assert get_current_streak(store, name) == get_current_streak(db, name)
+    assert longest_streak_maxima(store) == longest_streak_maxima(db)
+    for month in (4, 5, 6):
+        assert monthly_completion_counts(store, month) == monthly_completion_counts(db, month)
+
+
+def test_snapshot_round_trip(db, tmp_path):
+    """Test that a snapshot written by export_snapshot is loaded with memoryviews of the mapped file, gives the same
+    analysis results as the database, and that a file that is not a snapshot is refused.
+
+    parameters:
+        db: database connection fixture in conftest.py
+        tmp_path: pytest fixture with a temporary directory for the snapshot file
+    """
+    path = str(tmp_path / "habits.snapshot")
+    store = export_snapshot(db, path)
+    snapshot = load_snapshot(path)
+    assert read_header(path)["version"] == SNAPSHOT_VERSION
+    assert read_header(path)["check_offs"] == len(store.days)
+    assert isinstance(snapshot.days, memoryview) and snapshot.days.readonly
+    assert list(snapshot.days) == list(store.days) and snapshot.names == store.names
+
+    for name in ("Meditation", "Swimming"):
+        assert get_longest_streak(snapshot, name) == get_longest_streak(db, name)
+        assert get_current_streak(snapshot, name) == get_current_streak(db, name)
+    assert longest_streak_maxima(snapshot) == longest_streak_maxima(db)
+    assert monthly_completion_counts(snapshot, 5) == monthly_completion_counts(db, 5)
+
+    (tmp_path / "other.snapshot").write_bytes(b"not a snapshot" * 10)
+    with pytest.raises(ValueError):
+        load_snapshot(str(tmp_path / "other.snapshot"))
+
+
+def test_instrumentation(tmp_path):
+    """Test that the instrumentation records the calls, rows and SQL statements of the database and analysis
+    functions only while it is switched on, and that disable puts the original functions back.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+    """
+    original = analyse.get_day_list
+    instrument.reset()
+    instrument.enable()
+    try:
+        db = get_db(str(tmp_path / "profile.db"))
+        add_habit(db, "Reading", "Read more.", "Daily", "2024-05-01")
+        habit_id = get_primary_key(db, "Reading")
+        add_habit_completions_bulk(db, habit_id, ["2024-05-01 08:00", "2024-05-02 08:00"])
+        assert analyse.calculate_longest_streak(db, "Reading") == 2
+    finally:
+        instrument.disable()
+    assert analyse.get_day_list is original and db_module.get_day_list is original
+
+    stats = instrument.summary()
+    assert stats["functions"]["analyse.calculate_longest_streak"]["calls"] == 1
+    # The rows read from the database: the check-offs or the habit plus the row of PRAGMA data_version.
+    assert stats["functions"]["db.get_day_list"]["rows"] == 2 + 1
+    assert stats["functions"]["db.get_habit_metadata"]["rows"] == 1 + 1
+    assert any(statement.startswith("SELECT completion_day FROM habit_completion_dates WHERE habit_id = ?")
+               for statement in stats["statements"])
+    analyse.calculate_longest_streak(db, "Reading")
+    assert instrument.summary()["functions"]["analyse.calculate_longest_streak"]["calls"] == 1
+    instrument.reset()
+
+
+def test_command_mode(tmp_path, capsys):
+    """Test the non-interactive commands of main.py and that they do not need questionary.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+        capsys: CaptureFixture which captures the text output of the commands
+    """
+    path = str(tmp_path / "commands.db")
+    database = Habit.Database
+    try:
+        add_habit(get_db(path), "Reading", "Read more.", "Daily", "2024-05-01")
+        assert main.main(["--database", path, "checkoff", "reading"]) == 0
+        assert main.main(["--database", path, "checkoff", "Reading", "--date", "2024-04-01"]) == 1
+        assert main.main(["--database", path, "checkoff", "Cycling"]) == 1
+        assert main.main(["--database", path, "list", "--frequency", "daily"]) == 0
+        assert main.main(["--database", path, "streak", "Reading"]) == 0
+        assert main.main(["--database", path, "top"]) == 0
+    finally:
+        Habit.Database = database
+    output = capsys.readouterr().out
+    assert "Reading has been checked off." in output
+    assert "Reading has not started yet." in output and "There is no habit called Cycling." in output
+    assert "Reading has a longest streak of 1 days and a current streak of 1 days." in output
+    assert "Daily Habit with Longest Streak: Reading with 1 days." in output
+
+
+def test_check_off_all_due(tmp_path, capsys):
+    """Test that checkoff --all-due checks off the started daily habits and the weekly habits due on the day in one
+    action, and that a second run finds nothing left to check off.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+        capsys: CaptureFixture which captures the text output of the commands
+    """
+    path = str(tmp_path / "due.db")
+    db = get_db(path)
+    add_habit(db, "Reading", "Read more.", "Daily", "2024-05-01")
+    add_habit(db, "Swimming", "Improve cardio fitness.", "Weekly", "2024-05-01")
+    add_habit(db, "Cycling", "Improve cardio fitness.", "Weekly", "2024-05-02")
+    add_habit(db, "Painting", "Be creative.", "Daily", "2024-06-01")
+    database = Habit.Database
+    try:
+        assert main.main(["--database", path, "checkoff", "--all-due", "--date", "2024-05-15"]) == 0
+        assert main.main(["--database", path, "checkoff", "--all-due", "--date", "2024-05-15"]) == 0
+    finally:
+        Habit.Database = database
+    output = capsys.readouterr().out
+    assert "Reading has been checked off.\nSwimming has been checked off.\nThere are no habits to check off." in output
+    check_offs = [len(get_day_list(db, get_primary_key(db, name))) for name in ("Reading", "Swimming", "Cycling")]
+    assert check_offs == [1, 1, 0]
+
+    checked, not_started, unknown = main.check_off_habits(db, ["Cycling", "Painting", "Running"], date(2024, 5, 16))
+    assert checked == [("Cycling", "Weekly", "2024-05-02")]
+    assert not_started == [("Painting", "2024-06-01")] and unknown == ["Running"]
+
+
+def test_check_off_repeated_names(tmp_path):
+    """Test that a habit named twice, or named and also due with --all-due, is checked off once.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+    """
+    path = str(tmp_path / "repeated.db")
+    db = get_db(path)
+    add_habit(db, "Reading", "Read more.", "Daily", "2024-05-01")
+    add_habit(db, "Swimming", "Improve cardio fitness.", "Weekly", "2024-05-01")
+    database = Habit.Database
+    try:
+        assert main.main(["--database", path, "checkoff", "Reading", "reading", "--date", "2024-05-10"]) == 0
+        assert main.main(["--database", path, "checkoff", "reading", "Reading", "--all-due",
+                          "--date", "2024-05-15"]) == 0
+    finally:
+        Habit.Database = database
+    assert list(get_day_list(db, get_primary_key(db, "Reading"))) == [to_epoch_day(date(2024, 5, 15)),
+                                                                      to_epoch_day(date(2024, 5, 10))]
+    assert len(get_day_list(db, get_primary_key(db, "Swimming"))) == 1
+
+    checked, _, _ = main.check_off_habits(db, ["Swimming", "Swimming"], date(2024, 5, 22))
+    assert checked == [("Swimming", "Weekly", "2024-05-01")]
+    assert len(get_day_list(db, get_primary_key(db, "Swimming"))) == 2
+
+
+def test_habits_due(tmp_path, capsys):
+    """Test that habits_due finds the started daily habits and the weekly habits that start on the same day of the
+    week, with their most recent check-off, and that resetting a habit moves the day a weekly habit is due.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+        capsys: CaptureFixture which captures the text output of the due command
+    """
+    path = str(tmp_path / "due_today.db")
+    db = get_db(path)
+    add_habit(db, "Reading", "Read more.", "Daily", "2024-05-01")
+    add_habit(db, "Swimming", "Improve cardio fitness.", "Weekly", "2024-05-01")
+    add_habit(db, "Cycling", "Improve cardio fitness.", "Weekly", "2024-05-02")
+    add_habit(db, "Painting", "Be creative.", "Daily", "2024-06-01")
+    add_habit_completion(db, get_primary_key(db, "Reading"), "2024-05-14 08:00")
+    add_habit_completion(db, get_primary_key(db, "Swimming"), "2024-05-15 08:00")
+
+    assert habits_due(db, date(2024, 5, 15)) == [("Reading", "Daily", date(2024, 5, 14))]
+    assert habits_due(db, date(2024, 5, 14)) == []
+    assert habits_due(db, date(2024, 5, 16)) == [("Reading", "Daily", date(2024, 5, 14)), ("Cycling", "Weekly", None)]
+
+    reset_habit(db, "Cycling", "2024-05-08")
+    assert habits_due(db, date(2024, 5, 15)) == [("Reading", "Daily", date(2024, 5, 14)), ("Cycling", "Weekly", None)]
+
+    database = Habit.Database
+    try:
+        assert main.main(["--database", path, "due", "--date", "2024-05-16"]) == 0
+    finally:
+        Habit.Database = database
+    assert capsys.readouterr().out == "Reading (Daily), last checked off on 2024-05-14.\n"
+
+
+def test_idempotent_check_offs(tmp_path):
+    """Test that a retried check-off with the same idempotency key is saved once, that compaction removes repeated
+    check-offs on one day without changing the streak, and that with unique check-offs a habit is checked off once
+    a day.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+    """
+    db = get_db(str(tmp_path / "unique.db"))
+    add_habit(db, "Reading", "Read more.", "Daily", "2024-05-01")
+    habit_id = get_primary_key(db, "Reading")
+    assert add_habit_completion(db, habit_id, "2024-05-01 08:00", idempotency_key="request-1")
+    assert not add_habit_completion(db, habit_id, "2024-05-01 08:00", idempotency_key="request-1")
+    assert add_completions_batch(db, [(habit_id, "2024-05-02 08:00", "request-2"),
+                                      (habit_id, "2024-05-02 08:00", "request-2")]) == [None, None]
+    add_habit_completions_bulk(db, habit_id, ["2024-05-01 20:00", "2024-05-02 20:00", "2024-05-03 08:00"])
+    assert len(get_day_list(db, habit_id)) == 5
+    assert get_longest_streak(db, "Reading") == "3 days"
+
+    assert not unique_check_offs(db)
+    assert compact_check_offs(db) == 2
+    assert list(get_day_list(db, habit_id)) == [to_epoch_day(date(2024, 5, day)) for day in (3, 2, 1)]
+    assert get_longest_streak(db, "Reading") == "3 days"
+
+    assert set_unique_check_offs(db) == 0 and unique_check_offs(db)
+    assert not add_habit_completion(db, habit_id, "2024-05-03 20:00")
+    assert add_habit_completions_bulk(db, habit_id, ["2024-05-03 21:00", "2024-05-04 08:00"])[0] == 1
+    assert len(get_day_list(db, habit_id)) == 4
+    assert get_longest_streak(db, "Reading") == "4 days"
+
+
+def test_retried_check_off_keeps_streak(tmp_path):
+    """Test that a check-off retried with the same idempotency key on a later day is left out of the streak summary
+    as well as the history.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+    """
+    db = get_db(str(tmp_path / "retry.db"))
+    add_habit(db, "Reading", "Read more.", "Daily", "2024-05-01")
+    habit_id = get_primary_key(db, "Reading")
+    add_completions_batch(db, [(habit_id, "2024-05-01 23:59", "request-1")])
+    assert get_longest_streak(db, "Reading") == "1 days"
+
+    assert add_completions_batch(db, [(habit_id, "2024-05-02 00:01", "request-1")]) == [None]
+    assert not add_habit_completion(db, habit_id, "2024-05-03 00:01", idempotency_key="request-1")
+    assert len(get_day_list(db, habit_id)) == 1
+    assert get_longest_streak(db, "Reading") == "1 days"
+    assert get_longest_streaks(db)[0][2] == 1
+
+
+def test_streak_state_rebuild(tmp_path):
+    """Test that the streak summary is rebuilt from the check-off table rather than a stale day_list_cache entry, and
+    that a read-only connection calculates the streaks without saving the summary.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+    """
+    path = str(tmp_path / "rebuild.db")
+    db = get_db(path)
+    add_habit(db, "Reading", "Read more.", "Daily", "2024-05-01")
+    habit_id = get_primary_key(db, "Reading")
+    add_habit_completions_bulk(db, habit_id, ["2024-05-01 08:00", "2024-05-02 08:00", "2024-05-03 08:00"])
+
+    day_list_cache.put((path, habit_id), (to_epoch_day(date(2024, 5, 1)),))
+    assert get_longest_streak(db, "Reading") == "3 days"
+    assert get_streak_state(db, habit_id)[-1] == 3
+
+    with db:
+        db.execute("DELETE FROM habit_streak_state")
+    read_only = connect_read_only(path)
+    try:
+        assert get_longest_streak(read_only, "Reading") == "3 days"
+        assert get_current_streak(read_only, "Reading") is not None
+    finally:
+        read_only.close()
+    assert get_streak_state(db, habit_id) is None
+
+
+def test_write_in_open_transaction(tmp_path):
+    """Test that rebuilding the streak summary and switching unique check-offs on do not commit a transaction the
+    caller has open.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+    """
+    path = str(tmp_path / "transaction.db")
+    db = get_db(path)
+    add_habit(db, "Reading", "Read more.", "Daily", "2024-05-01")
+    habit_id = get_primary_key(db, "Reading")
+    add_habit_completions_bulk(db, habit_id, ["2024-05-01 08:00", "2024-05-02 08:00"])
+    with db:
+        db.execute("DELETE FROM habit_streak_state")
+
+    db.execute("UPDATE habit_metadata SET description = 'Read every day.' WHERE habit_id = ?", (habit_id,))
+    assert get_longest_streak(db, "Reading") == "2 days"
+    assert set_unique_check_offs(db) == 0
+    assert db.in_transaction
+    db.rollback()
+    assert db.execute("SELECT description FROM habit_metadata").fetchone()[0] == "Read more."
+    assert get_streak_state(db, habit_id) is None and not unique_check_offs(db)
+
+
+def test_unique_check_offs_concurrent_insert(tmp_path, monkeypatch):
+    """Test that a check-off saved by another connection while unique check-offs are switched on waits for the switch,
+    instead of adding a repeated check-off that breaks the unique index.
+
+    parameters:
+        tmp_path: pytest fixture with a temporary directory for the database file
+        monkeypatch: pytest fixture used to start the other writer between the compaction and the index rebuild
+    """
+    path = str(tmp_path / "unique_race.db")
+    db = get_db(path)
+    add_habit(db, "Reading", "Read more.", "Daily", "2024-05-01")
+    habit_id = get_primary_key(db, "Reading")
+    add_habit_completions_bulk(db, habit_id, ["2024-05-01 08:00", "2024-05-01 20:00"])
+
+    writers = []
+    remove = db_module._remove_repeated_check_offs
+
+    def remove_then_write(cur):
+        result = remove(cur)
+        writer = threading.Thread(target=lambda: add_habit_completion(get_db(path), habit_id, "2024-05-01 22:00"))
+        writer.start()
+        writers.append(writer)
+        return result
+
+    monkeypatch.setattr(db_module, "_remove_repeated_check_offs", remove_then_write)
+    assert set_unique_check_offs(db) == 1
+    writers[0].join()
+    assert unique_check_offs(db)
+    assert len(get_day_list(db, habit_id)) == 1
+
+
 @pytest.mark.skip(reason="Comment out if you would like to run Pytest more than once to delete ALL data after running.")
 # This test is skipped so the user can use the test.db file to run the main.py CLI program to see full functionality.
 def test_habit_deletion(db, habit1, habit2, habit3, habit4, habit5):
@@ -0,0 +1,207 @@
+"""This module contains the optional write-behind queue for check-offs.
+
+Without the queue every check-off is its own transaction and commit (see db.add_habit_completion). With the queue,
+check-offs are kept in memory and a background writer thread saves them together in one transaction
+(see db.add_completions_batch) when the oldest one has waited `interval` seconds or `max_rows` are waiting:
+
+    queue = CheckOffQueue("main.db", interval=0.05, max_rows=500, durability="normal")
+    queue.put(habit_id)
+    ...
+    queue.close()
+
+Check-offs that are still in the queue are not visible to queries yet. Call flush() before reading them, and close()
+before the program ends; close() is also registered with atexit, so the queue is written on a normal interpreter exit.
+"""
+
+import atexit
+import threading
+import time
+from datetime import datetime
+from db import get_db, close_db, add_completions_batch
+
+
+# Durability modes and the synchronous setting of the writer connection for each of them.
+#   off:    fastest, a power loss can undo flushes that were already reported as written.
+#   normal: a flush survives a crash of the program once it is written (WAL with synchronous NORMAL).
+#   full:   every flush is synced to disk, and put() waits until its check-off is written.
+DURABILITY_MODES = {"off": "OFF", "normal": "NORMAL", "full": "FULL"}
+
+
+class CheckOffQueue:
+    """In-memory buffer of check-offs that a background thread writes to the database in group commits.
+
+    attributes:
+        database(str): Name of the database file.
+        interval(float): Seconds the oldest check-off waits before the buffer is written.
+        max_rows(int): Number of waiting check-offs that triggers a write right away, and the largest transaction.
+        durability(str): One of DURABILITY_MODES.
+    """
+
+    def __init__(self, database="main.db", interval=0.05, max_rows=500, durability="normal"):
+        """
+        Initialize the queue and start its writer thread.
+
+        parameters:
+           database(str): Name of the database file. Default is main.db.
+           interval(float): Seconds the oldest check-off waits before the buffer is written. Default is 0.05.
+           max_rows(int): Number of waiting check-offs that triggers a write. Default is 500.
+           durability(str): off, normal or full (see DURABILITY_MODES). Default is normal.
+        """
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Durability must be one of {', '.join(DURABILITY_MODES)}.")
+        self.database = database
+        self.interval = interval
+        self.max_rows = max_rows
+        self.durability = durability
+
+        self._buffer = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._flush_requested = False
+        self._queued = 0
+        self._written = 0
+        self._errors = {}
+        self._stopped = False
+        self._writer_error = None
+
+        self._max_depth = 0
+        self._flushes = 0
+        self._rows_written = 0
+        self._failed = 0
+        self._last_latency = 0.0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="habit-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, habit_id, completion_date=None, idempotency_key=None):
+        """Queue a check-off of a habit.
+
+        In the off and normal modes this returns right away. In the full mode it waits until the check-off is written
+        and raises the error if it could not be saved. If the writer thread has stopped because of an error, that
+        error is raised instead (see _check_writer).
+
+        parameters:
+           habit_id(int): Primary key of the habit.
+           completion_date(str): Date the habit was completed (YYYY-MM-DD HH:MM). Default is the current date.
+           idempotency_key(str): Key of the client request. A retry with the same key is not saved again.
+        """
+        if completion_date is None:
+            completion_date = datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M")
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The check-off queue is closed.")
+            self._check_writer()
+            self._queued += 1
+            number = self._queued
+            self._buffer.append((number, habit_id, completion_date, idempotency_key))
+            self._max_depth = max(self._max_depth, len(self._buffer))
+            if len(self._buffer) == 1 or len(self._buffer) >= self.max_rows:
+                self._condition.notify_all()
+            if self.durability == "full":
+                while self._written < number and not self._stopped:
+                    self._condition.wait()
+                if self._written < number:
+                    self._check_writer()
+                error = self._errors.pop(number, None)
+                if error is not None:
+                    raise error
+
+    def flush(self):
+        """Write the queued check-offs now and wait until they are written.
+        If the writer thread stopped before they were written, its error is raised (see _check_writer)."""
+        with self._condition:
+            target = self._queued
+            self._flush_requested = True
+            self._condition.notify_all()
+            while self._written < target and not self._stopped:
+                self._condition.wait()
+            if self._written < target:
+                self._check_writer()
+
+    def close(self):
+        """Write the queued check-offs, stop the writer thread and close its connection.
+        Calling close again does nothing."""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        atexit.unregister(self.close)
+
+    def metrics(self):
+        """Return the queue depth and flush statistics as a dictionary.
+
+        returns:
+           dict: depth (check-offs waiting now), max_depth, flushes, rows_written, failed (rows that could not be
+           saved) and the last, mean and max flush latency in seconds.
+        """
+        with self._condition:
+            return {"depth": len(self._buffer), "max_depth": self._max_depth, "flushes": self._flushes,
+                    "rows_written": self._rows_written, "failed": self._failed,
+                    "last_flush_latency": self._last_latency,
+                    "mean_flush_latency": self._total_latency / self._flushes if self._flushes else 0.0,
+                    "max_flush_latency": self._max_latency}
+
+    def _check_writer(self):
+        """Raise the error the writer thread stopped with, if it has stopped. Called with the condition held."""
+        if self._stopped:
+            raise self._writer_error or RuntimeError("The check-off queue writer has stopped.")
+
+    def _run(self):
+        """Writer thread: wait for check-offs, write them in batches and close the connection when the queue closes.
+        If it stops because of an error, the error is kept for the callers waiting in put and flush."""
+        try:
+            db = get_db(self.database)
+            db.execute(f"PRAGMA synchronous = {DURABILITY_MODES[self.durability]}")
+            while True:
+                with self._condition:
+                    while not self._buffer and not self._closed:
+                        self._condition.wait()
+                    deadline = time.monotonic() + self.interval
+                    while len(self._buffer) < self.max_rows and not self._closed and not self._flush_requested:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    batch = self._buffer[:self.max_rows]
+                    del self._buffer[:self.max_rows]
+                    if not self._buffer:
+                        self._flush_requested = False
+                    if not batch and self._closed:
+                        break
+                self._write(db, batch)
+        except Exception as error:
+            self._writer_error = error
+        finally:
+            close_db(self.database)
+            with self._condition:
+                self._stopped = True
+                self._condition.notify_all()
+
+    def _write(self, db, batch):
+        """Save a batch of queued check-offs in one transaction and update the metrics."""
+        start = time.perf_counter()
+        try:
+            results = add_completions_batch(db, [row[1:] for row in batch])
+        except Exception as error:
+            results = [error] * len(batch)
+        latency = time.perf_counter() - start
+
+        with self._condition:
+            self._flushes += 1
+            self._last_latency = latency
+            self._total_latency += latency
+            self._max_latency = max(self._max_latency, latency)
+            for (number, *_), error in zip(batch, results):
+                if error is None:
+                    self._rows_written += 1
+                else:
+                    self._failed += 1
+                    if self.durability == "full":
+                        self._errors[number] = error
+            self._written = batch[-1][0]
+            self._condition.notify_all()